@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Copyright (C) 2010 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""Benchmark the throughput of the XML indexer.
+
+Generates a synthetic XML file of the requested size (in the same format as
+examples/books.xml), then indexes it with each of the requested numbers of
+worker processes, reporting documents and megabytes per second and the peak
+memory use of the main process.
+
+Usage:
+
+    $ python xml_indexing.py [<size in MB> [<workers> ...]]
+
+The defaults are a 2048MB file, indexed with 1, 2 and 4 workers.  The file
+and databases are created in a temporary directory, which needs room for the
+file plus roughly twice its size again.
+
+"""
+
+import os, os.path
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'xml_indexer'))
+import xml_indexer
+
+ACTIONS = """\
+.//metadata[@name='ETextNo']/@value
+    etextno: filter(docid)
+
+.//metadata[@name='Title']/@value
+    title: index(default)
+
+.//metadata[@name='Author']/@value
+    author: filter(facet)
+
+.//metadata[@name='Year']/@value
+    published: numeric
+
+.//sample//text()
+    sample: index(default)
+"""
+
+WORDS = """the aim of philosophy is to seek explanation all things quest for
+first causes everything and also how are finally why with what design view
+that taking principle in senses word it has been called science when
+zarathustra was thirty years old he left his home lake went into mountains
+there enjoyed spirit solitude ten did not weary but at last heart changed
+rising one morning rosy dawn before sun spake thus unto thou great star would
+be thy happiness if hadst those whom shinest""".split()
+
+def write_xml(path, size):
+    """Write a synthetic XML file of about `size` bytes.
+    
+    """
+    rnd = random.Random(42)
+    f = open(path, 'w')
+    try:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<library>\n')
+        docid = 0
+        while f.tell() < size:
+            docid += 1
+            f.write('<book>\n'
+                    '<metadata name="ETextNo" value="%d" />\n'
+                    '<metadata name="Title" value="%s" />\n'
+                    '<metadata name="Author" value="Author %d" />\n'
+                    '<metadata name="Year" value="%d" />\n'
+                    '<sample>%s</sample>\n'
+                    '</book>\n' % (
+                docid,
+                ' '.join(rnd.sample(WORDS, 4)).title(),
+                rnd.randint(1, 1000),
+                rnd.randint(1500, 2000),
+                ' '.join(rnd.choice(WORDS) for i in xrange(200))))
+        f.write('</library>\n')
+        return docid
+    finally:
+        f.close()
+
+def main(size_mb, worker_counts):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        xml_path = os.path.join(tmpdir, 'books.xml')
+        actions_path = os.path.join(tmpdir, 'books.actions')
+        f = open(actions_path, 'w')
+        f.write(ACTIONS)
+        f.close()
+
+        print 'generating %dMB of XML' % size_mb
+        docs = write_xml(xml_path, size_mb * 1024 * 1024)
+        size = os.path.getsize(xml_path)
+
+        results = []
+        for workers in worker_counts:
+            db_path = os.path.join(tmpdir, 'db%d' % workers)
+            indexer = xml_indexer.Indexer(db_path, actions_path, 'book', workers)
+            start = time.time()
+            indexer.index_file(xml_path)
+            elapsed = time.time() - start
+            del indexer
+            shutil.rmtree(db_path)
+            results.append((workers, elapsed))
+
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print
+        print '%d documents, %.0fMB' % (docs, size / 1048576.0)
+        print 'workers   seconds    docs/s      MB/s'
+        for workers, elapsed in results:
+            print '%7d %9.1f %9.0f %9.2f' % (workers, elapsed, docs / elapsed,
+                                             size / 1048576.0 / elapsed)
+        print 'peak memory of main process: %.0fMB' % (maxrss / 1024.0)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    size_mb = 2048
+    worker_counts = [1, 2, 4]
+    if len(sys.argv) > 1:
+        size_mb = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        worker_counts = [int(arg) for arg in sys.argv[2:]]
+    main(size_mb, worker_counts)
@@ -49,6 +49,9 @@ DBDIR = '/tmp/flaxdemo'
 
 mlookup = TemplateLookup(directories=['templates'])
 
+# shared cache of fieldmaps and parsed queries for the databases
+fieldmaps = flax.core.FieldmapCache()
+
 urls = (
     '^/$', 'list',
     '^/(.*)/search$', 'search',
@@ -76,14 +79,15 @@ class search:
             i = web.input(query='', authfac=[], startrank=0, 
                           yearfrom='', yearto='')
             
-            # open the xapian Database and get the flax.core fieldmap object
-            # FIXME - could cache these for efficiency
-            db = xapian.Database(os.path.join(DBDIR, dbname))
-            fieldmap = flax.core.Fieldmap(db)
+            # open the xapian Database and get the (cached) flax.core
+            # fieldmap object for it
+            dbpath = os.path.join(DBDIR, dbname)
+            db = xapian.Database(dbpath)
+            cached = fieldmaps.get(dbpath, db)
+            fieldmap = cached.fieldmap
             
-            # get a query parser and parse the query
-            queryparser = fieldmap.query_parser(db)
-            query = queryparser.parse_query(i.query)
+            # parse the query (repeated queries are cached)
+            query = cached.parse_query(i.query)
             
             # add authors filter, if supplied
             if i.authfac:
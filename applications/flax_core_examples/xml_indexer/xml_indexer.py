@@ -23,12 +23,16 @@ To run the indexer, you will need Python 2.5 or higher plus:
     - xapian ( http://xapian.org/ )
     - flax.core ( http://code.google.com/p/flaxcode/source/checkout )
 
+To index using more than one process, you will also need Python 2.6 or higher
+(or the multiprocessing package).
+
 Run the indexer with the following parameters:
 
-    $ python xml_indexer.py <db name> <xml file> <actions> <doc tag>
+    $ python xml_indexer.py [-j <workers>] <db name> <xml file> <actions> <doc tag>
 
 where:
 
+    <workers> is the number of worker processes to index with (default 1)
     <db name> is the name of the database to create in DBDIR (see below)
     <xml file> is the path to the source XML data
     <actions> is the path to the indexer actions file
@@ -38,11 +42,22 @@ e.g. using the files provided in examples/ -
 
     $ python xml_indexer.py books.db examples/books.xml examples/book.actions book
 
+With more than one worker, the main process parses the XML and hands each
+document element (serialised) to the workers, which each index into their own
+temporary database.  The temporary databases are merged into the target
+database at the end, in the original document order.  Since each element is
+parsed again on its own by a worker, the xpath expressions in the actions file
+must be relative to the document element.
+
 """
 
 from __future__ import with_statement
 
 import os, os.path
+import heapq
+import Queue
+import shutil
+import tempfile
 import time
 import logging
 
@@ -50,20 +65,63 @@ from lxml import etree
 import xapian
 import flax.core
 
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
 # change this to the directory you want to create databases in
 DBDIR = '/tmp/flaxdemo'
 
 # language for stemming
 LANGUAGE = 'en'
 
+# number of document elements sent to a worker at a time
+BATCH_SIZE = 100
+
+def compile_actions(actions):
+    """Return a list of (action, compiled xpath) for a list of actions.
+    
+    """
+    return [(act, etree.XPath(act.external_key, smart_strings=False))
+            for act in actions]
+
+def make_document(fieldmap, xpaths, element, data, database):
+    """Make a flax document from an XML element.
+    
+    `xpaths` is a list of (action, compiled xpath), as returned by
+    compile_actions().  `data` is the serialised element, which is stored as
+    the document data.  `database` is the database the document will be added
+    to (needed for spelling data).
+    
+    """
+    doc = fieldmap.document()
+    doc.database = database
+    for act, xpath in xpaths:
+        for item in xpath(element):
+            if not isinstance(item, basestring):
+                raise Exception, \
+                    'xpath expression "%s" does not evaluate to a string' % act.external_key
+            act.action(act.fieldname, item, doc)
+
+    doc.set_data(data)
+    return doc
+
 class Indexer(object):
-    """FIXME
+    """Index XML files into a flax database.
+
+    `workers` is the number of worker processes to use.  With a single worker
+    (or if multiprocessing is not available) documents are indexed directly,
+    in this process.
     
     """
-    def __init__(self, db_path, actions_path, root_tag):
+    def __init__(self, db_path, actions_path, root_tag, workers=1):
         self.db_path = db_path
+        self.actions_path = actions_path
         self.actions = flax.core.actions.parse_actions(actions_path)
+        self.xpaths = compile_actions(self.actions)
         self.root_tag = root_tag
+        self.workers = workers
         
         try:
             self.db = xapian.WritableDatabase(db_path, xapian.DB_OPEN)
@@ -75,45 +133,191 @@ class Indexer(object):
             # create a fieldmap from the actions and save it
             self.fieldmap = flax.core.Fieldmap(language=LANGUAGE)
             for act in self.actions:
-                self.fieldmap.setfield(act.fieldname, act.action.isfilter)
+                self.fieldmap.setfield(act.fieldname, act.action.isfilter,
+                    precision_step=getattr(act.action, 'precision_step', None))
                 
             self.fieldmap.save(self.db)
             self.db.flush()
             
     def index_file(self, path):
-        with open(path) as f:
-            for event, element in etree.iterparse(f):
-                if element.tag == self.root_tag:
-                    self.index_element(element)
+        """Index all the document elements in an XML file.
+        
+        Returns the number of documents indexed.
+        
+        """
+        start = time.time()
+        if self.workers > 1 and multiprocessing is not None:
+            count = self._index_parallel(path)
+        else:
+            count = 0
+            for element in self.iter_elements(path):
+                self.index_element(element)
+                count += 1
+                if count % 10000 == 0:
+                    print 'indexed', count
 
         self.db.flush()
-        print 'done'
+        print 'done: %d documents in %.1fs' % (count, time.time() - start)
+        return count
+
+    def iter_elements(self, path):
+        """Iterate over the document elements in an XML file.
+        
+        Each element is cleared (along with anything preceding it) once the
+        caller has finished with it, so memory use doesn't grow with the size
+        of the file.
+        
+        """
+        with open(path) as f:
+            for event, element in etree.iterparse(f, tag=self.root_tag):
+                yield element
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
 
     def index_element(self, element):
         """Index an XML element as one xapian document.
         
         """
-        doc = self.fieldmap.document()
-        print 'indexing', element.tag
-        for act in self.actions:
-            for item in element.xpath(act.external_key):
-                if not isinstance(item, basestring):
-                    raise Exception, \
-                        'xpath expression "%s" does not evaluate to a string' % field.xpath
-                act.action(act.fieldname, item, doc)
-
-        data = etree.tostring(element)
-        doc.set_data(data)
+        doc = make_document(self.fieldmap, self.xpaths, element,
+                            etree.tostring(element), self.db)
         self.fieldmap.add_document(self.db, doc)
 
+    def _index_parallel(self, path):
+        """Index a file using worker processes, and merge the results.
+        
+        """
+        tmpdir = tempfile.mkdtemp(prefix='xml_indexer',
+                                  dir=os.path.dirname(os.path.abspath(self.db_path)))
+        try:
+            queue = multiprocessing.Queue(self.workers * 4)
+            procs = []
+            for i in xrange(self.workers):
+                tmp_path = os.path.join(tmpdir, str(i))
+                proc = multiprocessing.Process(target=_index_worker,
+                    args=(self.db_path, self.actions_path, tmp_path, queue))
+                proc.start()
+                procs.append((proc, tmp_path))
+
+            count = 0
+            batch = []
+            for element in self.iter_elements(path):
+                batch.append((count, etree.tostring(element)))
+                count += 1
+                if len(batch) >= BATCH_SIZE:
+                    _put(queue, batch, procs)
+                    batch = []
+                if count % 10000 == 0:
+                    print 'parsed', count
+            if batch:
+                _put(queue, batch, procs)
+            for proc in procs:
+                _put(queue, None, procs)
+
+            for proc, tmp_path in procs:
+                proc.join()
+                if proc.exitcode != 0:
+                    raise Exception, 'indexing worker failed'
+
+            print 'merging'
+            self._merge([tmp_path for proc, tmp_path in procs])
+            return count
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def _merge(self, tmp_paths):
+        """Merge the workers' databases into the target database, in the
+        original document order.
+        
+        """
+        sources = []
+        heap = []
+        for tmp_path in tmp_paths:
+            db = xapian.Database(tmp_path)
+            ids = open(tmp_path + '.ids')
+            sources.append((db, ids))
+            _push_next(heap, len(sources) - 1, ids)
+
+        while heap:
+            seqno, source, docid, idterm = heapq.heappop(heap)
+            db, ids = sources[source]
+            doc = db.get_document(docid)
+            if idterm is None:
+                self.db.add_document(doc)
+            else:
+                self.db.replace_document(idterm, doc)
+            _push_next(heap, source, ids, docid)
+
+        for db, ids in sources:
+            for item in db.spellings():
+                self.db.add_spelling(item.term, item.termfreq)
+            ids.close()
+
+def _push_next(heap, source, ids, docid=0):
+    """Push the next document from a worker's database onto the merge heap.
+    
+    """
+    line = ids.readline()
+    if not line:
+        return
+    bits = line.rstrip('\n').split(' ', 1)
+    idterm = None
+    if len(bits) == 2:
+        idterm = bits[1].decode('string_escape')
+    heapq.heappush(heap, (int(bits[0]), source, docid + 1, idterm))
+
+def _put(queue, item, procs):
+    """Put an item on the workers' queue, checking that they're still alive.
+    
+    """
+    while True:
+        try:
+            queue.put(item, True, 1.0)
+            return
+        except Queue.Full:
+            for proc, tmp_path in procs:
+                if not proc.is_alive():
+                    raise Exception, 'indexing worker failed'
+
+def _index_worker(db_path, actions_path, tmp_path, queue):
+    """Worker process: index batches of serialised elements into a temporary
+    database.
+    
+    Documents are added in order, and the sequence number and ID term of each
+    is written to a file alongside the database, for merging.
+    
+    """
+    xpaths = compile_actions(flax.core.actions.parse_actions(actions_path))
+    fieldmap = flax.core.Fieldmap(xapian.Database(db_path))
+    db = xapian.WritableDatabase(tmp_path, xapian.DB_CREATE)
+    with open(tmp_path + '.ids', 'w') as ids:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            for seqno, data in batch:
+                element = etree.fromstring(data)
+                doc = make_document(fieldmap, xpaths, element, data, db)
+                db.add_document(doc.get_xapian_doc())
+                if doc._docid is None:
+                    ids.write('%d\n' % seqno)
+                else:
+                    ids.write('%d %s\n' % (seqno, doc._docid.encode('string_escape')))
+    db.flush()
+
 if __name__ == '__main__':
     import sys
-    if len(sys.argv) != 5:
-        print "usage: python xml_indexer.py <db name> <xml file> <actions> <doc tag>"
+    from optparse import OptionParser
+    parser = OptionParser(usage="python xml_indexer.py [-j <workers>] <db name> <xml file> <actions> <doc tag>")
+    parser.add_option('-j', '--workers', type='int', default=1,
+                      help='number of worker processes to index with')
+    options, args = parser.parse_args()
+    if len(args) != 4:
+        parser.print_usage()
     else:
         if not os.path.exists(DBDIR):
             os.mkdir(DBDIR)
             
-        indexer = Indexer(os.path.join(DBDIR, sys.argv[1]), sys.argv[3], sys.argv[4])
-        indexer.index_file(sys.argv[2])
-    
\ No newline at end of file
+        indexer = Indexer(os.path.join(DBDIR, args[0]), args[2], args[3],
+                          options.workers)
+        indexer.index_file(args[1])
@@ -1,2 +1,3 @@
 from fieldmap import Fieldmap
+from cache import FieldmapCache
 import actions
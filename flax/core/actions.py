@@ -61,9 +61,10 @@ class DateAction(_IndexerAction):
     action_name = 'date'
     isfilter = True
     
-    def __init__(self, format):
+    def __init__(self, format, precision_step=None):
         _IndexerAction.__init__(self)
         self.format = format
+        self.precision_step = precision_step
 
     def __call__(self, fieldname, value, doc):        
         date = time.strptime(value, self.format)
@@ -103,6 +104,10 @@ class NumericAction(_IndexerAction):
     action_name = 'numeric'
     isfilter = True
     
+    def __init__(self, precision_step=None):
+        _IndexerAction.__init__(self)
+        self.precision_step = precision_step
+
     def __call__(self, fieldname, value, doc):
         try:
             doc.index(fieldname, int(value))
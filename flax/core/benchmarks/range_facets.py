@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+r"""Benchmark range facets computed in the match pass against counting each
+bucket with a separate range query.
+
+Builds a database of synthetic documents with a numeric "price" field and a
+date "published" field, then for a query matching most documents, computes a
+10-bucket histogram of each field both ways.
+
+Usage:
+
+    $ python range_facets.py [<documents> [<iterations>]]
+
+"""
+
+import os.path
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..'))
+import xapian
+from flax.core import Fieldmap
+
+def build(path, ndocs):
+    db = xapian.WritableDatabase(path, xapian.DB_CREATE_OR_OVERWRITE)
+    fm = Fieldmap()
+    fm.setfield('text', False)
+    fm.setfield('price', True)
+    fm.setfield('published', True)
+    fm.save(db)
+
+    rnd = random.Random(42)
+    words = ['apple', 'banana', 'cherry', 'damson', 'elder', 'fig']
+    for i in xrange(ndocs):
+        doc = fm.document()
+        doc.index('text', ' '.join(rnd.sample(words, 3)), search_default=True)
+        doc.index('price', rnd.uniform(0, 1000))
+        doc.index('published', datetime.fromtimestamp(
+            rnd.uniform(946684800, 1262304000)))
+        fm.add_document(db, doc)
+    db.flush()
+    return fm
+
+def per_bucket(fm, db, query, field, bounds):
+    """Count each bucket with its own range query.
+
+    """
+    counts = []
+    for i in xrange(len(bounds) - 1):
+        high = bounds[i + 1]
+        if i < len(bounds) - 2:
+            # make the range exclusive at the top, as the facets are
+            high = high - 1e-9
+        q = fm.FILTER(query, fm.range_query(field, bounds[i], high))
+        enq = xapian.Enquire(db)
+        enq.set_query(q)
+        counts.append(enq.get_mset(0, 0, db.get_doccount())
+                      .get_matches_estimated())
+    return counts
+
+def timeit(fn, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        result = fn()
+    return (time.time() - start) / iterations, result
+
+def main(ndocs, iterations):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'db')
+        print 'building database of %d documents' % ndocs
+        fm = build(path, ndocs)
+        db = xapian.Database(path)
+        query = fm.query('text', ['apple', 'banana', 'cherry'])
+
+        price_bounds = [i * 100.0 for i in xrange(11)]
+        date_bounds = [float(946684800 + i * 31557600) for i in xrange(11)]
+
+        def single_pass():
+            return fm.search(db, query, 0, 10, checkatleast=ndocs,
+                             range_facets={'price': price_bounds,
+                                           'published': date_bounds})
+
+        def separate():
+            return (per_bucket(fm, db, query, 'price', price_bounds),
+                    per_bucket(fm, db, query, 'published', date_bounds))
+
+        t_single, mset = timeit(single_pass, iterations)
+        t_separate, (prices, dates) = timeit(separate, iterations)
+
+        assert [x[2] for x in mset.range_facets['price']] == prices
+        assert [x[2] for x in mset.range_facets['published']] == dates
+
+        print '%d documents matched' % mset.get_matches_estimated()
+        print 'match pass facets:      %8.1f ms' % (t_single * 1000)
+        print 'per-bucket queries:     %8.1f ms (20 queries)' % (t_separate * 1000)
+        print 'speedup:                %8.1fx' % (t_separate / t_single)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    ndocs = 100000
+    iterations = 10
+    if len(sys.argv) > 1:
+        ndocs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+    main(ndocs, iterations)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+r"""Benchmark range queries using multi-precision terms against value ranges.
+
+Builds two databases of synthetic documents with a date field, one indexed
+with multi-precision range terms and one without, then times date range
+filters of several widths on each.
+
+Usage:
+
+    $ python range_queries.py [<documents> [<precision step>]]
+
+"""
+
+import os.path
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', '..', '..'))
+import xapian
+from flax.core import Fieldmap
+
+START = datetime(2000, 1, 1)
+DAYS = 3650
+
+def build(path, ndocs, precision_step):
+    db = xapian.WritableDatabase(path, xapian.DB_CREATE_OR_OVERWRITE)
+    fm = Fieldmap()
+    fm.setfield('text', False)
+    fm.setfield('published', True, precision_step=precision_step)
+    fm.save(db)
+
+    rnd = random.Random(42)
+    for i in xrange(ndocs):
+        doc = fm.document()
+        doc.index('text', 'document', search_default=True)
+        doc.index('published', START + timedelta(seconds=rnd.uniform(0, DAYS * 86400)))
+        fm.add_document(db, doc)
+    db.flush()
+    return fm
+
+def time_query(fm, db, query, iterations):
+    enq = xapian.Enquire(db)
+    enq.set_query(query)
+    start = time.time()
+    for i in xrange(iterations):
+        mset = enq.get_mset(0, 10, db.get_doccount())
+    return (time.time() - start) / iterations, mset.get_matches_estimated()
+
+def main(ndocs, precision_step):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print 'building databases of %d documents' % ndocs
+        dbs = []
+        for step in (None, precision_step):
+            path = os.path.join(tmpdir, 'db%s' % step)
+            fm = build(path, ndocs, step)
+            dbs.append((fm, xapian.Database(path)))
+        size = lambda step: sum(os.path.getsize(os.path.join(tmpdir, 'db%s' % step, f))
+                                for f in os.listdir(os.path.join(tmpdir, 'db%s' % step)))
+        print 'database size: %.1fMB (values), %.1fMB (terms)' % (
+            size(None) / 1048576.0, size(precision_step) / 1048576.0)
+
+        print '  days   matches    values ms     terms ms  terms'
+        for days in (1, 30, 365, 1825, 3650):
+            low = START + timedelta(days=(DAYS - days) / 2)
+            high = low + timedelta(days=days)
+            times = []
+            for fm, db in dbs:
+                query = fm.FILTER(fm.query('text', 'document'),
+                                  fm.range_query('published', low, high))
+                t, matches = time_query(fm, db, query, 5)
+                times.append((t, matches))
+            assert times[0][1] == times[1][1]
+            nterms = len(list(dbs[1][0].range_query('published', low, high)))
+            print '%6d %9d %12.1f %12.1f  %5d' % (days, times[0][1],
+                times[0][0] * 1000, times[1][0] * 1000, nterms)
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    ndocs = 1000000
+    precision_step = 4
+    if len(sys.argv) > 1:
+        ndocs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        precision_step = int(sys.argv[2])
+    main(ndocs, precision_step)
@@ -0,0 +1,232 @@
+# Copyright (c) 2010 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+r"""Cache of fieldmaps and query parsers, for applications which search the
+same databases repeatedly.
+
+"""
+
+import threading
+import xapian
+
+from fieldmap import Fieldmap
+
+# the flags used by xapian.QueryParser.parse_query() by default
+_DEFAULT_FLAGS = getattr(xapian.QueryParser, 'FLAG_DEFAULT',
+                         xapian.QueryParser.FLAG_PHRASE |
+                         xapian.QueryParser.FLAG_BOOLEAN |
+                         xapian.QueryParser.FLAG_LOVEHATE)
+
+def database_revision(database):
+    """Return a value which changes whenever the database is modified.
+    
+    Uses the database revision number where Xapian provides it. Otherwise,
+    only the flax metadata is checked, which is enough for the fieldmap and
+    query parser to be kept up to date.
+    
+    """
+    try:
+        return database.get_revision()
+    except AttributeError:
+        return (database.get_metadata('flax.fieldmap'),
+                database.get_metadata('flax.language'),
+                database.get_metadata('flax.precision'))
+
+class _LRUCache(object):
+    """A simple bounded cache, discarding the least recently used items.
+    
+    Not thread-safe - callers must do their own locking.
+    
+    """
+    def __init__(self, maxitems):
+        self.maxitems = maxitems
+        self._items = {}
+        self._tick = 0
+    
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            return None
+        self._tick += 1
+        item[0] = self._tick
+        return item[1]
+
+    def set(self, key, value):
+        if self.maxitems <= 0:
+            return
+        if key not in self._items and len(self._items) >= self.maxitems:
+            # discard the least recently used half, so that this is only
+            # done occasionally
+            items = sorted(self._items.iteritems(), key=lambda x: x[1][0])
+            for k, v in items[:max(1, len(items) / 2)]:
+                del self._items[k]
+        self._tick += 1
+        self._items[key] = [self._tick, value]
+
+    def __len__(self):
+        return len(self._items)
+
+class CachedFieldmap(object):
+    """A fieldmap and query parser for one revision of a database.
+
+    Obtain these from FieldmapCache.get(). The fieldmap is shared, so it must
+    not be modified.
+    
+    """
+    def __init__(self, database, revision, maxqueries):
+        self.revision = revision
+        self.fieldmap = Fieldmap(database)
+        self._queryparser = self.fieldmap.query_parser(database)
+        self._queries = _LRUCache(maxqueries)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse_query(self, querystring, flags=None, default_op=None):
+        """Parse a query string, returning a xapian.Query.
+        
+        `flags` and `default_op` are passed to the xapian.QueryParser. The
+        results for repeated query strings are cached.
+        
+        """
+        if flags is None:
+            flags = _DEFAULT_FLAGS
+        if default_op is None:
+            default_op = xapian.Query.OP_OR
+        key = (querystring, flags, default_op)
+        
+        self._lock.acquire()
+        try:
+            query = self._queries.get(key)
+            if query is not None:
+                self.hits += 1
+                return query
+            self.misses += 1
+            self._queryparser.set_default_op(default_op)
+            query = self._queryparser.parse_query(querystring, flags)
+            self._queries.set(key, query)
+            return query
+        finally:
+            self._lock.release()
+
+class FieldmapCache(object):
+    """A shared cache of fieldmaps, query parsers and parsed queries, keyed by
+    database path and revision.
+    
+    Typical use, in a search request:
+    
+        db = xapian.Database(path)
+        cached = cache.get(path, db)
+        query = cached.parse_query(querystring)
+        results = cached.fieldmap.search(db, query)
+    
+    `maxqueries` is the maximum number of parsed queries to keep for each
+    database.
+    
+    """
+    def __init__(self, maxqueries=1000):
+        self.maxqueries = maxqueries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, database):
+        """Return a CachedFieldmap for the database at `path`.
+        
+        `database` is an open xapian.Database for `path`, which is used to
+        check the revision (and to load the fieldmap, if it has changed).
+        
+        """
+        revision = database_revision(database)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(path)
+            if entry is not None and entry.revision == revision:
+                return entry
+        finally:
+            self._lock.release()
+
+        entry = CachedFieldmap(database, revision, self.maxqueries)
+        self._lock.acquire()
+        try:
+            self._entries[path] = entry
+        finally:
+            self._lock.release()
+        return entry
+
+    def fieldmap(self, path, database):
+        """Return the (shared) Fieldmap for the database at `path`.
+        
+        """
+        return self.get(path, database).fieldmap
+
+    def clear(self, path=None):
+        """Discard cached data for one path, or for all paths.
+        
+        """
+        self._lock.acquire()
+        try:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+        finally:
+            self._lock.release()
+
+def run_tests():
+    """Run some tests.
+    
+    """
+    path = '/tmp/flaxcachetest.db'
+    db = xapian.WritableDatabase(path, xapian.DB_CREATE_OR_OVERWRITE)
+    fm = Fieldmap()
+    fm.setfield('foo', False)
+    fm.save(db)
+    db.flush()
+
+    cache = FieldmapCache(maxqueries=2)
+    rdb = xapian.Database(path)
+    
+    # TEST - entries are shared while the revision is unchanged
+    cached = cache.get(path, rdb)
+    assert cache.get(path, xapian.Database(path)) is cached
+    assert cached.fieldmap == fm
+    
+    # TEST - parsed queries are cached
+    q1 = cached.parse_query('foo:gin')
+    assert str(q1) == 'Xapian::Query(XAgin:(pos=1))'
+    assert cached.parse_query('foo:gin') is q1
+    assert (cached.hits, cached.misses) == (1, 1)
+    cached.parse_query('tea')
+    cached.parse_query('coffee')
+    assert len(cached._queries) <= 2
+    
+    # TEST - a changed fieldmap is picked up
+    fm.setfield('bar', True)
+    fm.save(db)
+    db.flush()
+    rdb.reopen()
+    cached2 = cache.get(path, rdb)
+    assert cached2 is not cached
+    assert 'XBchips' in str(cached2.parse_query('bar:chips'))
+    
+    print 'all tests passed'
+
+if __name__ == '__main__':
+    run_tests()
@@ -29,6 +29,8 @@ to use Flax Core.
 import time
 from datetime import datetime
 import re
+from bisect import bisect_right
+import struct
 import xapian
 try:
     import json
@@ -45,6 +47,73 @@ except AttributeError:
     _FacetMatchSpy = xapian.ValueCountMatchSpy
     _multivalues = False
 
+# largest value of the integers used for multi-precision range terms
+_MAX_SORTABLE = (1 << 64) - 1
+
+def _sortable_int(value):
+    """Convert a number to a 64-bit unsigned integer with the same ordering.
+    
+    """
+    bits = struct.unpack('>Q', struct.pack('>d', float(value)))[0]
+    if bits & (1 << 63):
+        return bits ^ _MAX_SORTABLE
+    return bits | (1 << 63)
+
+def _range_term(prefix, value, shift):
+    """Return the range term for a sortable integer at a precision level.
+    
+    """
+    return '%s#%02d%x' % (prefix, shift, value >> shift)
+
+def _range_terms(prefix, value, step):
+    """Return the range terms for a number, at every precision level.
+    
+    """
+    value = _sortable_int(value)
+    return [_range_term(prefix, value, shift) for shift in xrange(0, 64, step)]
+
+def _range_query_terms(prefix, low, high, step):
+    """Return the smallest set of range terms covering [low, high].
+    
+    Works up from the finest precision level, covering the parts of the range
+    which don't fill a whole term at the next level, as in Lucene's
+    NumericRangeQuery.
+    
+    """
+    low = _sortable_int(low)
+    high = _sortable_int(high)
+    terms = []
+    if low > high:
+        return terms
+    
+    def add(low, high, shift):
+        # (values may be too large for xrange)
+        v = low >> shift
+        while v <= high >> shift:
+            terms.append(_range_term(prefix, v << shift, shift))
+            v += 1
+
+    shift = 0
+    while True:
+        diff = 1 << (shift + step)
+        mask = ((1 << step) - 1) << shift
+        has_lower = (low & mask) != 0
+        has_upper = (high & mask) != mask
+        next_low = (low + diff if has_lower else low) & ~mask
+        next_high = (high - diff if has_upper else high) & ~mask
+        if (shift + step >= 64 or next_low > next_high or
+            next_low > _MAX_SORTABLE or next_high < 0):
+            add(low, high, shift)
+            break
+        if has_lower:
+            add(low, low | mask, shift)
+        if has_upper:
+            add(high & ~mask, high, shift)
+        low = next_low
+        high = next_high
+        shift += step
+    return terms
+
 
 class Fieldmap(object):
     """Helper class for adding named field functionality to Xapian.
@@ -65,6 +134,7 @@ class Fieldmap(object):
         
         """
         self._fieldmap = {}
+        self._precision = {}
         self.language = language
         if database:
             # FIXME: handle conflict between saved and supplied arguments?
@@ -73,6 +143,9 @@ class Fieldmap(object):
             if jstr:
                 for k, v in json.loads(jstr).iteritems():
                     self._fieldmap[k] = tuple(v)
+            jstr = database.get_metadata('flax.precision')
+            if jstr:
+                self._precision = json.loads(jstr)
 
     def save(self, database):
         """Save this fieldmap to the database specified.
@@ -82,18 +155,34 @@ class Fieldmap(object):
         """
         database.set_metadata('flax.fieldmap', json.dumps(self._fieldmap))
         database.set_metadata('flax.language', self.language)
+        database.set_metadata('flax.precision', json.dumps(self._precision))
 
-    def setfield(self, fieldname, isfilter, overwrite=False):
+    def setfield(self, fieldname, isfilter, overwrite=False,
+                 precision_step=None):
         """Set a field in the map.
         
         `fieldname` is the name of the field.
         `isfilter` should be True iff the field is a filter.
         `overwrite` must be true to overwrite an existing definition.
+        `precision_step` may be set for numeric and date filter fields, to
+            also index values as terms at several precisions, each 
+            `precision_step` bits coarser than the last (between 1 and 8; 4
+            is a good choice). Range queries on the field then use these 
+            terms instead of scanning the values. Smaller steps give faster
+            range queries but more terms per document.
         
         """
         fieldname = unicode(fieldname)
         if self._fieldmap.get(fieldname) and not overwrite:
             raise FieldmapError, 'field "%s" already exists' % fieldname
+        if precision_step is not None:
+            precision_step = int(precision_step)
+            if not isfilter or not 1 <= precision_step <= 8:
+                raise FieldmapError, \
+                    'invalid precision step for field "%s"' % fieldname
+            self._precision[fieldname] = precision_step
+        else:
+            self._precision.pop(fieldname, None)
 
         if self._fieldmap:
             fieldnum = 1 + max(x[1] for x in self._fieldmap.itervalues())
@@ -127,7 +216,8 @@ class Fieldmap(object):
         return self._fieldmap.iteritems()
     
     def __eq__(self, other):
-        return self._fieldmap == other._fieldmap
+        return (self._fieldmap == other._fieldmap and
+                self._precision == other._precision)
         
     def __str__(self):
         return 'Fieldmap: %r' % self._fieldmap
@@ -169,6 +259,7 @@ class Fieldmap(object):
         
         """
         prefix, valnum, isfilter = self._fieldmap[fieldname]
+        step = self._precision.get(fieldname)
 
         def mq(v):
             if isinstance(v, unicode):
@@ -178,6 +269,9 @@ class Fieldmap(object):
                 return xapian.Query('%s%s%s' % (prefix, 
                     ':' if v[0].isupper() else '', v))
             elif isinstance(v, int) or isinstance(v, float):
+                if step:
+                    return xapian.Query(xapian.Query.OP_SCALE_WEIGHT,
+                        xapian.Query(_range_terms(prefix, v, step)[0]), 0)
                 strv = xapian.sortable_serialise(v)
                 return xapian.Query(
                     xapian.Query.OP_VALUE_RANGE, valnum, strv, strv)
@@ -185,7 +279,12 @@ class Fieldmap(object):
                 term = '%s%04d%02d%02d' % (prefix, v.year, v.month, v.day)
 #                strv = '%04d%02d%02d%02d%02d%02d' % (
 #                    v.year, v.month, v.day, v.hour, v.minute, v.second)
-                strv = xapian.sortable_serialise(time.mktime(v.timetuple()))
+                t = time.mktime(v.timetuple())
+                if step:
+                    return xapian.Query(xapian.Query.OP_AND,
+                        xapian.Query(term),
+                        xapian.Query(_range_terms(prefix, t, step)[0]))
+                strv = xapian.sortable_serialise(t)
                 return xapian.Query(xapian.Query.OP_AND,
                     xapian.Query(term), xapian.Query(
                         xapian.Query.OP_VALUE_RANGE, valnum, strv, strv))
@@ -214,6 +313,10 @@ class Fieldmap(object):
         latter case, the fieldmap will generate helper terms to try to
         optimise the query.
         
+        If the field was set with a `precision_step`, the query is an OR of
+        the multi-precision terms covering the range (with zero weight),
+        rather than a value range.
+        
         """
         if type(value1) is not type(value2):
             raise SearchError, 'cannot mix types in a query range'
@@ -223,6 +326,15 @@ class Fieldmap(object):
         except KeyError:
             raise SearchError, 'fieldname %s not in fieldmap' % fieldname
 
+        step = self._precision.get(fieldname)
+        if step:
+            if isinstance(value1, datetime):
+                value1 = time.mktime(value1.timetuple())
+                value2 = time.mktime(value2.timetuple())
+            terms = _range_query_terms(prefix, value1, value2, step)
+            return xapian.Query(xapian.Query.OP_SCALE_WEIGHT,
+                xapian.Query(xapian.Query.OP_OR, terms), 0)
+
         if isinstance(value1, int) or isinstance(value1, float):
             return xapian.Query(xapian.Query.OP_VALUE_RANGE, valnum,
                 xapian.sortable_serialise(value1), 
@@ -298,7 +410,7 @@ class Fieldmap(object):
         This is a thin wrapper for a xapian.Document to support Flax indexing.
         
         """
-        return _FlaxDocument(self._fieldmap, self.language)
+        return _FlaxDocument(self._fieldmap, self.language, self._precision)
         
     @staticmethod
     def add_document(database, doc):
@@ -318,7 +430,8 @@ class Fieldmap(object):
             database.add_document(doc.get_xapian_doc())
 
     def search(self, database, query, startrank=0, maxitems=20, 
-               facet_fields=[], maxfacets=100, checkatleast=100):
+               facet_fields=[], maxfacets=100, checkatleast=100,
+               range_facets=None):
         """Search a database, returning hits and facets.
         
         `database` is a xapian.Database.
@@ -330,10 +443,24 @@ class Fieldmap(object):
         `maxfacets` is the maximum number of facet values to return for 
             each facet field.
         `checkatleast` is the minimum number of documents to check
+        `range_facets` is a dict of numeric or date fieldnames to collect
+            histogram-style facets for, mapping to either a list of bucket
+            boundaries (numbers or datetimes) or the number of equal-sized
+            buckets to divide the range of values into. A list of fieldnames
+            may also be given, for 10 buckets each.
         
         Results are returned as a xapian.MSet, with an additional attribute
         `facets` containing the facets collected as a dict.
         
+        Range facets are returned in an additional attribute `range_facets`,
+        a dict mapping each fieldname to a list of (low, high, count) tuples,
+        one per bucket. Buckets include values from low up to (but not
+        including) high, except the last, which also includes high. For 
+        automatic buckets, the boundaries are numbers (seconds since the
+        epoch, for date fields). Range facets are counted in the same match
+        pass as the hits, so they cover the documents checked by the match
+        (see `checkatleast`).
+        
         FIXME - how to use MatchDeciders, Sorters etc ?
         FIXME - stopwords?
 
@@ -348,6 +475,17 @@ class Fieldmap(object):
             enq.add_matchspy(ms)
             matchspies.append((field, ms))
 
+        # range facets count each distinct value, and are then grouped into
+        # buckets
+        rangespies = []
+        if range_facets:
+            if not isinstance(range_facets, dict):
+                range_facets = dict((field, 10) for field in range_facets)
+            for field, buckets in range_facets.iteritems():
+                ms = xapian.ValueCountMatchSpy(self._fieldmap[field][1])
+                enq.add_matchspy(ms)
+                rangespies.append((field, buckets, ms))
+
         mset = enq.get_mset(startrank, maxitems, checkatleast)
     
         # collect facets
@@ -359,9 +497,60 @@ class Fieldmap(object):
             for field, ms in matchspies:
                 facets[field] = [x.term for x in ms.top_values(maxfacets)]
         
+        range_results = {}
+        for field, buckets, ms in rangespies:
+            if _multivalues:
+                counts = [(x[0], x[1]) for x in
+                          ms.get_top_values(database.get_doccount())]
+            else:
+                counts = [(x.term, x.termfreq) for x in
+                          ms.top_values(database.get_doccount())]
+            range_results[field] = _range_buckets(
+                [(xapian.sortable_unserialise(v), c) for v, c in counts if v],
+                buckets)
+        
         # this is ok in Python, but what about other languages?
         mset.facets = facets
+        mset.range_facets = range_results
         return mset
+
+def _range_buckets(counts, buckets):
+    """Group value counts into buckets.
+    
+    `counts` is a list of (value, count) tuples. `buckets` is a list of
+    bucket boundaries (numbers or datetimes), or a number of buckets.
+    
+    Returns a list of (low, high, count) tuples.
+    
+    """
+    if isinstance(buckets, (int, long)):
+        if not counts:
+            return []
+        low = min(v for v, c in counts)
+        high = max(v for v, c in counts)
+        if low == high or buckets < 2:
+            return [(low, high, sum(c for v, c in counts))]
+        width = (high - low) / float(buckets)
+        bounds = [low + width * i for i in xrange(buckets)] + [high]
+        keys = bounds
+    else:
+        bounds = list(buckets)
+        if len(bounds) < 2:
+            raise SearchError, 'range facets need at least two boundaries'
+        keys = bounds
+        if isinstance(bounds[0], datetime):
+            keys = [time.mktime(b.timetuple()) for b in bounds]
+        for i in xrange(1, len(keys)):
+            if keys[i] < keys[i - 1]:
+                raise SearchError, 'range facet boundaries must be in order'
+
+    totals = [0] * (len(keys) - 1)
+    for v, c in counts:
+        if v == keys[-1]:
+            totals[-1] += c
+        elif keys[0] <= v < keys[-1]:
+            totals[bisect_right(keys, v) - 1] += c
+    return [(bounds[i], bounds[i + 1], totals[i]) for i in xrange(len(totals))]
         
 
 class _FlaxDocument(object):
@@ -369,8 +558,9 @@ class _FlaxDocument(object):
     
     """
 
-    def __init__(self, fieldmap, language):
+    def __init__(self, fieldmap, language, precision=None):
         self._fieldmap = fieldmap
+        self._precision = precision or {}
         self._doc = xapian.Document()
         self._stemmer = xapian.Stem(language) if language else None
         self._facets = {}
@@ -441,9 +631,9 @@ class _FlaxDocument(object):
                     self._docid = term
                     
             elif isinstance(value, float) or isinstance(value, int):
+                # the value is also used for range facets (see Fieldmap.search)
                 self._doc.add_value(valnum, xapian.sortable_serialise(value))
-                # FIXME - helper terms?
-                # FIXME - numeric facets
+                self._add_range_terms(fieldname, prefix, value)
 
                 if isdocid:
                     self._docid = '%s%s' % (prefix, value)
@@ -457,8 +647,9 @@ class _FlaxDocument(object):
 #                self._doc.add_value(valnum, '%04d%02d%02d%02d%02d%02d' % (
 #                    value.year, value.month, value.day, 
 #                    value.hour, value.minute, value.second))
-                self._doc.add_value(valnum, xapian.sortable_serialise(
-                    time.mktime(value.timetuple())))
+                t = time.mktime(value.timetuple())
+                self._doc.add_value(valnum, xapian.sortable_serialise(t))
+                self._add_range_terms(fieldname, prefix, t)
                     
                 if isdocid:
                     raise IndexingError, 'cannot use date as docid'
@@ -487,6 +678,16 @@ class _FlaxDocument(object):
 
             termgen.index_text(value)
 
+    def _add_range_terms(self, fieldname, prefix, value):
+        """Add multi-precision range terms for a number, if the field has a
+        precision step set.
+        
+        """
+        step = self._precision.get(fieldname)
+        if step:
+            for term in _range_terms(prefix, value, step):
+                self._doc.add_term(term, 0)
+
     def set_data(self, data):
         """Set the document data. This does no indexing.
         
@@ -585,6 +786,31 @@ def run_tests():
     else:
         assert mset.facets['bar'] == ['chips']
 
+    # TEST - range facets
+    mset = fm.search(db, q1, range_facets={'eggs': [
+        datetime(2010, 1, 1), datetime(2010, 6, 1), datetime(2011, 1, 1)]})
+    assert [x[2] for x in mset.range_facets['eggs']] == [1, 0]
+    assert _range_buckets([(1, 2), (5, 1), (10, 3)], 3) == [
+        (1, 4.0, 2), (4.0, 7.0, 1), (7.0, 10, 3)]
+    assert _range_buckets([(1, 2), (5, 1), (10, 3)], 3L) == [
+        (1, 4.0, 2), (4.0, 7.0, 1), (7.0, 10, 3)]
+    assert _range_buckets([(1, 2), (5, 1), (10, 3)], [0, 5, 10]) == [
+        (0, 5, 2), (5, 10, 4)]
+
+    # TEST - multi-precision range terms give the same results as values
+    fm.setfield('price', True, precision_step=4)
+    for price in (5, 12.5, 99):
+        doc = fm.document()
+        doc.index('price', price)
+        fm.add_document(db, doc)
+    db.flush()
+    for low, high, count in ((0, 100, 3), (5, 12.5, 2), (6, 12, 0), (99, 99, 1)):
+        enq = xapian.Enquire(db)
+        enq.set_query(fm.range_query('price', low, high))
+        assert enq.get_mset(0, 10).size() == count
+    enq.set_query(fm.query('price', 12.5))
+    assert enq.get_mset(0, 10).size() == 1
+
     # TEST - another query test with a query branch weight adjustment    
     q2 = fm.AND(fm.query('bar', 'chips'), fm.query('bar', 'chaps', 0.5))
     assert str(q2) == 'Xapian::Query((XBchips AND 0.5 * XBchaps))'
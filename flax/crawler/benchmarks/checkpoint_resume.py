@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark checkpointing and resuming DefaultURLPool.
+
+    A checkpointed pool is filled with URLs spread over a number of domains
+    and snapshotted, and then more URLs are added (and so only logged). A new
+    pool is then resumed from the checkpoint, as after a crash. Reports the
+    time to write the snapshot and its size, and the time to resume, for the
+    default seen set (a set of StdURLs) and for a FingerprintSet.
+
+    Usage:
+
+        $ python checkpoint_resume.py [<URLs> [<logged URLs> [<domains>]]]
+"""
+
+import os
+import os.path
+import sys
+from multiprocessing import Process, Queue
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+from checkpoint import Checkpoint
+from crawler import DefaultURLPool
+from seen import FingerprintSet
+from stdurl import StdURL
+
+
+def new_seen(name):
+    return FingerprintSet() if name == "fingerprints" else set()
+
+def measure(name, urls, logged, domains, results):
+    """ Put the seconds to snapshot, snapshot bytes and seconds to resume
+        on the results queue, for a pool with the named seen store.
+    """
+    directory = mkdtemp()
+    try:
+        pool = DefaultURLPool(seen=new_seen(name),
+                              checkpoint=Checkpoint(directory, "pool"))
+        pool.resume()
+        for i in xrange(urls + logged):
+            if i == urls:
+                t = time()
+                pool.checkpoint()
+                snapshot = time() - t
+            pool.add_url(StdURL("http://host{0}.example.com/page{1}.html"\
+                                .format(i % domains, i)))
+        pool._checkpoint.close()
+        size = os.path.getsize(os.path.join(directory, "pool.snapshot"))
+        del pool
+        pool = DefaultURLPool(seen=new_seen(name),
+                              checkpoint=Checkpoint(directory, "pool"))
+        t = time()
+        pool.resume()
+        resume = time() - t
+        assert sum([len(queue) for queue in pool._queues.itervalues()]) == \
+               urls + logged + domains
+        results.put((snapshot, size, resume))
+    finally:
+        rmtree(directory)
+
+
+if __name__ == "__main__":
+    urls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    logged = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    domains = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+
+    print "{0} URLs in the snapshot, {1} in the log, {2} domains".format(
+          urls, logged, domains)
+    print "{0:>12} {1:>12} {2:>12} {3:>12}".format("seen", "snapshot s",
+                                                   "snapshot MB", "resume s")
+    for name in ("set", "fingerprints"):
+        results = Queue()
+        process = Process(target=measure,
+                          args=(name, urls, logged, domains, results))
+        process.start()
+        snapshot, size, resume = results.get()
+        process.join()
+        print "{0:>12} {1:12.2f} {2:12.1f} {3:12.2f}".format(name, snapshot,
+              size / 2.0 ** 20, resume)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Benchmark compressed transfer and storage of content.
+
+    For a sample of pages (the files under a directory, by default the
+    crawler's test web site), reports:
+
+    * the bytes transferred without and with gzip Content-Encoding (level 6,
+      as servers commonly use, and only for text types, which are all most
+      servers compress), and the speed at which the crawler decodes gzipped
+      content as it is received (see crawler._Spool)
+    * the bytes stored by SQLImplementation with each codec (see
+      sql_crawler.codecs), and the speed of compressing and decompressing
+
+    Usage:
+
+        $ python compression.py [<directory>]
+"""
+
+import os
+import os.path
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+import synthetic_site
+from sql_crawler import codecs
+
+text_types = (".html", ".htm", ".xml", ".txt", ".css", ".js", ".json", ".php")
+
+
+def sample(directory):
+    """ Return a list of (is text, content) for the files under directory.
+    """
+    pages = list()
+    for path, _, names in os.walk(directory):
+        for name in names:
+            f = open(os.path.join(path, name), "rb")
+            try:
+                pages.append((os.path.splitext(name)[1].lower() in text_types,
+                              f.read()))
+            finally:
+                f.close()
+    return pages
+
+def receive(body, gzipped):
+    """ Receive the body through a spool as the crawler does, a chunk at a
+        time, with gzip Content-Encoding if gzipped.
+    """
+    spool = crawler._Spool(len(body), "gzip" if gzipped else None)
+    for i in xrange(0, len(body), crawler.read_size):
+        spool.write(body[i:i + crawler.read_size])
+    return spool.close().read()
+
+def mb(size, seconds):
+    return size / 2.0 ** 20 / max(seconds, 0.000001)
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else \
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "test")
+    crawler.max_content = 2 ** 31
+    pages = sample(directory)
+    size = sum([len(content) for _, content in pages])
+    texts = [content for text, content in pages if text]
+    print "{0} files ({1} text), {2} bytes".format(len(pages), len(texts),
+                                                   size)
+
+    # transfer
+    gzipped = [synthetic_site.gzip(content) for content in texts]
+    transfer = size - sum([len(content) for content in texts]) + \
+               sum([len(content) for content in gzipped])
+    t = time()
+    for content in texts:
+        receive(content, False)
+    plain = time() - t
+    t = time()
+    for body, content in zip(gzipped, texts):
+        assert receive(body, True) == content
+    decoding = time() - t
+    text_size = sum([len(content) for content in texts])
+    print "Transfer: {0} bytes with gzip ({1:.0%} saved), received at " \
+          "{2:.1f} MB/s ({3:.1f} MB/s without)".format(transfer,
+          1 - float(transfer) / size, mb(text_size, decoding),
+          mb(text_size, plain))
+
+    # storage
+    print "{0:>8} {1:>12} {2:>8} {3:>14} {4:>14}".format("codec", "bytes",
+          "saved", "compress MB/s", "decompress MB/s")
+    for name in sorted(codecs):
+        compressor, decompress = codecs[name]
+        t = time()
+        stored = list()
+        for _, content in pages:
+            c = compressor()
+            stored.append(c.compress(content) + c.flush())
+        compressing = time() - t
+        t = time()
+        for data in stored:
+            decompress(data)
+        decompressing = time() - t
+        total = sum([len(data) for data in stored])
+        print "{0:>8} {1:12} {2:8.0%} {3:14.1f} {4:14.1f}".format(name,
+              total, 1 - float(total) / size, mb(size, compressing),
+              mb(size, decompressing))
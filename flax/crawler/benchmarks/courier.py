@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark the HTTP traffic of the crawler's courier.
+
+    The thread pool engine crawls a synthetic site (see synthetic_site.py)
+    with and without persistent connections, and then recrawls it using
+    conditional GETs (keeping the duplicate detector, which holds the ETag and
+    Last-Modified values, from the previous crawl) starting from every page.
+    For each crawl the number of connections, requests and content bytes seen
+    by the server is printed.
+
+    Usage:
+
+        $ python courier.py [<hosts> [<pages per host> [<latency>]]]
+"""
+
+import os.path
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+import synthetic_site
+from stdurl import StdURL
+
+
+class CountingErrorHandler (crawler.DefaultErrorHandler):
+    """ Count errors by type.
+    """
+
+    def __init__(self):
+        crawler.DefaultErrorHandler.__init__(self)
+        self.by_type = dict()
+
+    def error(self, url, e):
+        name = e.__class__.__name__
+        self.by_type[name] = self.by_type.get(name, 0) + 1
+
+
+def crawl(name, urls, keep_alive, duplicate=None):
+    """ Crawl the site, printing the traffic seen by the server.
+    """
+    crawler.keep_alive = keep_alive
+    crawler.default_delay = 0
+    crawler.dump = crawler.DefaultDumper()
+    crawler.pool = crawler.DefaultURLPool()
+    crawler.follow = crawler.DefaultFollowDecider("^text/html$")
+    crawler.duplicate = duplicate or crawler.DefaultDuplicateDetector()
+    crawler.throttle = crawler.DefaultThrottle()
+    crawler.robots = crawler.DefaultRobotManager()
+    crawler.error = CountingErrorHandler()
+    for url in urls:
+        crawler.pool.add_url(StdURL(url))
+    before = synthetic_site.stats()
+    t = time()
+    crawler.start()
+    t = time() - t
+    # (the stats requests themselves add a connection each)
+    connections, requests, content = [y - x for x, y in
+                                      zip(before, synthetic_site.stats())]
+    errors = ", ".join(["{0} {1}".format(n, e) for e, n in
+                        sorted(crawler.error.by_type.items())])
+    print "{0:12} {1:6.1f}s {2:6} dumped {3:6} connections {4:6} requests " \
+          "{5:10} bytes {6}".format(name, t, crawler.dump.count,
+                                    connections - 1, requests, content, errors)
+
+
+if __name__ == "__main__":
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.005
+
+    process = synthetic_site.start(hosts, pages, latency=latency)
+    seeds = synthetic_site.seeds(hosts)
+    print "{0} hosts, {1} pages per host, {2}s latency".format(hosts, pages,
+                                                               latency)
+    try:
+        crawl("close", seeds, 0)
+        crawl("keep-alive", seeds, 100)
+        pages = ["{0}p{1}.html".format(seed, n) for seed in seeds
+                 for n in xrange(pages)]
+        crawl("recrawl", pages, 100, crawler.duplicate)
+    finally:
+        process.terminate()
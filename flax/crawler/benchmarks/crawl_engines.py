@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark the thread pool crawl engine (crawler.py) against the event
+    driven engine (event_crawler.py).
+
+    Each engine crawls the whole of a synthetic site (see synthetic_site.py)
+    served from another process, using the default in-memory crawler API
+    objects with no delay between requests to a host. Every request takes at
+    least the simulated latency, so the thread pool engine is limited to about
+    http_threads / latency URLs/sec, whereas the event engine is limited by the
+    number of hosts or by CPU.
+
+    Usage:
+
+        $ python crawl_engines.py [<hosts> [<pages per host> [<latency>]]]
+"""
+
+import os.path
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+import event_crawler
+import synthetic_site
+from stdurl import StdURL
+
+
+def crawl(site, engine):
+    """ Crawl the site with the given engine module, returning the number of
+        pages dumped and the time taken.
+    """
+    crawler.default_delay = 0
+    crawler.dump = crawler.DefaultDumper()
+    crawler.pool = crawler.DefaultURLPool()
+    crawler.follow = crawler.DefaultFollowDecider("^text/html$")
+    crawler.duplicate = crawler.DefaultDuplicateDetector()
+    crawler.throttle = crawler.DefaultThrottle()
+    crawler.robots = crawler.DefaultRobotManager()
+    crawler.error = crawler.DefaultErrorHandler()
+    for url in site:
+        crawler.pool.add_url(StdURL(url))
+    t = time()
+    engine.start()
+    return crawler.dump.count, time() - t
+
+
+if __name__ == "__main__":
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    process = synthetic_site.start(hosts, pages, latency=latency)
+    seeds = synthetic_site.seeds(hosts)
+    print "{0} hosts, {1} pages per host, {2}s latency".format(hosts, pages,
+                                                               latency)
+    try:
+        for name, engine, setting, values in (
+            ("threads", crawler, "http_threads", (10, 100)),
+            ("events", event_crawler, "max_fetches", (100, 1000))):
+            for value in values:
+                setattr(engine, setting, value)
+                count, t = crawl(seeds, engine)
+                print "{0:8} {1}={2:<5} {3:6} pages {4:7.1f}s " \
+                      "{5:8.1f} URLs/sec".format(name, setting, value, count,
+                                                 t, count / t)
+    finally:
+        process.terminate()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark crawling straight into a Xapian index with IndexDumper, against
+    crawling with the default dumper (which only counts pages).
+
+    The event driven engine crawls a synthetic site (see synthetic_site.py)
+    into a new database for each queue size, and the pages/sec is reported
+    along with how often and for how long the crawler was held up by a full
+    queue. Needs the xapian bindings and flax.core (the flaxcode directory
+    is put on the path).
+
+    Usage:
+
+        $ python index_pipeline.py [<hosts> [<pages per host> [<latency>]]]
+"""
+
+import os.path
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+directory = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(directory, ".."))
+sys.path.insert(0, os.path.join(directory, "..", "..", ".."))
+import xapian
+import crawler
+import event_crawler
+import synthetic_site
+from index_dumper import IndexDumper
+from stdurl import StdURL
+
+
+def crawl(site, dumper):
+    """ Crawl the site with the given dumper, returning the number of pages
+        dumped and the time taken (including closing the dumper).
+    """
+    crawler.default_delay = 0
+    crawler.dump = dumper
+    crawler.pool = crawler.DefaultURLPool()
+    crawler.follow = crawler.DefaultFollowDecider("^text/html$")
+    crawler.duplicate = crawler.DefaultDuplicateDetector()
+    crawler.throttle = crawler.DefaultThrottle()
+    crawler.robots = crawler.DefaultRobotManager()
+    crawler.error = crawler.DefaultErrorHandler()
+    for url in site:
+        crawler.pool.add_url(StdURL(url))
+    t = time()
+    event_crawler.start()
+    close = getattr(dumper, "close", None)
+    if close is not None:
+        close()
+    return dumper.count, time() - t
+
+
+if __name__ == "__main__":
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    process = synthetic_site.start(hosts, pages, latency=latency)
+    seeds = synthetic_site.seeds(hosts)
+    print "{0} hosts, {1} pages per host, {2}s latency".format(hosts, pages,
+                                                               latency)
+    print "{0:>12} {1:>8} {2:>10} {3:>8} {4:>8} {5:>10}".format("dumper",
+          "pages", "pages/sec", "indexed", "waits", "wait s")
+    try:
+        count, t = crawl(seeds, crawler.DefaultDumper())
+        print "{0:>12} {1:8} {2:10.1f}".format("count only", count, count / t)
+        for queue_size in (10, 100, 1000):
+            path = mkdtemp()
+            try:
+                dumper = IndexDumper(os.path.join(path, "db"), queue_size)
+                count, t = crawl(seeds, dumper)
+                indexed = xapian.Database(dumper.path).get_doccount()
+                print "{0:>12} {1:8} {2:10.1f} {3:8} {4:8} {5:10.1f}".format(
+                      "queue={0}".format(queue_size), count, count / t,
+                      indexed, dumper.waits, dumper.wait_time)
+            finally:
+                rmtree(path)
+    finally:
+        process.terminate()
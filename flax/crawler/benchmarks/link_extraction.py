@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark link extraction from large HTML pages, comparing the previous
+    DefaultHtmlParser (three regular expressions over the whole content as a
+    string) with the current one (the content spooled as it is read, and
+    parsed a chunk at a time by links.LinkExtractor).
+
+    Each page is written to a file first, and read from it in read_size
+    chunks as if from a response. Reports the time to read and parse the page,
+    the number of links found, and the growth of the process's peak resident
+    size (each parser runs in a separate process).
+
+    Usage:
+
+        $ python link_extraction.py [<largest page MB>]
+"""
+
+import os
+import os.path
+import resource
+import sys
+from multiprocessing import Process, Queue
+from re import compile as re_compile, IGNORECASE
+from tempfile import mkstemp
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+from crawler import DefaultHtmlParser, HTTPResource, _Spool
+from stdurl import StdURL
+
+
+class OldHtmlParser (object):
+    """ The previous DefaultHtmlParser implementation.
+    """
+
+    def __init__(self):
+        re = "<\s*{0}\s+{1}\s*=\s*(\"[^\"]+\"|'[^']+')\s*/?>"
+        self._a = re_compile(re.format("a", "href"), IGNORECASE)
+        self._img = re_compile(re.format("img", "src"), IGNORECASE)
+        meta = "<\s*meta\s+name\s*=\s*(\"robots\"|'robots')\s+" \
+               "content\s*=\s*(\"[^\"]+\"|'[^']+')\s*/?>"
+        self._meta = re_compile(meta, IGNORECASE)
+
+    def parse_resource(self, resource):
+        meta = self._meta.findall(resource.content)
+        if len(meta) > 0:
+            content = meta[0][1].lower()
+            if "noindex" in content:
+                resource.noindex = True
+            if "nofollow" in content:
+                resource.nofollow = True
+        for url in self._a.findall(resource.content) + \
+                   self._img.findall(resource.content):
+            yield url.strip("\"'")
+
+
+def write_page(path, size):
+    """ Write an HTML page of about size bytes to path, with a link or image
+        in each paragraph.
+    """
+    f = open(path, "wb")
+    f.write("<html><head><title>Large page</title>"
+            "<meta name=\"robots\" content=\"index,follow\"></head><body>\n")
+    n = 0
+    written = 0
+    while written < size:
+        if n % 5 == 0:
+            link = "<img src=\"/images/{0}.png\" alt=\"\">".format(n)
+        else:
+            link = "<a href=\"/pages/{0}.html\">page {0}</a>".format(n)
+        para = "<p>Paragraph {0} of text, with a {1} and some more words " \
+               "to make the page look like a real page.</p>\n".format(n, link)
+        f.write(para)
+        written += len(para)
+        n += 1
+    f.write("</body></html>\n")
+    f.close()
+
+def rss():
+    """ Return the peak resident size of the process in bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(name, path, results):
+    """ Put the seconds to read and parse the page at path, the number of
+        links found and the growth in peak resident size on the results queue.
+    """
+    url = StdURL("http://test/large.html")
+    res = HTTPResource(url, url, {"Content-Type": "text/html"})
+    before = rss()
+    t = time()
+    f = open(path, "rb")
+    if name == "old":
+        chunks = list()
+        while True:
+            chunk = f.read(crawler.read_size)
+            if len(chunk) == 0:
+                break
+            chunks.append(chunk)
+        res.content = "".join(chunks)
+        del chunks
+        parser = OldHtmlParser()
+    else:
+        spool = _Spool()
+        while True:
+            chunk = f.read(crawler.read_size)
+            if len(chunk) == 0:
+                break
+            spool.write(chunk)
+        res.body = spool.close()
+        parser = DefaultHtmlParser()
+    f.close()
+    links = 0
+    for link in parser.parse_resource(res):
+        links += 1
+    results.put((time() - t, links, rss() - before))
+
+
+if __name__ == "__main__":
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    crawler.max_content = largest * 2 ** 21
+
+    print "{0:>8} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}".format("page MB",
+          "parser", "seconds", "MB/sec", "links", "peak MB")
+    size = 1
+    while size <= largest:
+        fd, path = mkstemp()
+        os.close(fd)
+        try:
+            write_page(path, size * 2 ** 20)
+            for name in ("old", "new"):
+                results = Queue()
+                process = Process(target=measure, args=(name, path, results))
+                process.start()
+                seconds, links, peak = results.get()
+                process.join()
+                print "{0:8} {1:>8} {2:10.2f} {3:10.1f} {4:10} " \
+                      "{5:10.1f}".format(size, name, seconds, size / seconds,
+                                         links, peak / 2.0 ** 20)
+        finally:
+            os.remove(path)
+        size *= 10
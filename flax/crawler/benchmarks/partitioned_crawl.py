@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Benchmark crawling with several processes (see partition.py).
+
+    A synthetic site (see synthetic_site.py) is crawled by 1, 2 and 4
+    processes, each using the default in-memory crawler API objects with no
+    delay between requests to a host, and the event driven engine. Reports
+    the URLs crawled (including robots.txt) and forwarded by each process, and
+    the aggregate throughput. The site is served by one process, so on a
+    machine with few cores it will limit the speed up.
+
+    Usage:
+
+        $ python partitioned_crawl.py [<hosts> [<pages per host> [<latency>]]]
+"""
+
+import os.path
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+import event_crawler
+import partition
+import synthetic_site
+
+
+def setup(index):
+    """ Set the crawler API objects for a crawler process.
+    """
+    crawler.default_delay = 0
+    crawler.dump = crawler.DefaultDumper()
+    crawler.pool = crawler.DefaultURLPool()
+    crawler.follow = crawler.DefaultFollowDecider("^text/html$")
+    crawler.duplicate = crawler.DefaultDuplicateDetector()
+    crawler.throttle = crawler.DefaultThrottle()
+    crawler.robots = crawler.DefaultRobotManager()
+    crawler.error = crawler.DefaultErrorHandler()
+
+
+if __name__ == "__main__":
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+
+    process = synthetic_site.start(hosts, pages, latency=latency)
+    seeds = synthetic_site.seeds(hosts)
+    print "{0} hosts, {1} pages per host, {2}s latency".format(hosts, pages,
+                                                               latency)
+    try:
+        for processes in (1, 2, 4):
+            print "{0} processes:".format(processes)
+            t = time()
+            stats = partition.crawl(processes, setup, seeds, event_crawler)
+            partition.report(stats, time() - t)
+    finally:
+        process.terminate()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Benchmark the freshness of pages visited again by RecrawlPolicy.
+
+    Simulates a host whose pages change at random (as Poisson processes):
+    a fraction of them (40% by default, roughly as found by Cho and
+    Garcia-Molina, "The evolution of the web", 2000) hardly ever, and the rest
+    with mean times between changes spread evenly on a log scale from an hour
+    to a hundred days. The pages are first crawled in turn, and then visited
+    again within a budget of visits per day. Compares visiting them in turn
+    (each every pages / budget days) with scheduling them as SQLImplementation
+    does with a RecrawlPolicy (the most overdue first, up to the budget in
+    each day). Reports the fraction of the time a page's stored copy is up to
+    date, averaged over pages, the number of visits made, and the number
+    which found the page changed.
+
+    Usage:
+
+        $ python recrawl_schedule.py [<pages> [<visits per day> [<days> [<static>]]]]
+"""
+
+import os
+import sys
+from heapq import heapify, heappush, heappop
+from math import exp, log
+from random import Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from recrawl import RecrawlPolicy
+
+day = 86400
+
+
+class Page (object):
+    """ A simulated page, and what a crawler has seen of it.
+    """
+
+    def __init__(self, rate, rnd):
+        self.rate = rate
+        self.rnd = rnd
+        self.visits = 0
+        self.changes = 0
+        self.elapsed = 0
+        self.last_visit = 0
+        self.stale = rnd.expovariate(rate) # time of the first unseen change
+        self.fresh = 0 # seconds up to date before the last visit
+
+    def visit(self, t):
+        """ Visit the page at time t, returning whether it had changed.
+        """
+        changed = self.stale <= t
+        self.fresh += min(self.stale, t) - self.last_visit
+        self.visits += 1
+        self.changes += 1 if changed else 0
+        self.elapsed += t - self.last_visit
+        self.last_visit = t
+        self.stale = t + self.rnd.expovariate(self.rate)
+        return changed
+
+    def freshness(self, t):
+        """ Return the fraction of the time up to t that the page was fresh.
+        """
+        return (self.fresh + min(self.stale, t) - self.last_visit) / float(t)
+
+
+def pages(n, static, seed=0):
+    """ Return n pages, the given fraction of which change once in ten years
+        on average, and the rest from once an hour to once in a hundred days.
+    """
+    rnd = Random(seed)
+    low, high = log(3600), log(100 * day)
+    return [Page(1.0 / (3650 * day) if rnd.random() < static else
+                 1.0 / exp(rnd.uniform(low, high)), rnd) for _ in xrange(n)]
+
+def uniform(pages, budget, days):
+    """ Visit the pages in turn, budget a day.
+    """
+    i = 0
+    for slot in xrange(budget * days):
+        pages[i].visit((slot + 1) * float(day) / budget)
+        i = (i + 1) % len(pages)
+
+def adaptive(pages, budget, days):
+    """ Visit the pages when the policy says they are due, the most overdue
+        first, up to budget a day.
+    """
+    policy = RecrawlPolicy(initial=len(pages) * day / budget, period=day,
+                           budget=budget)
+    # first visits as for uniform()
+    due = [(float(i + 1) * day / budget, i) for i in xrange(len(pages))]
+    heapify(due)
+    for slot in xrange(budget * days):
+        t = (slot + 1) * float(day) / budget
+        if due[0][0] > t:
+            continue
+        _, i = heappop(due)
+        page = pages[i]
+        page.visit(t)
+        heappush(due, (t + policy.interval(page.visits, page.changes,
+                                           page.elapsed), i))
+
+def report(name, pages, days):
+    freshness = sum([page.freshness(days * day) for page in pages]) / \
+                len(pages)
+    print "{0:>10} {1:10.3f} {2:10d} {3:10d}".format(name, freshness,
+          sum([page.visits for page in pages]),
+          sum([page.changes for page in pages]))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    budget = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    days = int(sys.argv[3]) if len(sys.argv) > 3 else 90
+    static = float(sys.argv[4]) if len(sys.argv) > 4 else 0.4
+
+    print "{0} pages ({1:.0%} static), {2} visits a day, {3} days".format(
+          n, static, budget, days)
+    print "{0:>10} {1:>10} {2:>10} {3:>10}".format("schedule", "freshness",
+                                                   "visits", "changes")
+    for name, schedule in (("uniform", uniform), ("adaptive", adaptive)):
+        simulated = pages(n, static)
+        schedule(simulated, budget, days)
+        report(name, simulated, days)
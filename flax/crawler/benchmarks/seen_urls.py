@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark the stores of seen URLs in seen.py against a set of StdURLs.
+
+    Each store has the given number of URLs added, and then a million URLs
+    that were added and a million that were not are looked up. Each store is
+    run in its own process, and the growth in peak resident memory is
+    reported. The set of StdURLs is limited to a million URLs, as it would not
+    fit in memory otherwise.
+
+    Usage:
+
+        $ python seen_urls.py [<URLs> [<directory for disk-backed tables>]]
+"""
+
+import os.path
+import sys
+from multiprocessing import Process, Queue
+from resource import getrusage, RUSAGE_SELF
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from seen import FingerprintSet, BloomFilter
+from stdurl import StdURL
+
+
+def url(i):
+    return "http://host{0}.example.com/page/{1}.html".format(i % 100000, i)
+
+
+def run(name, make, count, results):
+    """ Fill a store and time lookups, putting the results on the queue.
+    """
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    seen = make()
+    t = time()
+    for i in xrange(count):
+        seen.add(make.url(i))
+    add = count / (time() - t)
+    lookups = min(count, 1000000)
+    t = time()
+    for i in xrange(lookups):
+        assert make.url(i * (count / lookups)) in seen
+    hit = lookups / (time() - t)
+    t = time()
+    false_positives = 0
+    for i in xrange(count, count + lookups):
+        if make.url(i) in seen:
+            false_positives += 1
+    miss = lookups / (time() - t)
+    memory = (getrusage(RUSAGE_SELF).ru_maxrss - rss) * 1024
+    seen.close() if hasattr(seen, "close") else None
+    results.put((name, count, add, hit, miss, false_positives / float(lookups),
+                 memory))
+
+
+class Store (object):
+    """ Factory for a store, with the function used to make its URLs.
+    """
+
+    def __init__(self, factory, url=url):
+        self.factory = factory
+        self.url = url
+
+    def __call__(self):
+        return self.factory()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000000
+    directory = sys.argv[2] if len(sys.argv) > 2 else mkdtemp()
+
+    stores = (
+        ("set of StdURL", min(count, 1000000),
+         Store(set, lambda i: StdURL(url(i)))),
+        ("FingerprintSet", count, Store(FingerprintSet)),
+        ("FingerprintSet (disk)", count,
+         Store(lambda: FingerprintSet(directory))),
+        ("BloomFilter 1%", count, Store(lambda: BloomFilter(count, 0.01))),
+        ("BloomFilter 0.1%", count, Store(lambda: BloomFilter(count, 0.001))),
+    )
+    print "{0:22} {1:>10} {2:>10} {3:>10} {4:>10} {5:>8} {6:>12}".format(
+          "store", "URLs", "adds/s", "hits/s", "misses/s", "FP rate",
+          "bytes/URL")
+    try:
+        for name, n, make in stores:
+            results = Queue()
+            process = Process(target=run, args=(name, make, n, results))
+            process.start()
+            name, n, add, hit, miss, fp_rate, memory = results.get()
+            process.join()
+            print "{0:22} {1:10} {2:10.0f} {3:10.0f} {4:10.0f} {5:8.4f} " \
+                  "{6:12.1f}".format(name, n, add, hit, miss, fp_rate,
+                                     memory / float(n))
+    finally:
+        rmtree(directory)
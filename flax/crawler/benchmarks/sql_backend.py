@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark crawling into the SQL database of sql_crawler.py, before and
+    after batching writes and URL claims.
+
+    The synthetic site (see synthetic_site.py) is crawled with the event driven
+    engine, using the SQLImplementation for every part of the crawler API as
+    sql_crawler.py does. "before" commits after every statement, with the
+    default rollback journal, and claims one URL at a time (as the SQL
+    implementation used to, although with the indexes the schema now needs);
+    "after" uses the defaults.
+
+    Usage:
+
+        $ python sql_backend.py [<hosts> [<pages per host> [<latency>]]]
+"""
+
+import os.path
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+import event_crawler
+import synthetic_site
+from crawler import DefaultFollowDecider, DefaultHtmlParser
+from sql_crawler import SQLImplementation
+from stdurl import StdURL
+
+
+def crawl(site, sql):
+    """ Crawl the site into the database, returning the number of pages stored
+        and the time taken.
+    """
+    crawler.default_delay = 0
+    crawler.dump = sql
+    crawler.pool = sql
+    crawler.follow = DefaultFollowDecider("^text/html$")
+    crawler.duplicate = sql
+    crawler.parsers = (DefaultHtmlParser(), )
+    crawler.throttle = sql
+    crawler.robots = sql
+    crawler.error = sql
+    for url in site:
+        sql.add_url(StdURL(url))
+    t = time()
+    event_crawler.start()
+    sql.commit()
+    t = time() - t
+    return sql.select("SELECT COUNT(*) FROM content"), t
+
+
+if __name__ == "__main__":
+    hosts = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    pages = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+
+    process = synthetic_site.start(hosts, pages, latency=latency)
+    seeds = synthetic_site.seeds(hosts)
+    print "{0} hosts, {1} pages per host, {2}s latency".format(hosts, pages,
+                                                               latency)
+    directory = mkdtemp()
+    try:
+        for name in ("before", "after"):
+            path = os.path.join(directory, name + ".db")
+            if name == "before":
+                sql = SQLImplementation(path, batch_size=1, wal=False,
+                                        claim_size=1)
+            else:
+                sql = SQLImplementation(path)
+            sql.initialise()
+            count, t = crawl(seeds, sql)
+            sql.close()
+            print "{0:8} {1:6} pages {2:7.1f}s {3:8.1f} URLs/sec".format(
+                  name, count, t, count / t)
+    finally:
+        process.terminate()
+        rmtree(directory)
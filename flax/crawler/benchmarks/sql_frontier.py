@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark handing out URLs from the SQL frontier of sql_crawler.py as the
+    number of queued URLs grows.
+
+    A database is filled with URLs spread over a number of domains (which have
+    all had robots.txt fetched), and then URLs are taken with next_url(),
+    calling last_time() for each as the crawler does. The batched claims of
+    SQLImplementation are compared with the previous next_url (a join ordered
+    by domain.time for every URL).
+
+    Usage:
+
+        $ python sql_frontier.py [<max URLs> [<domains> [<takes>]]]
+"""
+
+import os.path
+import sys
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+from sql_crawler import SQLImplementation
+from stdurl import StdURL
+
+
+def old_next_url(sql):
+    """ The previous SQLImplementation.next_url (for domains which have had
+        robots.txt fetched).
+    """
+    domain_id, url_id, url = sql.select("SELECT domain_id, " \
+        "url.id, url FROM domain, url WHERE url.domain_id=domain.id " \
+        "AND url.time=0 ORDER BY domain.time LIMIT 1")
+    sql.execute("UPDATE url SET time=? WHERE id=?", int(time()), url_id)
+    return StdURL(url)
+
+def measure(path, size, domains, takes, next_url):
+    """ Fill a database with size URLs, and take takes URLs with next_url.
+        Returns URLs taken per second.
+    """
+    sql = SQLImplementation(path)
+    sql.initialise()
+    for i in xrange(size):
+        sql.add_url(StdURL("http://host{0}.example.com/page{1}.html".format(
+                           i % domains, i)))
+    sql.execute("UPDATE domain SET time=1")
+    sql.commit()
+    t = time()
+    for _ in xrange(takes):
+        url = next_url(sql)
+        sql.last_time(url.netloc)
+    rate = takes / (time() - t)
+    sql.close()
+    return rate
+
+
+if __name__ == "__main__":
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    domains = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    takes = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    crawler.default_delay = 0
+
+    print "{0:>10} {1:>14} {2:>14}".format("URLs", "old URLs/sec",
+                                           "claim URLs/sec")
+    directory = mkdtemp()
+    try:
+        size = 10000
+        while size <= max_size:
+            rates = list()
+            for name, next_url in (("old", old_next_url),
+                                   ("claim", SQLImplementation.next_url)):
+                path = os.path.join(directory, "{0}-{1}.db".format(name, size))
+                rates.append(measure(path, size, domains, takes, next_url))
+            print "{0:10} {1:14.1f} {2:14.1f}".format(size, *rates)
+            size *= 10
+    finally:
+        rmtree(directory)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" A synthetic web site for crawler benchmarks.
+
+    Each of a number of hosts is a port on 127.0.0.1, serving a fixed number
+    of generated HTML pages which link to random pages on random hosts. Every
+    response is delayed to simulate network latency, and robots.txt allows
+    everything. The server is a single asyncore loop, so that it can hold
+    thousands of connections open at once.
+
+    Connections are kept alive unless the client asks otherwise, and pages have
+    an ETag and Last-Modified header, so conditional requests get a 304 Not
+    Modified response. Pages are gzipped if the request's Accept-Encoding
+    allows it. The path /_stats on any host returns the number of
+    connections, requests and content bytes served so far.
+
+    Usage:
+
+        $ python synthetic_site.py [<hosts> [<pages per host> [<latency>]]]
+"""
+
+import asyncore
+import socket
+from gzip import GzipFile
+from heapq import heappush, heappop
+from multiprocessing import Process
+from random import Random
+from StringIO import StringIO
+from time import time, sleep
+
+base_port = 18000
+last_modified = "Sat, 01 Jan 2011 00:00:00 GMT"
+
+
+def gzip(content):
+    """ Return the content gzipped.
+    """
+    out = StringIO()
+    gzipped = GzipFile(fileobj=out, mode="wb")
+    gzipped.write(content)
+    gzipped.close()
+    return out.getvalue()
+
+def page(host, n, hosts, pages, links, size):
+    """ Return the HTML for page n of the given host (0-based indices).
+    """
+    rnd = Random(host * pages + n)
+    body = ["<html><head><title>Host {0} page {1}</title></head><body>"\
+            .format(host, n)]
+    for _ in xrange(links):
+        target = rnd.randrange(hosts)
+        body.append('<a href="http://127.0.0.1:{0}/p{1}.html">link</a>'\
+                    .format(base_port + target, rnd.randrange(pages)))
+    text = "host {0} page {1} ".format(host, n)
+    body.append("<p>{0}</p></body></html>".format(
+                (text * (size / len(text) + 1))[:size]))
+    return "".join(body)
+
+
+class _Handler (asyncore.dispatcher):
+    """ Serve a single request on a connection.
+    """
+
+    def __init__(self, site, sock, host):
+        asyncore.dispatcher.__init__(self, sock, map=site.socket_map)
+        self.site = site
+        self.host = host
+        self.data = ""
+        self.out = ""
+        self.done = False
+        self.keep_alive = False
+        site.connections += 1
+
+    def readable(self):
+        return not self.done
+
+    def writable(self):
+        return len(self.out) > 0
+
+    def handle_read(self):
+        self.data += self.recv(4096)
+        if "\r\n\r\n" in self.data:
+            self.done = True
+            self.site.later(self.respond)
+
+    def respond(self):
+        head, _, self.data = self.data.partition("\r\n\r\n")
+        lines = head.split("\r\n")
+        method, path, version = lines[0].split(" ", 2)
+        headers = dict()
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        self.keep_alive = version == "HTTP/1.1" and \
+                          headers.get("connection", "").lower() != "close"
+        n = self.site.page_number(path)
+        extra = ""
+        if n is not None:
+            etag = '"{0}-{1}"'.format(self.host, n)
+            extra = "ETag: {0}\r\nLast-Modified: {1}\r\n".format(
+                    etag, last_modified)
+            if headers.get("if-none-match") == etag or \
+               headers.get("if-modified-since") == last_modified:
+                status, content_type, content = "304 Not Modified", None, ""
+            else:
+                status, content_type = "200 OK", "text/html"
+                content = page(self.host, n, self.site.hosts, self.site.pages,
+                               self.site.links, self.site.size)
+                if "gzip" in headers.get("accept-encoding", ""):
+                    content = gzip(content)
+                    extra += "Content-Encoding: gzip\r\n"
+        elif path == "/robots.txt":
+            status, content_type = "200 OK", "text/plain"
+            content = "User-agent: *\nDisallow:\n"
+        elif path == "/_stats":
+            status, content_type = "200 OK", "text/plain"
+            content = "{0} {1} {2}".format(self.site.connections,
+                                           self.site.requests,
+                                           self.site.bytes)
+        else:
+            status, content_type = "404 Not Found", "text/plain"
+            content = "Not found"
+        if path != "/_stats":
+            self.site.requests += 1
+        if content_type is not None:
+            extra += "Content-Type: {0}\r\nContent-Length: {1}\r\n".format(
+                     content_type, len(content))
+        self.out = "HTTP/1.1 {0}\r\n{1}Connection: {2}\r\n\r\n".format(
+                   status, extra, "keep-alive" if self.keep_alive else "close")
+        if method != "HEAD":
+            self.out += content
+            if path != "/_stats":
+                self.site.bytes += len(content)
+
+    def handle_write(self):
+        self.out = self.out[self.send(self.out):]
+        if len(self.out) == 0:
+            if not self.keep_alive:
+                self.close()
+            elif "\r\n\r\n" in self.data:
+                self.site.later(self.respond)
+            else:
+                self.done = False
+
+    def handle_close(self):
+        self.close()
+
+    def handle_error(self):
+        self.close()
+
+
+class _Listener (asyncore.dispatcher):
+    """ Accept connections for a host.
+    """
+
+    def __init__(self, site, host):
+        asyncore.dispatcher.__init__(self, map=site.socket_map)
+        self.site = site
+        self.host = host
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(("127.0.0.1", base_port + host))
+        self.listen(1024)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            _Handler(self.site, pair[0], self.host)
+
+
+class Site (object):
+    """ The synthetic site.
+    """
+
+    def __init__(self, hosts, pages, links=10, latency=0.05, size=2000):
+        self.hosts = hosts
+        self.pages = pages
+        self.links = links
+        self.latency = latency
+        self.size = size
+        self.socket_map = dict()
+        self.connections = 0
+        self.requests = 0
+        self.bytes = 0
+        self._timers = list()
+        for host in xrange(hosts):
+            _Listener(self, host)
+
+    def later(self, fn):
+        """ Call fn after the simulated latency.
+        """
+        heappush(self._timers, (time() + self.latency, fn))
+
+    def serve(self):
+        """ Serve forever.
+        """
+        while True:
+            wait = self._timers[0][0] - time() if self._timers else 0.1
+            asyncore.loop(max(wait, 0), True, self.socket_map, 1)
+            now = time()
+            while self._timers and self._timers[0][0] <= now:
+                heappop(self._timers)[1]()
+
+    def page_number(self, path):
+        """ Return the page number for a path, or None if there is no such
+            page.
+        """
+        if path == "/":
+            return 0
+        if not path.startswith("/p") or not path.endswith(".html"):
+            return None
+        try:
+            n = int(path[2:-5])
+        except ValueError:
+            return None
+        return n if 0 <= n < self.pages else None
+
+
+def seeds(hosts):
+    """ Return the home page URL of each host.
+    """
+    return ["http://127.0.0.1:{0}/".format(base_port + host)
+            for host in xrange(hosts)]
+
+def stats():
+    """ Return the number of connections, requests and content bytes served
+        so far by a site started with start().
+    """
+    connection = socket.create_connection(("127.0.0.1", base_port))
+    connection.sendall("GET /_stats HTTP/1.0\r\n\r\n")
+    data = ""
+    while True:
+        chunk = connection.recv(4096)
+        if len(chunk) == 0:
+            break
+        data += chunk
+    connection.close()
+    return [int(x) for x in data.split("\r\n\r\n", 1)[1].split()]
+
+def _serve(*args):
+    Site(*args).serve()
+
+def start(hosts, pages, links=10, latency=0.05, size=2000):
+    """ Start serving the site in another process, returning the process
+        (which should be terminated when finished with).
+    """
+    process = Process(target=_serve,
+                      args=(hosts, pages, links, latency, size))
+    process.daemon = True
+    process.start()
+    # wait for the last host to be listening
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1",
+                                      base_port + hosts - 1)).close()
+            return process
+        except socket.error:
+            sleep(0.1)
+
+
+if __name__ == "__main__":
+    from sys import argv
+
+    hosts = int(argv[1]) if len(argv) > 1 else 100
+    pages = int(argv[2]) if len(argv) > 2 else 100
+    latency = float(argv[3]) if len(argv) > 3 else 0.05
+    print "Serving {0} hosts on ports {1}-{2}".format(hosts, base_port,
+                                                    base_port + hosts - 1)
+    Site(hosts, pages, latency=latency).serve()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark DefaultURLPool as the number of queued URLs grows.
+
+    For each pool size, the pool is filled with URLs spread over a number of
+    domains, and then URLs are taken with next_url(). The per-domain heap
+    frontier is compared with the previous implementation (a list, picking
+    with randint and removing with list.remove), which is only run up to a
+    million URLs as each next_url() call is O(n).
+
+    To fit 10 million URLs in memory, a minimal stand-in for StdURL is used
+    (the pool only needs the scheme, netloc and selector, and hashing).
+
+    Usage:
+
+        $ python url_pool.py [<max URLs> [<domains>]]
+"""
+
+import gc
+import os.path
+import sys
+from random import randint
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+import crawler
+from crawler import DefaultURLPool
+from stdurl import StdURL
+
+
+class URL (object):
+    """ Minimal stand-in for StdURL.
+    """
+
+    __slots__ = ("scheme", "netloc", "selector")
+
+    def __init__(self, netloc, selector):
+        self.scheme = "http"
+        self.netloc = netloc
+        self.selector = selector
+
+    def __eq__(self, other):
+        return self.netloc == other.netloc and self.selector == other.selector
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.netloc, self.selector))
+
+
+class ListURLPool (object):
+    """ The previous DefaultURLPool implementation (add_url and next_url).
+    """
+
+    def __init__(self):
+        self._urls = list()
+        self._seen = set()
+        self._robots = list()
+
+    def add_url(self, url):
+        self._urls.append(url)
+        self._seen.add(url)
+        robots_url = StdURL("http://{0}/robots.txt".format(url.netloc))
+        if robots_url not in self._seen:
+            self._robots.append(robots_url)
+            self._seen.add(robots_url)
+
+    def next_url(self):
+        if len(self._robots) > 0:
+            url = self._robots[0]
+            self._robots.remove(url)
+            return url
+        if len(self._urls) == 0:
+            return None
+        url = self._urls[randint(0, len(self._urls) - 1)]
+        self._urls.remove(url)
+        return url
+
+
+def measure(pool, size, domains, takes):
+    """ Fill the pool with size URLs, and take takes URLs (after all robots.txt
+        URLs have been taken). Returns microseconds per add_url and next_url.
+    """
+    netlocs = ["host{0}.example.com".format(i) for i in xrange(domains)]
+    t = time()
+    for i in xrange(size):
+        pool.add_url(URL(netlocs[i % domains], "/page{0}.html".format(i)))
+    add = (time() - t) / size
+    for _ in xrange(domains):
+        pool.next_url()
+    t = time()
+    for _ in xrange(takes):
+        assert pool.next_url() is not None
+    take = (time() - t) / takes
+    return add * 1e6, take * 1e6
+
+
+if __name__ == "__main__":
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    domains = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    crawler.default_delay = 0
+
+    print "{0:>10} {1:>14} {2:>14} {3:>14} {4:>14}".format("URLs",
+          "heap add us", "heap next us", "list add us", "list next us")
+    size = 100000
+    while size <= max_size:
+        heap_add, heap_next = measure(DefaultURLPool(), size, domains,
+                                      min(size - domains, 100000))
+        gc.collect()
+        if size <= 1000000:
+            list_add, list_next = measure(ListURLPool(), size, domains, 100)
+            gc.collect()
+            list_add = "{0:14.2f}".format(list_add)
+            list_next = "{0:14.2f}".format(list_next)
+        else:
+            list_add = list_next = "{0:>14}".format("-")
+        print "{0:10} {1:14.2f} {2:14.2f} {3} {4}".format(size, heap_add,
+              heap_next, list_add, list_next)
+        size *= 10
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Benchmark StdURL against the previous implementation (a class with a
+    __dict__, which formatted its string form again for every hash and
+    comparison).
+
+    Reports microseconds to create a URL from a string, to join a relative
+    link to a parent URL, to hash a URL and to look one up in a set, and the
+    memory used by each URL (from the growth of the process, which includes
+    the strings it refers to).
+
+    Usage:
+
+        $ python urls.py [<URLs>]
+"""
+
+import os.path
+import resource
+import sys
+from multiprocessing import Process, Queue
+from time import time
+from urlparse import urljoin, urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+from stdurl import StdURL
+
+
+class OldURL (object):
+    """ The previous StdURL implementation.
+    """
+
+    def __init__(self, url, parent=None):
+        if parent is not None:
+            if isinstance(parent, OldURL):
+                parent = str(parent)
+            if isinstance(url, OldURL):
+                url = str(url)
+            url = urljoin(parent, url)
+        if isinstance(url, OldURL):
+            parts = url
+        else:
+            parts = urlsplit(url.strip())
+        self.scheme = parts.scheme
+        self.hostname = parts.hostname
+        self.port = parts.port
+        self.netloc = parts.netloc
+        self.path = parts.path
+        self.query = parts.query
+        if self.path.find(".") == -1:
+            self.extension = ""
+        else:
+            self.extension = self.path.split(".")[-1]
+        query_str = "?{0}".format(self.query) if self.query else ""
+        self.selector = "{0}{1}".format(self.path, query_str)
+
+    def __eq__(self, other):
+        if other is None:
+            return False
+        return self.scheme == other.scheme and self.netloc == other.netloc \
+               and self.selector == other.selector
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __str__(self):
+        return "{0}://{1}{2}".format(self.scheme, self.netloc, self.selector)
+
+
+def rss():
+    """ Return the peak resident size of the process in bytes.
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(cls, n, results):
+    """ Put microseconds per create, join, hash and set lookup, and bytes per
+        URL, for n URLs of class cls on the results queue. Run in a separate
+        process for each class, so that the memory used can be measured.
+    """
+    strings = ["http://host{0}.example.com/dir/page{1}.html?id={1}".format(
+               i % 1000, i) for i in xrange(n)]
+    links = ["../other/page{0}.html".format(i) for i in xrange(n)]
+    before = rss()
+    t = time()
+    urls = [cls(s) for s in strings]
+    create = (time() - t) / n
+    size = float(rss() - before) / n
+    t = time()
+    for url, link in zip(urls, links):
+        cls(link, url)
+    join = (time() - t) / n
+    t = time()
+    for url in urls:
+        hash(url)
+    hashing = (time() - t) / n
+    seen = set(urls)
+    t = time()
+    for url in urls:
+        url in seen
+    lookup = (time() - t) / n
+    results.put((create * 1e6, join * 1e6, hashing * 1e6, lookup * 1e6, size))
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    print "{0:>8} {1:>10} {2:>10} {3:>10} {4:>10} {5:>10}".format("",
+          "create us", "join us", "hash us", "lookup us", "bytes/URL")
+    for name, cls in (("old", OldURL), ("StdURL", StdURL)):
+        results = Queue()
+        process = Process(target=measure, args=(cls, n, results))
+        process.start()
+        result = results.get()
+        process.join()
+        print "{0:>8} {1:10.2f} {2:10.2f} {3:10.2f} {4:10.2f} " \
+              "{5:10.0f}".format(name, *result)
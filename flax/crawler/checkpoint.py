@@ -0,0 +1,195 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Checkpoints of the state of crawler API objects, so that a crawl can be
+    resumed after it is stopped or crashes (see DefaultURLPool for example).
+
+    A checkpoint is a snapshot of the whole state of an object, and an
+    append-only log of the changes made to it since. Each snapshot is written
+    to a new file which then replaces the old one, and starts a new log, so
+    that after a crash there is always a snapshot and a log which follows on
+    from it (less the records written in the last flush_interval seconds).
+"""
+
+import cPickle
+from os import fsync, remove, rename
+from os.path import exists, join
+from time import time
+
+flush_interval = 1.0 # seconds between flushes of the log
+
+
+class Checkpoint (object):
+    """ Snapshots and log of an object's state, in files in a directory named
+        after the object.
+
+        Nothing is logged until load() has been called, so that changes made
+        before resuming from the checkpoint do not get mixed up with it.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.generation = 0 # of the snapshot, which the log follows on from
+        self._log = None
+        self._flushed = 0
+
+    def load(self):
+        """ Return the state from the latest snapshot (None if there is none)
+            and a list of the records logged since, and start logging.
+        """
+        state = None
+        path = join(self.directory, self.name + ".snapshot")
+        if exists(path):
+            f = open(path, "rb")
+            try:
+                self.generation, state = cPickle.load(f)
+            finally:
+                f.close()
+        records = list()
+        path = self._log_path(self.generation)
+        if exists(path):
+            f = open(path, "r+b")
+            try:
+                end = 0
+                while True:
+                    try:
+                        records.append(cPickle.load(f))
+                    except EOFError:
+                        break
+                    except Exception:
+                        # the last record was cut short by a crash
+                        break
+                    end = f.tell()
+                f.truncate(end)
+            finally:
+                f.close()
+        self._log = open(path, "ab")
+        return state, records
+
+    def log(self, record):
+        """ Append a record (a tuple of strings and numbers) to the log.
+        """
+        if self._log is None:
+            return
+        cPickle.dump(record, self._log, 2)
+        now = time()
+        if now - self._flushed >= flush_interval:
+            self._log.flush()
+            self._flushed = now
+
+    def snapshot(self, state):
+        """ Write a snapshot of the whole state (which must be picklable), and
+            start a new log.
+        """
+        path = join(self.directory, self.name + ".snapshot")
+        f = open(path + ".new", "wb")
+        try:
+            cPickle.dump((self.generation + 1, state), f, 2)
+            f.flush()
+            fsync(f.fileno())
+        finally:
+            f.close()
+        rename(path + ".new", path)
+        if self._log is not None:
+            self._log.close()
+        old = self._log_path(self.generation)
+        self.generation += 1
+        self._log = open(self._log_path(self.generation), "ab")
+        if exists(old):
+            remove(old)
+
+    def close(self):
+        """ Flush and close the log.
+        """
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _log_path(self, generation):
+        return join(self.directory, "{0}.log-{1}".format(self.name,
+                                                          generation))
+
+
+if __name__ == "__main__":
+    from shutil import rmtree
+    from tempfile import mkdtemp
+
+    directory = mkdtemp()
+    try:
+        checkpoint = Checkpoint(directory, "test")
+        checkpoint.log(("ignored", ))
+        assert checkpoint.load() == (None, [])
+        checkpoint.log(("a", 1))
+        checkpoint.log(("b", "2"))
+        checkpoint.close()
+        checkpoint = Checkpoint(directory, "test")
+        assert checkpoint.load() == (None, [("a", 1), ("b", "2")])
+        checkpoint.snapshot({"a": 1, "b": "2"})
+        checkpoint.log(("c", 3.0))
+        checkpoint.close()
+        # a record cut short is dropped, and logging carries on after it
+        f = open(checkpoint._log_path(1), "ab")
+        f.write(cPickle.dumps(("d", "x" * 100), 2)[:-10])
+        f.close()
+        checkpoint = Checkpoint(directory, "test")
+        assert checkpoint.load() == ({"a": 1, "b": "2"}, [("c", 3.0)])
+        checkpoint.log(("e", 5))
+        checkpoint.close()
+        checkpoint = Checkpoint(directory, "test")
+        assert checkpoint.load() == ({"a": 1, "b": "2"}, [("c", 3.0),
+                                                          ("e", 5)])
+        assert not exists(checkpoint._log_path(0))
+    finally:
+        rmtree(directory)
+
+    # a URL pool resumes after a crash, with the handed out URL queued again
+    import crawler
+    from crawler import DefaultURLPool
+    from stdurl import StdURL
+    crawler.default_delay = 0
+    directory = mkdtemp()
+    try:
+        pool = DefaultURLPool(checkpoint=Checkpoint(directory, "pool"))
+        pool.add_url(StdURL("http://a/1"))
+        pool.resume()
+        pool.add_url(StdURL("http://a/2"))
+        assert str(pool.next_url()) == "http://a/robots.txt"
+        pool.done_url(StdURL("http://a/robots.txt"))
+        pool.checkpoint()
+        assert str(pool.next_url()) == "http://a/1"
+        pool.add_url(StdURL("http://b/1"))
+        pool._checkpoint.close()
+        for seed in ("http://a/2", "http://c/1"):
+            pool = DefaultURLPool(checkpoint=Checkpoint(directory, "pool"))
+            pool.add_url(StdURL(seed))
+            pool.resume()
+            urls = list()
+            while pool.next_time() is not None:
+                url = pool.next_url()
+                if url is not None:
+                    assert isinstance(url, StdURL)
+                    urls.append(str(url))
+            expected = ["http://a/1", "http://a/2", "http://b/robots.txt",
+                        "http://b/1"]
+            if seed == "http://c/1":
+                expected += ["http://c/robots.txt", "http://c/1"]
+            assert sorted(urls) == sorted(expected), urls
+            pool._checkpoint.close()
+    finally:
+        rmtree(directory)
+    print "Test passed"
@@ -17,18 +17,24 @@
 """ Module for web crawling.
 """
 
-from urllib2 import urlopen, Request, URLError, HTTPError
-from httplib import IncompleteRead
-from robotparser import RobotFileParser
+from urllib2 import URLError, HTTPError
+from httplib import HTTPConnection, HTTPSConnection, HTTPException, \
+                    IncompleteRead
+from socket import error as SocketError
 from time import time, sleep
 from hashlib import md5
-from random import randint
-from re import compile as re_compile, IGNORECASE
+from heapq import heappush, heappop, heapify
+from collections import deque
+from re import compile as re_compile
 from new import instancemethod
 from threading import Thread, Lock, current_thread
 from inspect import currentframe
 from sys import exc_info, exc_clear
+from tempfile import SpooledTemporaryFile
+from zlib import decompressobj, error as ZlibError, MAX_WBITS
 
+from links import LinkExtractor
+from robots import RobotRules, RobotsCache
 from stdurl import StdURL
 
 
@@ -36,6 +42,16 @@ silent = True # if False, output debug to stdout
 user_agent = "FlaxBot/0.1 (see http://www.flax.co.uk/)"
 default_delay = 4 # default time between requests for a domain
 http_threads = 10 # number of crawler threads
+http_timeout = 60 # seconds before a blocking HTTP operation is abandoned
+keep_alive = 100 # maximum number of idle persistent HTTP connections
+max_redirects = 10 # number of redirects followed before giving up
+checkpoint_interval = 300 # seconds between checkpoints of crawler API objects
+max_content = 10485760 # bytes of content above which a response is rejected
+spool_content = 1048576 # bytes of content above which it is kept on disk
+read_size = 65536 # bytes of content read or parsed at a time
+accept_encoding = "gzip, deflate" # Accept-Encoding request header, or None
+
+_REDIRECTS = (301, 302, 303, 307)
 
 
 class CrawlerError (Exception):
@@ -80,6 +96,27 @@ class NotHandled (CrawlerError):
     pass
 
 
+class NotModified (CrawlerError):
+    """ Exception raised when a conditional GET finds that a resource has not
+        changed since it was last fetched.
+    """
+    pass
+
+
+class ContentTooLarge (CrawlerError):
+    """ Exception raised when a response has more than max_content bytes of
+        content.
+    """
+    pass
+
+
+class BadContentEncoding (CrawlerError):
+    """ Exception raised when the content of a response can not be decoded
+        according to its Content-Encoding header.
+    """
+    pass
+
+
 class DefaultDumper (object):
     """ Default implementation of a dumper, which maintains a count of dumped
         resources and the total number of characters.
@@ -97,35 +134,74 @@ class DefaultDumper (object):
         """ Dump a resource.
         """
         self.count += 1
-        self.chars += len(resource.content)
+        for chunk in resource.chunks():
+            self.chars += len(chunk)
 
 
 class DefaultURLPool (object):
     """ Default implementation of a URL pool, maintaining URLs in memory.
-        Also maintains a dictionary of URL to error encountered.
+
+        URLs are queued in first-in first-out order for each domain, and
+        domains with queued URLs are kept in a heap ordered by the time at
+        which the next URL may be fetched, so that next_url() only returns a
+        URL that can be fetched now, in O(log domains) time.
+
+        The pool can be checkpointed (see checkpoint.py), in which case the
+        URLs added, handed out and done are logged, and the crawler snapshots
+        the pool every checkpoint_interval seconds and resumes from the
+        checkpoint when it starts. Queued URLs are held as strings after
+        resuming, and only parsed when they are handed out, and the seen set
+        is pickled (so for a fast resume of a large crawl, use a FingerprintSet
+        from seen.py).
         
         If the attribute api_lock is a Lock, calls to the API are synchronized.
     """
     
     api_lock = Lock()
         
-    def __init__(self):
-        self._urls = list()
-        self._seen = set()
-        self._robots = list()
+    def __init__(self, delay=None, seen=None, checkpoint=None):
+        """ URLs for a domain are returned no more often than every delay
+            seconds (default_delay if None).
+
+            URLs that have been added are remembered in seen, which should
+            support add() and the in operator - by default a set, but for
+            large crawls see the seen.py module.
+
+            checkpoint is a Checkpoint, or None if the pool is not to be
+            checkpointed.
+        """
+        self.delay = delay
+        self._queues = dict() # netloc to deque of URLs
+        self._heap = list() # (next fetch time, netloc) for non-empty queues
+        self._times = dict() # netloc to next fetch time, for all domains
+        self._seen = seen if seen is not None else set()
+        self._checkpoint = checkpoint
+        self._fetching = set() # URLs handed out and not done, if checkpointed
         self.repeat_count = 0
         self.link_count = 0
         self.redirect_count = 0
         
     def add_url(self, url):
-        """ Add a StdURL to the pool.
+        """ Add a StdURL to the pool. The robots.txt URL for the domain is
+            queued first, if this is the first URL for the domain.
         """
-        self._urls.append(url)
+        self._add(url)
+        if self._checkpoint is not None:
+            self._checkpoint.log(("a", str(url)))
+
+    def _add(self, url):
+        queue = self._queues.get(url.netloc)
+        if queue is None:
+            queue = self._queues[url.netloc] = deque()
+            if url.netloc not in self._times:
+                self._times[url.netloc] = 0
+                robots_url = StdURL("http://{0}/robots.txt".format(url.netloc))
+                if robots_url not in self._seen and robots_url != url:
+                    queue.append(robots_url)
+                    self._seen.add(robots_url)
+            heappush(self._heap, (self._times[url.netloc], url.netloc))
+        queue.append(url)
         self._seen.add(url)
-        robots_url = StdURL("http://{0}/robots.txt".format(url.netloc))
-        if robots_url not in self._seen:
-            self._robots.append(robots_url)
-            self._seen.add(robots_url)
         
     def add_link(self, source, target):
         """ Add a link between the source StdURL and the target StdURL. Note
@@ -151,19 +227,115 @@ class DefaultURLPool (object):
             raise DuplicateURL()
 
     def next_url(self):
-        """ Return a StdURL from the to-do collection. If none are left,
-            return None.
-        """
-        if len(self._robots) > 0:
-            url = self._robots[0]
-            self._robots.remove(url)
-            return url
-        if len(self._urls) == 0:
+        """ Return a StdURL from the to-do collection that can be fetched now.
+            If there are none, return None.
+        """
+        now = time()
+        if len(self._heap) == 0 or self._heap[0][0] > now:
             return None
-        url = self._urls[randint(0, len(self._urls) - 1)]
-        self._urls.remove(url)
+        netloc = heappop(self._heap)[1]
+        t = now + (self.delay if self.delay is not None else default_delay)
+        url = self._take(netloc, t)
+        if netloc in self._queues:
+            heappush(self._heap, (t, netloc))
+        if self._checkpoint is not None:
+            self._fetching.add(str(url))
+            self._checkpoint.log(("n", netloc, t))
+        if isinstance(url, str):
+            # queued before resuming from a checkpoint
+            url = StdURL(url)
+        return url
+
+    def _take(self, netloc, t):
+        """ Remove and return the first URL queued for a domain, which can
+            next be fetched at time t.
+        """
+        queue = self._queues[netloc]
+        url = queue.popleft()
+        self._times[netloc] = t
+        if len(queue) == 0:
+            del self._queues[netloc]
         return url
 
+    def done_url(self, url):
+        """ Record that the crawler has finished with a StdURL returned by
+            next_url().
+        """
+        if self._checkpoint is not None:
+            self._fetching.discard(str(url))
+            self._checkpoint.log(("d", str(url)))
+
+    def next_time(self):
+        """ Return the time at which next_url() will next return a StdURL, or
+            None if there are no URLs left.
+        """
+        if len(self._heap) == 0:
+            return None
+        return self._heap[0][0]
+
+    def checkpoint(self):
+        """ Snapshot the pool, if it is checkpointed.
+        """
+        if self._checkpoint is None:
+            return
+        queues = dict([(netloc, [str(url) for url in queue])
+                       for netloc, queue in self._queues.iteritems()])
+        self._checkpoint.snapshot((queues, self._times, self._seen,
+                                   self._fetching, self.repeat_count,
+                                   self.link_count, self.redirect_count))
+
+    def resume(self):
+        """ Restore the pool from its checkpoint, if it is checkpointed. URLs
+            which were handed out but not done are queued again, and URLs
+            added before resuming are kept unless they had already been seen.
+        """
+        if self._checkpoint is None:
+            return
+        state, records = self._checkpoint.load()
+        added = [url for queue in self._queues.itervalues() for url in queue]
+        self._queues = dict()
+        if state is not None:
+            queues, self._times, self._seen, self._fetching, \
+                self.repeat_count, self.link_count, self.redirect_count = state
+            for netloc, queue in queues.iteritems():
+                self._queues[netloc] = deque(queue)
+        else:
+            # the seen store is kept, as it may be persistent (see seen.py)
+            self._times = dict()
+        replayed = set()
+        for record in records:
+            if record[0] == "a":
+                replayed.add(record[1])
+                self._add(StdURL(record[1]))
+            elif record[0] == "n":
+                self._fetching.add(str(self._take(record[1], record[2])))
+            elif record[0] == "d":
+                self._fetching.discard(record[1])
+            elif record[0] == "r":
+                self._fetching.discard(record[1])
+                self._requeue(record[1])
+        self._heap = [(self._times[netloc], netloc) for netloc in self._queues]
+        heapify(self._heap)
+        for url in list(self._fetching):
+            self._fetching.discard(url)
+            self._requeue(url)
+            self._checkpoint.log(("r", url))
+        for url in added:
+            if str(url) not in replayed and \
+               (state is None or url not in self._seen):
+                self.add_url(url)
+
+    def _requeue(self, url):
+        """ Queue a URL string (handed out before resuming) at the front of
+            the queue for its domain.
+        """
+        netloc = StdURL(url).netloc
+        queue = self._queues.get(netloc)
+        if queue is None:
+            queue = self._queues[netloc] = deque()
+            heappush(self._heap, (self._times.get(netloc, 0), netloc))
+        queue.appendleft(url)
+
 
 class DefaultErrorHandler (object):
     """ Default implementation of an error handler.
@@ -198,10 +370,11 @@ class DefaultFollowDecider (object):
 
     def follow_resource(self, resource):
         """ If the resource should not be followed, raise URLNotFollowed. This
-            is called twice, once after the HEAD request (when resource.content
-            is None) and again after the GET request.
+            is called twice, once when the headers have been received (when
+            resource.has_content() is False) and again when the content has
+            been received.
         """
-        if resource.content is not None:
+        if resource.has_content():
             return
         if not self._re.match(resource.content_type()):
             raise URLNotFollowed()
@@ -216,87 +389,120 @@ class DefaultFollowDecider (object):
 
 class DefaultDuplicateDetector (object):
     """ Default implementation of a duplicate detector, using an in-memory
-        set of ETags and content hashes.
+        set of ETags and content hashes, which can be checkpointed (see
+        DefaultURLPool).
         
         If the attribute api_lock is a Lock, calls to the API are synchronized.
     """
     
     api_lock = Lock()
     
-    def __init__(self):
+    def __init__(self, checkpoint=None):
         self.etags = set()
         self.hash_set = set()
+        self.validators_by_url = dict() # by URL string
+        self._checkpoint = checkpoint
         
     def duplicate_resource(self, resource):
         """ Check a web resource for duplication. This will be called twice,
-            once after the HEAD request (when resource.content is None) and
-            again after the GET request.
+            once when the headers have been received (when
+            resource.has_content() is False) and again when the content has
+            been received.
         """
-        if resource.content is None:
+        if not resource.has_content():
             # check the ETag, if there is one
             etag = resource.headers.get("ETag")
             if etag is not None:
                 if etag in self.etags:
                     raise DuplicateResource()
                 self.etags.add(etag)
+                if self._checkpoint is not None:
+                    self._checkpoint.log(("e", etag))
             return
         # now check and update the hash set
         hasher = md5()
-        hasher.update(resource.content)
+        for chunk in resource.chunks():
+            hasher.update(chunk)
         value = hasher.digest()
         if value in self.hash_set:
             raise DuplicateResource()
         self.hash_set.add(value)
+        url = str(resource.origin_url)
+        validators = (resource.headers.get("ETag"),
+                      resource.headers.get("Last-Modified"))
+        self.validators_by_url[url] = validators
+        if self._checkpoint is not None:
+            self._checkpoint.log(("h", value, url, validators))
+
+    def validators(self, url):
+        """ Return the ETag and Last-Modified header values (either of which
+            may be None) of the resource last fetched from the given StdURL,
+            for making a conditional GET, or None if it has not been fetched.
+        """
+        return self.validators_by_url.get(str(url))
+
+    def checkpoint(self):
+        """ Snapshot the detector, if it is checkpointed.
+        """
+        if self._checkpoint is not None:
+            self._checkpoint.snapshot((self.etags, self.hash_set,
+                                       self.validators_by_url))
+
+    def resume(self):
+        """ Restore the detector from its checkpoint, if it is checkpointed.
+        """
+        if self._checkpoint is None:
+            return
+        state, records = self._checkpoint.load()
+        if state is not None:
+            self.etags, self.hash_set, self.validators_by_url = state
+        for record in records:
+            if record[0] == "e":
+                self.etags.add(record[1])
+            elif record[0] == "h":
+                self.hash_set.add(record[1])
+                self.validators_by_url[record[2]] = record[3]
 
 
 class DefaultHtmlParser (object):
-    """ Default implementation of an HTML link parser, using a (not very
-        sophisticated) regular expression.
+    """ Default implementation of an HTML link parser, which parses the
+        content a chunk at a time (see links.py).
         
         If the attribute api_lock is a Lock, calls to the API are synchronized.
     """
     
     content_types = ("text/html", "application/xhtml+xml")
     
-    def __init__(self):
-        # note that {0}, {1} are not part of the regular expression
-        re = "<\s*{0}\s+{1}\s*=\s*(\"[^\"]+\"|'[^']+')\s*/?>"
-        self._a = re_compile(re.format("a", "href"), IGNORECASE)
-        self._img = re_compile(re.format("img", "src"), IGNORECASE)
-        meta = "<\s*meta\s+name\s*=\s*(\"robots\"|'robots')\s+" \
-               "content\s*=\s*(\"[^\"]+\"|'[^']+')\s*/?>"
-        self._meta = re_compile(meta, IGNORECASE)
-        
     def parse_resource(self, resource):
-        """ Yield target URLs from the given HTML content, and set noindex and
-            nofollow on the resource if necessary. Raise NotHandled if the
-            resource can not be handled by this parser.
+        """ Yield target URLs from the given HTML content, and set noindex,
+            nofollow and base on the resource if necessary. Raise NotHandled
+            if the resource can not be handled by this parser.
         """
         if resource.content_type() not in DefaultHtmlParser.content_types:
             raise NotHandled()
-        meta = self._meta.findall(resource.content)
-        if len(meta) > 0:
-            content = meta[0][1].lower()
-            if "noindex" in content:
-                resource.noindex = True
-            if "nofollow" in content:
-                resource.nofollow = True
-        for url in self._a.findall(resource.content) + \
-                   self._img.findall(resource.content):
-            yield url.strip("\"'")
+        extractor = LinkExtractor()
+        for chunk in resource.chunks():
+            links = extractor.feed(chunk)
+            resource.noindex = resource.noindex or extractor.noindex
+            resource.nofollow = resource.nofollow or extractor.nofollow
+            if resource.base is None and extractor.base is not None:
+                resource.base = StdURL(extractor.base, resource.url)
+            for url in links:
+                yield url
         
             
 class DefaultThrottle (object):
     """ Default implementation of a throttle, maintaining a in-memory map from
-        domain last fetch time.
+        domain last fetch time, which can be checkpointed (see DefaultURLPool).
         
         If the attribute api_lock is a Lock, calls to the API are synchronized.
     """
     
     api_lock = Lock()
     
-    def __init__(self):
+    def __init__(self, checkpoint=None):
         self.hosts = dict()
+        self._checkpoint = checkpoint
         
     def last_time(self, netloc):
         """ Return the last time a request was made to the specified domain,
@@ -304,45 +510,91 @@ class DefaultThrottle (object):
             the first request.
         """
         t = self.hosts.get(netloc)
-        self.hosts[netloc] = time()
+        self.hosts[netloc] = now = time()
+        if self._checkpoint is not None:
+            self._checkpoint.log((netloc, now))
         return t or 0
 
+    def checkpoint(self):
+        """ Snapshot the throttle, if it is checkpointed.
+        """
+        if self._checkpoint is not None:
+            self._checkpoint.snapshot(self.hosts)
+
+    def resume(self):
+        """ Restore the throttle from its checkpoint, if it is checkpointed.
+        """
+        if self._checkpoint is None:
+            return
+        state, records = self._checkpoint.load()
+        if state is not None:
+            self.hosts = state
+        for netloc, t in records:
+            self.hosts[netloc] = t
+
 
 class DefaultRobotManager (object):
     """ Default implementation of a manager for robots.txt information.
-        Maintains an in-memory map from netloc to an instance of
-        RobotExclusionRulesParser.
+        Maintains an in-memory cache (see robots.py) from netloc to an
+        instance of RobotRules, refetching robots.txt in the background when
+        the rules are more than expiry seconds old.
+        The rules can be checkpointed (see DefaultURLPool).
         
         If the attribute api_lock is a Lock, calls to the API are synchronized.
     """
     
     api_lock = Lock()
     
-    def __init__(self):
-        self._robots = dict()
+    def __init__(self, expiry=86400, checkpoint=None):
+        self._robots = RobotsCache(None, expiry, refresh=self._refresh)
+        self._checkpoint = checkpoint
 
     def parse_robots(self, netloc, content):
         """ Parse the given robots.txt content and store against the given
             domain. If content is None, any URL will be allowed.
         """
-        robot = RobotFileParser()
-        if content is not None:
-            robot.parse(content.split("\n"))
-        self._robots[netloc] = robot
+        self._robots.put(netloc, RobotRules(content, user_agent))
+        if self._checkpoint is not None:
+            self._checkpoint.log((netloc, content))
         
     def check_robots(self, url):
         """ If no attempt has yet been made to fetch robots.txt for the domain
             of the specified StdURL, raise NoRobots. Otherwise, if access to
             the URL is not allowed according to the stored robots.txt, raise
-            URLNotAllowed. Otherwise, return the crawl delay required by
-            robots.txt, or None if not specified.
+            URLNotAllowed. Otherwise, return the delay between requests to the
+            domain (the Crawl-delay from robots.txt if it is longer than
+            default_delay).
         """
-        robot = self._robots.get(url.netloc)
-        if robot is None:
+        rules = self._robots.get(url.netloc)
+        if rules is None:
             raise NoRobots()
-        if not robot.can_fetch(user_agent, url.path):
+        if not rules.can_fetch(url.path):
             raise URLNotAllowed()
-        return default_delay
+        return rules.delay(default_delay)
+
+    def _refresh(self, netloc):
+        """ Fetch robots.txt for a domain again (called in the background).
+        """
+        url = StdURL("http://{0}/robots.txt".format(netloc))
+        return RobotRules(fetch_robots(url), user_agent)
+
+    def checkpoint(self):
+        """ Snapshot the rules, if they are checkpointed.
+        """
+        if self._checkpoint is not None:
+            self._checkpoint.snapshot(self._robots.items())
+
+    def resume(self):
+        """ Restore the rules from their checkpoint, if they are
+            checkpointed.
+        """
+        if self._checkpoint is None:
+            return
+        state, records = self._checkpoint.load()
+        for netloc, rules in state or ():
+            self._robots.put(netloc, rules)
+        for netloc, content in records:
+            self._robots.put(netloc, RobotRules(content, user_agent))
 
 
 dump = DefaultDumper()
@@ -378,15 +630,56 @@ def _sync(arg, *args):
 
 class HTTPResource (object):
     """ Class for storing the results of a successful HTTP GET.
+
+        The content is either set as a string, or body is set to a file
+        holding it (which may be on disk if it is large). It is best read with
+        chunks(), as the content attribute reads all of it into a string.
     """
     
     def __init__(self, origin_url, url, headers):
         self.origin_url = origin_url
         self.url = url
         self.headers = headers
-        self.content = None
+        self.body = None
         self.noindex = False
         self.nofollow = False
+        self.base = None # StdURL links are relative to, from <base href>
+        self._content = None
+
+    def _get_content(self):
+        if self.body is None:
+            return self._content
+        self.body.seek(0)
+        return self.body.read()
+
+    def _set_content(self, content):
+        self.body = None
+        self._content = content
+
+    content = property(_get_content, _set_content)
+
+    def has_content(self):
+        """ Return whether the content has been received (without reading it,
+            as the content attribute does).
+        """
+        return self.body is not None or self._content is not None
+
+    def chunks(self, size=None):
+        """ Yield the content in strings of at most size (default read_size)
+            bytes.
+        """
+        size = size or read_size
+        if self.body is None:
+            content = self._content or ""
+            for i in xrange(0, len(content), size):
+                yield content[i:i + size]
+            return
+        self.body.seek(0)
+        while True:
+            chunk = self.body.read(size)
+            if len(chunk) == 0:
+                break
+            yield chunk
 
     def content_type(self):
         """ Return the primary content type from the Content-Type header.
@@ -398,7 +691,8 @@ class HTTPResource (object):
 
     def check(self):
         """ Check for duplicate (redirected) URL and content, and whether to
-            follow (raises exceptions if not).
+            follow (raises exceptions if not). This is called once the headers
+            have been received, and again once the content has been received.
         """
         if self.url != self.origin_url:
             _sync(pool.check_url, self.url)
@@ -406,30 +700,263 @@ class HTTPResource (object):
         _sync(follow.follow_resource, self)
 
 
-class _Courier (Request):
-    """ Class for using urllib2 to request web page content via HTTP.
+class _Courier (object):
+    """ Class for requesting web page content via HTTP, reusing persistent
+        connections to each domain.
+
+        The response headers are available as soon as fetch() returns, and the
+        content can then be read, or the response abandoned by calling close()
+        without reading it (which closes the connection).
     """
 
     def __init__(self, url):
         """ Initialise the courier for the given page.
         """
-        Request.__init__(self, str(url).replace(" ", "%20"))
-        self._method = None
-        self.add_header("User-Agent", user_agent)
-    
-    def get_method(self):
-        """ Specifies the method used by urllib2 when making an HTTP request.
+        self.url = url
+        self._connection = None
+        self._response = None
+
+    def fetch(self, method, validators=None):
+        """ Send a request of the specified type (GET, HEAD) for the URL,
+            following redirects (self.url is set to the final URL). Returns the
+            HTTP response once the headers have been received.
+
+            If validators is an (ETag, Last-Modified) tuple, as returned by the
+            duplicate detector, a conditional request is made and NotModified
+            is raised if the resource has not changed.
+
+            Can raise URLError (including when there are more than
+            max_redirects redirects), HTTPError, NotModified or IncompleteRead.
         """
-        return self._method
+        headers = {"User-Agent": user_agent}
+        if accept_encoding is not None:
+            headers["Accept-Encoding"] = accept_encoding
+        if validators is not None:
+            etag, last_modified = validators
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if last_modified is not None:
+                headers["If-Modified-Since"] = last_modified
+        for redirects in xrange(max_redirects + 1):
+            response = self._request(method, headers)
+            location = response.getheader("Location")
+            if response.status not in _REDIRECTS or location is None:
+                break
+            self.read()
+            self.close()
+            if redirects == max_redirects:
+                raise URLError("too many redirects")
+            self.url = StdURL(location, self.url)
+            _debug("Redirect to", self.url)
+        if response.status == 304:
+            self.read()
+            self.close()
+            raise NotModified()
+        if not 200 <= response.status < 300:
+            self.read()
+            self.close()
+            raise HTTPError(str(self.url), response.status, response.reason,
+                            response.msg, None)
+        return response
+
+    def spool(self):
+        """ Read the content of the response a chunk at a time into a file
+            (see _Spool), and return the file.
+
+            Can raise URLError, IncompleteRead, ContentTooLarge or
+            BadContentEncoding.
+        """
+        try:
+            spool = _Spool(self._response.getheader("Content-Length"),
+                           self._response.getheader("Content-Encoding"))
+            while True:
+                chunk = self._response.read(read_size)
+                if len(chunk) == 0:
+                    return spool.close()
+                spool.write(chunk)
+        except IncompleteRead:
+            raise
+        except (HTTPException, SocketError) as e:
+            raise URLError(e)
 
-    def fetch(self, method):
-        """ Send a request of the specified type (HEAD, GET) for the given URL.
-            Returns the HTTP response.
-            
-            Can raise URLError, HTTPError or IncompleteRead.
+    def read(self):
+        """ Read and return the content of the response.
+
+            Can raise URLError or IncompleteRead.
+        """
+        try:
+            return self._response.read()
+        except IncompleteRead:
+            raise
+        except (HTTPException, SocketError) as e:
+            raise URLError(e)
+
+    def close(self):
+        """ Finish with the response, keeping the connection open for the next
+            request to the domain if the content has been read.
+        """
+        if self._connection is None:
+            return
+        if self._response.isclosed() and not self._response.will_close:
+            _release_connection(self.url, self._connection)
+        else:
+            self._connection.close()
+        self._connection = None
+        self._response = None
+
+    def _request(self, method, headers):
+        """ Send a request for self.url on a persistent connection, retrying
+            once on a new connection if a reused one has been closed by the
+            server.
         """
-        self._method = method
-        return urlopen(self)
+        selector = (self.url.selector or "/").replace(" ", "%20")
+        while True:
+            self._connection, reused = _get_connection(self.url)
+            try:
+                self._connection.request(method, selector, headers=headers)
+                self._response = self._connection.getresponse()
+                return self._response
+            except (HTTPException, SocketError) as e:
+                self._connection.close()
+                self._connection = None
+                if not reused:
+                    raise URLError(e)
+                exc_clear()
+
+
+class _Spool (object):
+    """ Class for receiving the content of a response, held in memory until
+        there are more than spool_content bytes, and then in a temporary file.
+        Content with a gzip or deflate Content-Encoding is decoded as it is
+        received, so the file holds the decoded content (and max_content
+        applies to that, as well as to the Content-Length).
+    """
+
+    def __init__(self, length=None, encoding=None):
+        """ length is the value of the Content-Length header, and encoding of
+            the Content-Encoding header, if any.
+
+            Can raise ContentTooLarge.
+        """
+        try:
+            length = int(length)
+        except (TypeError, ValueError):
+            length = None
+        if length is not None and length > max_content:
+            raise ContentTooLarge(length)
+        self.size = 0
+        self.received = 0 # bytes received, before decoding
+        encoding = (encoding or "").strip().lower()
+        if encoding in ("gzip", "x-gzip"):
+            self._decoder = decompressobj(16 + MAX_WBITS)
+        elif encoding == "deflate":
+            self._decoder = decompressobj()
+        else:
+            self._decoder = None
+        # deflate content received before any is decoded, in case it has to
+        # be decoded again without the zlib header
+        self._head = "" if encoding == "deflate" else None
+        self._file = SpooledTemporaryFile(spool_content)
+
+    def write(self, data):
+        """ Add data to the content.
+
+            Can raise ContentTooLarge or BadContentEncoding.
+        """
+        self.received += len(data)
+        if self._decoder is None:
+            self._write(data)
+            return
+        if self._head is not None:
+            self._head += data
+        try:
+            try:
+                self._decode(data)
+            except ZlibError:
+                if self._head is None:
+                    raise
+                # some servers send deflate without the zlib header
+                data, self._head = self._head, None
+                self._decoder = decompressobj(-MAX_WBITS)
+                self._decode(data)
+        except ZlibError as e:
+            self._file.close()
+            raise BadContentEncoding(e)
+
+    def _decode(self, data):
+        # decode a chunk at a time, so that a small response can not expand
+        # into a huge string
+        while True:
+            decoded = self._decoder.decompress(data, read_size)
+            data = self._decoder.unconsumed_tail
+            if len(decoded) > 0:
+                self._head = None
+            self._write(decoded)
+            if len(data) == 0 and len(decoded) < read_size:
+                break
+
+    def _write(self, data):
+        self.size += len(data)
+        if self.size > max_content:
+            self._file.close()
+            raise ContentTooLarge(self.size)
+        self._file.write(data)
+
+    def close(self):
+        """ Return the file holding the content, at the start.
+
+            Can raise ContentTooLarge or BadContentEncoding.
+        """
+        if self._decoder is not None:
+            try:
+                self._write(self._decoder.flush())
+            except ZlibError as e:
+                self._file.close()
+                raise BadContentEncoding(e)
+            self._decoder = None
+        self._file.seek(0)
+        return self._file
+
+
+_connections = dict() # idle persistent connections by (scheme, netloc)
+_connections_lock = Lock()
+
+def _get_connection(url):
+    """ Return an idle persistent connection for the scheme and domain of the
+        given StdURL, or a new connection if there isn't one, and whether the
+        connection has been used before.
+    """
+    key = (url.scheme, url.netloc)
+    _connections_lock.acquire()
+    try:
+        if key in _connections:
+            return _connections.pop(key)[1], True
+    finally:
+        _connections_lock.release()
+    if url.scheme == "http":
+        return HTTPConnection(url.hostname, url.port, timeout=http_timeout), \
+               False
+    if url.scheme == "https":
+        return HTTPSConnection(url.hostname, url.port, timeout=http_timeout), \
+               False
+    raise URLError("unsupported scheme: {0}".format(url.scheme))
+
+def _release_connection(url, connection):
+    """ Keep a connection open for the next request to the scheme and domain
+        of the given StdURL, closing the least recently used idle connection
+        if there are more than keep_alive.
+    """
+    key = (url.scheme, url.netloc)
+    _connections_lock.acquire()
+    try:
+        if key in _connections:
+            _connections[key][1].close()
+        _connections[key] = (time(), connection)
+        if len(_connections) > keep_alive:
+            oldest = min(_connections, key=lambda k: _connections[k][0])
+            _connections.pop(oldest)[1].close()
+    finally:
+        _connections_lock.release()
 
 
 class CrawlerThread (Thread):
@@ -470,27 +997,37 @@ def _crawl():
         except:
             # error is not lost - see _debug()
             stop()
+            continue
+        _done_url(url)
 
 def _get_robots(url):
     """ Fetch a robots.txt URL and send the content to the robots module.
     """
     # initialise the throttle for this domain
     _sync(throttle.last_time, url.netloc)
-    # make a GET request for robots.txt
+    # send content to robots for parsing
+    _sync(robots.parse_robots, url.netloc, fetch_robots(url))
+
+def fetch_robots(url):
+    """ Fetch a robots.txt URL, returning the content, or None if there is no
+        robots.txt (404 Not Found). Robots managers can call this to refresh
+        their rules.
+
+        Can raise URLError, HTTPError, IncompleteRead, ContentTooLarge or
+        BadContentEncoding.
+    """
     _debug("HTTP GET", url)
     courier = _Courier(url)
     try:
-        response = courier.fetch("GET")
+        courier.fetch("GET")
     except HTTPError as e:
         if e.code == 404:
-            content = None
-        else:
-            raise
-    else:
-        content = response.read()
-        response.close()
-    # send content to robots for parsing
-    _sync(robots.parse_robots, url.netloc, content)
+            return None
+        raise
+    try:
+        return courier.spool().read()
+    finally:
+        courier.close()
         
 def _get_url(url):
     """ Fetch a URL. Note that this is synchronized by the engine such that
@@ -505,31 +1042,38 @@ def _get_url(url):
         _debug("Sleep for", wait)
         sleep(wait)
     _sync(throttle.last_time, url.netloc)
-    # make a HEAD request to check the headers
+    # make a (conditional) GET request, and read the headers
     courier = _Courier(url)
-    _debug("HTTP HEAD", url)
-    response = courier.fetch("HEAD")
-    resource = HTTPResource(url, StdURL(response.url), response.headers)
-    # check for a redirect
-    if resource.url != resource.origin_url:
-        _sync(pool.add_redirect, resource.origin_url, resource.url)
-    # check whether to reject on (redirected) URL, headers or content type
-    resource.check()
-    # make a GET request for the resource, and replace details just in case
     _debug("HTTP GET", url)
-    response = courier.fetch("GET")
-    resource.url = StdURL(response.url)
-    resource.headers = response.headers
-    resource.content = response.read()
-    response.close()
+    validators = getattr(duplicate, "validators", None)
+    if validators is not None:
+        validators = _sync(validators, url)
+    response = courier.fetch("GET", validators)
+    try:
+        resource = HTTPResource(url, courier.url, response.msg)
+        # check for a redirect
+        if resource.url != resource.origin_url:
+            _sync(pool.add_redirect, resource.origin_url, resource.url)
+        # check whether to reject on (redirected) URL, headers or content
+        # type, abandoning the response if so
+        resource.check()
+        resource.body = courier.spool()
+    finally:
+        courier.close()
     # check whether to reject on (redirected) URL, headers or content
     resource.check()
+    _handle_resource(url, resource)
+
+def _handle_resource(url, resource):
+    """ Parse a fetched resource for links, adding them to the URL pool, then
+        dump the resource.
+    """
     # attempt to parse the content
     parent = StdURL(resource.url)
     for parser in parsers:
         try:
             for rel_url in _sync(parser.parse_resource, resource):
-                target = StdURL(rel_url, parent)
+                target = StdURL(rel_url, resource.base or parent)
                 try:
                     if target.scheme != parent.scheme:
                         raise URLNotFollowed()
@@ -601,14 +1145,22 @@ def start():
     """
     global t0
     t0 = time()
+    _waiters.clear() # left over from a previous crawl
+    _resume()
     for _ in xrange(http_threads):
         _threads.append(CrawlerThread())
     for thread in _threads:
         thread.start()
+    last = time()
     while len(_threads) > 0:
         thread = _threads[0]
-        thread.join()
-        _threads.remove(thread)
+        thread.join(1)
+        if not thread.is_alive():
+            _threads.remove(thread)
+        if time() - last >= checkpoint_interval:
+            _checkpoint()
+            last = time()
+    _checkpoint()
 
 def stop():
     """ Gracefully stop the crawler prematurely. Crawler threads will still
@@ -633,6 +1185,48 @@ def _wait():
         waiter.acquire()
         _lock.acquire()
 
+def _next_time():
+    """ Return the time at which the URL pool will next have a URL that can be
+        fetched, or None if it has none or does not say (the next_time method
+        is optional).
+    """
+    next_time = getattr(pool, "next_time", None)
+    if next_time is None:
+        return None
+    return _sync(next_time)
+
+def _api_objects():
+    """ Return the crawler API objects.
+    """
+    return [dump, pool, follow, duplicate, throttle, robots, error] + \
+           list(parsers)
+
+def _resume():
+    """ Restore the crawler API objects from their checkpoints (the resume
+        method is optional).
+    """
+    for obj in _api_objects():
+        resume = getattr(obj, "resume", None)
+        if resume is not None:
+            _sync(resume)
+
+def _checkpoint():
+    """ Checkpoint the crawler API objects (the checkpoint method is
+        optional).
+    """
+    for obj in _api_objects():
+        checkpoint = getattr(obj, "checkpoint", None)
+        if checkpoint is not None:
+            _sync(checkpoint)
+
+def _done_url(url):
+    """ Tell the URL pool that the crawler has finished with a URL returned by
+        next_url (the done_url method is optional).
+    """
+    done_url = getattr(pool, "done_url", None)
+    if done_url is not None:
+        _sync(done_url, url)
+
 def _iter_urls():
     """ Yield URLs obtained from the URL Pool module, causing threads to wait
         when no more URLs are available, and wait on threads fetching a URL
@@ -643,7 +1237,14 @@ def _iter_urls():
     while len(_waiters) < len(_threads):
         _lock.release()
         url = _sync(pool.next_url) if not _halt else None
+        t = _next_time() if url is None and not _halt else None
         _lock.acquire()
+        if t is not None:
+            # there are URLs, but none that can be fetched yet
+            _lock.release()
+            sleep(min(max(t - time(), 0), 1))
+            _lock.acquire()
+            continue
         if url is None:
             _wait() # wait for a URL to be ready
             continue
@@ -684,6 +1285,37 @@ if __name__ == "__main__":
     if "-q" in argv[1:]:
         default_delay = 0
 
+    # test that a redirect loop fails only the URL being fetched
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+    class RedirectLoopHandler (BaseHTTPRequestHandler):
+        """ Test implementation, which always redirects.
+        """
+
+        def do_GET(self):
+            self.send_response(302)
+            self.send_header("Location", "/again")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), RedirectLoopHandler)
+    server_thread = Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    courier = _Courier(StdURL("http://127.0.0.1:{0}/".format(
+                                                        server.server_port)))
+    try:
+        courier.fetch("GET")
+        assert False
+    except HTTPError:
+        assert False
+    except URLError as e:
+        assert e.reason == "too many redirects"
+    server.shutdown()
+
     class DomainFollowDecider (DefaultFollowDecider):
         """ Test implementation.
         """
@@ -0,0 +1,690 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Event-driven crawl engine.
+
+    This is an alternative to the thread pool engine in crawler.py, which can
+    only have as many requests in flight as there are crawler threads. Here a
+    single thread runs an event loop over non-blocking sockets (using asyncore
+    with poll), so that thousands of fetches can be in progress at once. Each
+    URL is crawled by a generator which yields whenever it needs to wait for
+    the network or the throttle, and is resumed by the loop when the result is
+    ready.
+
+    The objects satisfying the crawler API (crawler.pool, crawler.throttle,
+    crawler.robots, crawler.dump etc.) are used unchanged, and are only ever
+    called from the thread running start().
+"""
+
+import asyncore
+import socket
+from collections import deque
+from cStringIO import StringIO
+from heapq import heappush, heappop
+from httplib import HTTPMessage, IncompleteRead
+from Queue import Queue, Empty
+from threading import Thread
+from time import time, sleep
+from urllib2 import URLError, HTTPError
+from sys import exc_info, exc_clear
+from os import strerror
+
+import crawler
+from crawler import CrawlerError, NotModified, ContentTooLarge, \
+                    BadContentEncoding, HTTPResource, _Spool, _sync, _debug, \
+                    _REDIRECTS
+from stdurl import StdURL
+
+
+max_fetches = 1000 # maximum number of URLs being crawled at once
+host_fetches = 1 # maximum number of URLs being crawled at once per domain
+max_waiting = 10000 # maximum number of URLs waiting for a domain to be free
+timeout = 60 # seconds before an HTTP request is abandoned
+resolver_threads = 10 # number of threads doing blocking DNS lookups
+
+
+class _Response (object):
+    """ Class for an HTTP response, the content of which may still be being
+        received.
+    """
+
+    def __init__(self, connection, url, code, msg, headers):
+        self.url = url
+        self.code = code
+        self.msg = msg
+        self.headers = headers
+        self.body = None
+        self.error = None
+        self._connection = connection
+        self._reader = None
+
+    def read(self, callback):
+        """ Call callback(body, error) via the engine once the content has
+            been received into body (a file, see crawler._Spool), or the
+            request has failed.
+        """
+        if self.body is not None or self.error is not None:
+            self._connection.engine.call_soon(callback, self.body,
+                                              self.error)
+        else:
+            self._reader = callback
+
+    def close(self):
+        """ Abandon the response, closing the connection if the content is
+            still being received.
+        """
+        self._reader = None
+        self._connection.abandon()
+
+
+class _Connection (asyncore.dispatcher):
+    """ Class for making a single HTTP request over a non-blocking socket.
+
+        Once the headers have been received, callback(response, error) is
+        called via the engine, and the content continues to be received in
+        the background (see _Response).
+    """
+
+    def __init__(self, engine, method, url, headers, address, callback):
+        """ Connect to address (as returned by getaddrinfo) and send a request
+            of the specified type (GET, HEAD) for the given StdURL, with the
+            extra request headers in the given dictionary.
+
+            Can raise socket.error.
+        """
+        asyncore.dispatcher.__init__(self, map=engine.socket_map)
+        self.engine = engine
+        self._method = method
+        self._url = url
+        self._callback = callback
+        if crawler.accept_encoding is not None:
+            headers = dict(headers)
+            headers["Accept-Encoding"] = crawler.accept_encoding
+        headers = "".join(["{0}: {1}\r\n".format(name, value)
+                           for name, value in headers.iteritems()])
+        self._out = "{0} {1} HTTP/1.1\r\nHost: {2}\r\nUser-Agent: {3}\r\n" \
+                    "{4}Connection: close\r\n\r\n".format(method,
+                    (url.selector or "/").replace(" ", "%20"), url.netloc,
+                    crawler.user_agent, headers)
+        self._data = ""
+        self._response = None
+        self._done = False
+        self._length = None
+        self._chunked = False
+        self._chunk_left = None
+        self._body = None
+        self._received = 0
+        self._timer = engine.call_later(timeout, self._timed_out)
+        family, socktype, proto, canonname, sockaddr = address
+        try:
+            self.create_socket(family, socktype)
+            self.connect(sockaddr)
+        except:
+            self._done = True
+            self._timer[-1] = None
+            if self.socket is not None:
+                self.close()
+            raise
+
+    def abandon(self):
+        """ Stop receiving the response.
+        """
+        if not self._done:
+            self._done = True
+            self._timer[-1] = None
+            self.close()
+
+    def readable(self):
+        return not self._done
+
+    def writable(self):
+        return not self.connected or len(self._out) > 0
+
+    def handle_connect(self):
+        pass
+
+    def handle_write(self):
+        sent = self.send(self._out)
+        self._out = self._out[sent:]
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if len(data) == 0 or self._done:
+            return
+        self._data += data
+        try:
+            if self._response is None and not self._read_headers():
+                return
+            if self._read_body():
+                self._finish()
+        except (ContentTooLarge, BadContentEncoding) as e:
+            self._finish(e)
+
+    def handle_close(self):
+        if not self._done:
+            if self._response is None:
+                err = self.socket.getsockopt(socket.SOL_SOCKET,
+                                             socket.SO_ERROR)
+                reason = socket.error(err, strerror(err)) if err else \
+                         "connection closed"
+                self._finish(URLError(reason))
+            elif self._length is None and not self._chunked:
+                # the body is delimited by the connection closing
+                self._finish()
+            else:
+                self._finish(IncompleteRead(self._body.close().read()))
+        self.close()
+
+    def handle_expt(self):
+        self._finish(URLError("socket error"))
+
+    def handle_error(self):
+        e = exc_info()[1]
+        exc_clear()
+        self._finish(URLError(e))
+
+    def _timed_out(self):
+        self._finish(URLError("timed out"))
+
+    def _finish(self, error=None):
+        """ Close the connection, and pass the content or error to whoever is
+            waiting for it.
+        """
+        if self._done:
+            return
+        self.abandon()
+        response = self._response
+        if response is None:
+            self.engine.call_soon(self._callback, None, error)
+            return
+        if error is None:
+            try:
+                response.body = self._body.close()
+            except (ContentTooLarge, BadContentEncoding) as e:
+                error = e
+        response.error = error
+        if response._reader is not None:
+            self.engine.call_soon(response._reader, response.body, error)
+
+    def _read_headers(self):
+        """ Parse the status line and headers if they have all been received,
+            returning True if so, and pass the response to the callback.
+        """
+        while True:
+            end = self._data.find("\r\n\r\n")
+            if end < 0:
+                if len(self._data) > 65536:
+                    raise ValueError("HTTP headers too long")
+                return False
+            head = self._data[:end]
+            self._data = self._data[end + 4:]
+            status, _, head = head.partition("\r\n")
+            parts = status.split(None, 2)
+            code = int(parts[1])
+            # skip interim responses (100 Continue)
+            if code >= 200:
+                break
+        headers = HTTPMessage(StringIO(head + "\r\n\r\n"), 0)
+        encoding = headers.get("Transfer-Encoding", "")
+        length = headers.get("Content-Length")
+        if self._method == "HEAD" or code in (204, 304):
+            self._length = 0
+        elif encoding.lower() == "chunked":
+            self._chunked = True
+        elif length is not None:
+            self._length = int(length)
+        self._body = _Spool(self._length, headers.get("Content-Encoding"))
+        self._response = _Response(self, self._url, code,
+                                   parts[2] if len(parts) > 2 else "", headers)
+        self.engine.call_soon(self._callback, self._response, None)
+        return True
+
+    def _read_body(self):
+        """ Move received data into the body, returning True if the body is
+            complete.
+        """
+        if self._chunked:
+            return self._read_chunks()
+        data = self._data
+        if self._length is not None:
+            data = data[:self._length - self._received]
+        self._body.write(data)
+        self._received += len(data)
+        self._data = ""
+        return self._length is not None and self._received >= self._length
+
+    def _read_chunks(self):
+        """ Decode as many chunks as have been received, returning True if the
+            last chunk has been read.
+        """
+        pos = 0
+        try:
+            while True:
+                if self._chunk_left is None:
+                    end = self._data.find("\r\n", pos)
+                    if end < 0:
+                        return False
+                    size = int(self._data[pos:end].split(";")[0], 16)
+                    pos = end + 2
+                    if size == 0:
+                        return True
+                    self._chunk_left = size
+                if len(self._data) - pos < self._chunk_left + 2:
+                    return False
+                self._body.write(self._data[pos:pos + self._chunk_left])
+                pos += self._chunk_left + 2
+                self._chunk_left = None
+        finally:
+            self._data = self._data[pos:]
+
+
+class _Resolver (object):
+    """ Class for doing blocking DNS lookups in a pool of threads, caching the
+        results for the duration of the crawl.
+    """
+
+    def __init__(self, threads):
+        self.cache = dict()
+        self.pending = dict()
+        self._requests = Queue()
+        self._results = Queue()
+        self._threads = [Thread(target=self._run) for _ in xrange(threads)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def resolve(self, host, port, callback):
+        """ Look up a host and port, calling callback(address, error) from a
+            later call to deliver() (or immediately, if cached).
+        """
+        key = (host, port)
+        if key in self.cache:
+            callback(self.cache[key], None)
+        elif key in self.pending:
+            self.pending[key].append(callback)
+        else:
+            self.pending[key] = [callback]
+            self._requests.put(key)
+
+    def deliver(self):
+        """ Call the callbacks for any completed lookups.
+        """
+        while True:
+            try:
+                key, address, error = self._results.get_nowait()
+            except Empty:
+                return
+            if error is None:
+                self.cache[key] = address
+            for callback in self.pending.pop(key):
+                callback(address, error)
+
+    def close(self):
+        """ Stop the resolver threads.
+        """
+        for thread in self._threads:
+            self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            key = self._requests.get()
+            if key is None:
+                return
+            try:
+                address = socket.getaddrinfo(key[0], key[1], 0,
+                                             socket.SOCK_STREAM)[0]
+            except socket.error as e:
+                self._results.put((key, None, e))
+            else:
+                self._results.put((key, address, None))
+
+
+class _Sleep (object):
+    """ Yielded by a crawl generator to wait for a number of seconds.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def start(self, engine, resume):
+        engine.call_later(self.seconds, resume, None, None)
+
+
+class _Fetch (object):
+    """ Yielded by a crawl generator to make an HTTP request. The generator is
+        resumed with a _Response once the headers have been received, or the
+        error is raised at the yield.
+    """
+
+    def __init__(self, method, url, headers=None):
+        self.method = method
+        self.url = url
+        self.headers = headers or dict()
+
+    def start(self, engine, resume):
+        engine.fetch(self.method, self.url, self.headers, resume)
+
+
+class _Read (object):
+    """ Yielded by a crawl generator to read the content of a _Response. The
+        generator is resumed with a file holding the content, or the error is
+        raised at the yield.
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+    def start(self, engine, resume):
+        self.response.read(resume)
+
+
+class _Engine (object):
+    """ Class implementing the event loop.
+    """
+
+    def __init__(self):
+        self.socket_map = dict()
+        self._resolver = _Resolver(resolver_threads)
+        self._timers = list()
+        self._timer_seq = 0
+        self._ready = deque()
+        self._fetches = 0
+        self._host_fetches = dict()
+        self._waiting = dict()
+        self._waiting_count = 0
+        self._next_time = None
+
+    def call_soon(self, fn, *args):
+        """ Call fn(*args) from the event loop.
+        """
+        self._ready.append((fn, args))
+
+    def call_later(self, seconds, fn, *args):
+        """ Call fn(*args) from the event loop after the given number of
+            seconds. Returns a timer, which is cancelled by setting its last
+            item to None.
+        """
+        self._timer_seq += 1
+        timer = [time() + seconds, self._timer_seq, args, fn]
+        heappush(self._timers, timer)
+        return timer
+
+    def fetch(self, method, url, headers, callback, redirects=0):
+        """ Make an HTTP request for the given StdURL, following redirects,
+            and calling callback(response, error) once the headers have been
+            received. As with the courier in crawler.py, NotModified is passed
+            for a 304 response, and HTTPError for anything else other than 2xx.
+        """
+        if url.scheme != "http":
+            self.call_soon(callback, None,
+                           URLError("unsupported scheme: " + url.scheme))
+            return
+
+        def received(response, error):
+            if error is None and response.code in _REDIRECTS and \
+               redirects < crawler.max_redirects:
+                location = response.headers.get("Location")
+                if location:
+                    response.close()
+                    _debug("Redirect", url, "to", location)
+                    self.fetch(method, StdURL(location, url), headers,
+                               callback, redirects + 1)
+                    return
+            if error is None and response.code == 304:
+                response.close()
+                error = NotModified()
+            elif error is None and not 200 <= response.code < 300:
+                response.close()
+                error = HTTPError(str(response.url), response.code,
+                                  response.msg, response.headers, None)
+            callback(response, error)
+
+        def resolved(address, error):
+            if error is not None:
+                self.call_soon(callback, None, URLError(error))
+                return
+            _debug("HTTP", method, url)
+            try:
+                _Connection(self, method, url, headers, address, received)
+            except socket.error as e:
+                self.call_soon(callback, None, URLError(e))
+
+        self._resolver.resolve(url.hostname, url.port or 80, resolved)
+
+    def run(self):
+        """ Crawl URLs from the URL pool until there are none left.
+        """
+        last = time()
+        try:
+            while self._fill() or self._fetches > 0:
+                self._poll()
+                if time() - last >= crawler.checkpoint_interval:
+                    crawler._checkpoint()
+                    last = time()
+        finally:
+            self._resolver.close()
+            asyncore.close_all(self.socket_map)
+
+    def _fill(self):
+        """ Start crawling URLs from the URL pool until the limits are reached.
+            Returns False if the URL pool has no more URLs.
+        """
+        while self._fetches < max_fetches and \
+              self._waiting_count < max_waiting:
+            url = _sync(crawler.pool.next_url) if not crawler._halt else None
+            if url is None:
+                self._next_time = crawler._next_time() \
+                                  if not crawler._halt else None
+                return self._waiting_count > 0 or self._next_time is not None
+            if self._host_fetches.get(url.netloc, 0) < host_fetches:
+                self._start(url)
+            else:
+                # wait for a URL on the same domain to be finished
+                self._waiting.setdefault(url.netloc, deque()).append(url)
+                self._waiting_count += 1
+        return True
+
+    def _poll(self):
+        """ Wait for and handle socket, timer and DNS events.
+        """
+        wait = 1
+        if len(self._timers) > 0:
+            wait = min(max(self._timers[0][0] - time(), 0), wait)
+        if self._next_time is not None:
+            # wake when the URL pool will have a URL ready
+            wait = min(max(self._next_time - time(), 0), wait)
+            self._next_time = None
+        if len(self._resolver.pending) > 0:
+            wait = min(wait, 0.01)
+        if len(self.socket_map) > 0:
+            asyncore.loop(wait, True, self.socket_map, 1)
+        else:
+            sleep(wait)
+        self._resolver.deliver()
+        now = time()
+        while len(self._timers) > 0 and self._timers[0][0] <= now:
+            _, _, args, fn = heappop(self._timers)
+            if fn is not None:
+                fn(*args)
+        while len(self._ready) > 0:
+            fn, args = self._ready.popleft()
+            fn(*args)
+
+    def _start(self, url):
+        """ Start crawling a URL.
+        """
+        self._fetches += 1
+        self._host_fetches[url.netloc] = self._host_fetches.get(url.netloc,
+                                                                0) + 1
+        self._step(url, _crawl_url(url))
+
+    def _done(self, url):
+        """ Finish crawling a URL, and start the next URL waiting on its
+            domain, if any.
+        """
+        self._fetches -= 1
+        self._host_fetches[url.netloc] -= 1
+        waiting = self._waiting.get(url.netloc)
+        if waiting is not None:
+            self._waiting_count -= 1
+            self.call_soon(self._start, waiting.popleft())
+            if len(waiting) == 0:
+                del self._waiting[url.netloc]
+        elif self._host_fetches[url.netloc] == 0:
+            del self._host_fetches[url.netloc]
+
+    def _step(self, url, crawl, value=None, error=None):
+        """ Resume a crawl generator with a value or an error, and start the
+            operation it yields.
+        """
+        try:
+            if error is not None:
+                op = crawl.throw(type(error), error)
+            else:
+                op = crawl.send(value)
+        except StopIteration:
+            crawler._done_url(url)
+            self._done(url)
+        except (CrawlerError, URLError, IncompleteRead) as e:
+            _debug(url)
+            _sync(crawler.error.error, url, e)
+            crawler._done_url(url)
+            self._done(url)
+        except:
+            # error is not lost - see _debug()
+            stop()
+            self._done(url)
+        else:
+            op.start(self, lambda value, error: \
+                           self._step(url, crawl, value, error))
+
+
+def _crawl_url(url):
+    """ Generator crawling a URL, equivalent to crawler._get_robots() and
+        crawler._get_url().
+    """
+    _debug("Crawling", url)
+    if url.path == "/robots.txt":
+        # initialise the throttle for this domain
+        _sync(crawler.throttle.last_time, url.netloc)
+        try:
+            response = yield _Fetch("GET", url)
+        except HTTPError as e:
+            if e.code == 404:
+                content = None
+            else:
+                raise
+        else:
+            body = yield _Read(response)
+            content = body.read()
+        _sync(crawler.robots.parse_robots, url.netloc, content)
+        return
+    # check robots.txt
+    delay = _sync(crawler.robots.check_robots, url) or crawler.default_delay
+    # hit the throttle and wait if necessary
+    t = _sync(crawler.throttle.last_time, url.netloc)
+    wait = t + delay - time()
+    if wait > 0:
+        _debug("Sleep for", wait)
+        yield _Sleep(wait)
+    _sync(crawler.throttle.last_time, url.netloc)
+    # make a (conditional) GET request, and read the headers
+    headers = dict()
+    validators = getattr(crawler.duplicate, "validators", None)
+    if validators is not None:
+        validators = _sync(validators, url)
+    if validators is not None:
+        etag, last_modified = validators
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+    response = yield _Fetch("GET", url, headers)
+    try:
+        resource = HTTPResource(url, response.url, response.headers)
+        # check for a redirect
+        if resource.url != resource.origin_url:
+            _sync(crawler.pool.add_redirect, resource.origin_url, resource.url)
+        # check whether to reject on (redirected) URL, headers or content
+        # type, abandoning the response if so
+        resource.check()
+        resource.body = yield _Read(response)
+    finally:
+        response.close()
+    # check whether to reject on (redirected) URL, headers or content
+    resource.check()
+    crawler._handle_resource(url, resource)
+
+
+def start():
+    """ Start the crawler, returning when there are no more URLs in the URL
+        pool and all fetches have finished.
+    """
+    crawler.t0 = time()
+    crawler._halt = False
+    crawler._resume()
+    _Engine().run()
+    crawler._checkpoint()
+
+def stop():
+    """ Gracefully stop the crawler prematurely. URLs already being crawled
+        will still be handled.
+    """
+    crawler.stop()
+
+
+if __name__ == "__main__":
+    from sys import argv
+    from threading import Lock
+
+    if "-v" in argv[1:]:
+        crawler.silent = False
+    if "-q" in argv[1:]:
+        crawler.default_delay = 0
+
+    class TestErrorHandler (crawler.DefaultErrorHandler):
+        """ Test implementation.
+        """
+
+        def __init__(self):
+            crawler.DefaultErrorHandler.__init__(self)
+            self.by_type = dict()
+
+        def error(self, url, e):
+            """ Add the URL to a set held against the error type.
+            """
+            self.by_type.setdefault(type(e), set()).add(url)
+
+    # see crawler.py for the test site (http://test/)
+    crawler.follow = crawler.DefaultFollowDecider("^text/html$|^image/.*",
+                                                  True)
+    crawler.error = TestErrorHandler()
+    crawler.pool.add_url(StdURL("http://test/"))
+
+    start()
+
+    for u, y in (("http://test/does_not_exist.html", HTTPError),
+                 ("http://test/empty.mp3", crawler.URLNotFollowed),
+                 ("http://test/test.jpg", crawler.URLNotAllowed)):
+        assert StdURL(u) in crawler.error.by_type[y]
+    assert crawler.pool.redirect_count == 1
+    assert crawler.dump.count > 0
+    # test throttle
+    assert time() - crawler.t0 >= crawler.default_delay * \
+           (crawler.dump.count - 1)
+    print "Test passed"
@@ -0,0 +1,260 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" A dumper which indexes crawled pages into a Xapian database with a
+    flax.core Fieldmap, as they are crawled.
+
+    The text is extracted from each page by the crawler, and the document is
+    passed through a bounded queue to a background thread which writes to the
+    database, flushing it in batches. When the queue is full, dump_resource()
+    waits, which holds up the crawler until the index catches up.
+"""
+
+from hashlib import md5
+from htmlentitydefs import name2codepoint
+from Queue import Queue, Empty
+from re import compile as re_compile, IGNORECASE, DOTALL
+from threading import Thread
+from time import time
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import xapian
+import flax.core
+
+language = "en" # for stemming, when a new database is created
+max_url_term = 200 # bytes of URL above which its md5 is indexed instead
+
+_FLUSH = object() # queued to flush the database
+_HIDDEN = re_compile("<!--.*?-->|<(script|style)\\b.*?</\\1\\s*>",
+                     IGNORECASE | DOTALL)
+_TITLE = re_compile("<title\\b[^>]*>(.*?)</title\\s*>", IGNORECASE | DOTALL)
+_TAG = re_compile("<[^>]*>")
+_ENTITY = re_compile("&(#x[0-9a-f]+|#[0-9]+|[a-z0-9]+);", IGNORECASE)
+
+
+def _entity(match):
+    name = match.group(1)
+    try:
+        if name[:2].lower() == "#x":
+            return unichr(int(name[2:], 16))
+        if name[:1] == "#":
+            return unichr(int(name[1:]))
+        return unichr(name2codepoint[name])
+    except (KeyError, ValueError, OverflowError):
+        return match.group(0)
+
+def _decode(content, charset):
+    """ Decode content using charset if given, otherwise (or if charset is
+        unknown) as UTF-8, replacing any invalid characters.
+    """
+    try:
+        return content.decode(charset or "utf-8", "replace")
+    except LookupError:
+        return content.decode("utf-8", "replace")
+
+def _clean(html):
+    """ Return the text of a fragment of HTML (a unicode string), with tags
+        removed, entities decoded and white space collapsed.
+    """
+    text = _ENTITY.sub(_entity, _TAG.sub(" ", html))
+    return u" ".join(text.split())
+
+def html_text(content, charset=None):
+    """ Return the title and text of an HTML page as unicode strings. The page
+        is decoded using charset if given, otherwise as UTF-8 (replacing any
+        invalid characters).
+    """
+    html = _HIDDEN.sub(" ", _decode(content, charset))
+    match = _TITLE.search(html)
+    title = _clean(match.group(1)) if match is not None else u""
+    return title, _clean(html)
+
+def url_key(url):
+    """ Return the value of the url field for a URL string: the URL, or if
+        it is too long for a Xapian term, "md5:" and the hex MD5 of it.
+    """
+    if len(url) <= max_url_term:
+        return url
+    return "md5:" + md5(url).hexdigest()
+
+def charset(resource):
+    """ Return the charset parameter of the Content-Type header of a resource,
+        or None.
+    """
+    for param in resource.headers.get("Content-Type", "").split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            return value.strip().strip("\"'") or None
+    return None
+
+
+class IndexDumper (object):
+    """ Dumper which indexes HTML and plain text resources into a Xapian
+        database, with fields url (a filter field, used as the document ID so
+        that a page which is crawled again replaces the old document - see
+        url_key() for long URLs), domain and content_type (filter fields), and
+        title and text. The document data holds the full URL and the title.
+
+        A document which can not be indexed is skipped, and counted in errors
+        (with the exception in last_error). An exception flushing the
+        database is raised by the next call to the dumper, stopping the
+        crawl.
+
+        Calls to the API need not be synchronized, so there is no api_lock.
+    """
+
+    content_types = ("text/html", "application/xhtml+xml", "text/plain")
+
+    def __init__(self, path, queue_size=100, batch_size=1000, batch_time=10):
+        """ Index into the database at path, creating it if necessary. At most
+            queue_size documents wait to be indexed, and the database is
+            flushed every batch_size documents or batch_time seconds.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_time = batch_time
+        self.count = 0 # documents queued
+        self.indexed = 0 # documents added to the database
+        self.flushes = 0
+        self.errors = 0 # documents which could not be indexed
+        self.last_error = None
+        self.waits = 0 # number of times the queue was full
+        self.wait_time = 0.0 # seconds spent waiting for the queue
+        self._error = None # raised by the writer thread
+        self._queue = Queue(queue_size)
+        self._db = xapian.WritableDatabase(path, xapian.DB_CREATE_OR_OPEN)
+        self._fieldmap = flax.core.Fieldmap(self._db)
+        if len(list(self._fieldmap)) == 0:
+            self._fieldmap = flax.core.Fieldmap(language=language)
+            for name, isfilter in (("url", True), ("domain", True),
+                                   ("content_type", True), ("title", False),
+                                   ("text", False)):
+                self._fieldmap.setfield(name, isfilter)
+            self._fieldmap.save(self._db)
+            self._db.flush()
+        self._thread = Thread(target=self._write)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def dump_resource(self, resource):
+        """ Extract the text of a resource and queue it to be indexed, waiting
+            if the queue is full.
+        """
+        self._check()
+        content_type = resource.content_type()
+        if content_type not in IndexDumper.content_types:
+            return
+        content = resource.content
+        if content_type == "text/plain":
+            title = u""
+            text = _decode(content, charset(resource))
+        else:
+            title, text = html_text(content, charset(resource))
+        document = (str(resource.url), resource.url.netloc, content_type,
+                    title.encode("utf-8"), text.encode("utf-8"))
+        if self._queue.full():
+            self.waits += 1
+            t = time()
+            self._queue.put(document)
+            self.wait_time += time() - t
+        else:
+            self._queue.put(document)
+        self.count += 1
+
+    def checkpoint(self):
+        """ Wait for the queued documents to be indexed, and flush the
+            database (called by the crawler periodically, and when it
+            finishes).
+        """
+        self._check()
+        self._queue.put(_FLUSH)
+        self._queue.join()
+        self._check()
+
+    def close(self):
+        """ Index the queued documents, flush the database and stop the
+            writer thread.
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._check()
+
+    def _check(self):
+        """ Raise any exception raised by the writer thread.
+        """
+        if self._error is not None:
+            raise self._error
+
+    def _write(self):
+        """ Index documents from the queue until None is taken from it,
+            flushing the database every batch_size documents or batch_time
+            seconds, or when _FLUSH is taken from it.
+        """
+        pending = 0
+        last = time()
+        while True:
+            try:
+                item = self._queue.get(True, self.batch_time)
+                queued = True
+            except Empty:
+                item = _FLUSH
+                queued = False
+            try:
+                if self._error is not None:
+                    # keep emptying the queue, so the crawler is not held up
+                    pass
+                elif item is not None and item is not _FLUSH:
+                    try:
+                        self._add(*item)
+                        pending += 1
+                    except Exception as e:
+                        # skip the document, rather than stop the crawl
+                        self.errors += 1
+                        self.last_error = e
+                if self._error is None and \
+                   (item is None or item is _FLUSH or
+                    pending >= self.batch_size or
+                    time() - last >= self.batch_time):
+                    if pending > 0:
+                        self._db.flush()
+                        self.flushes += 1
+                    pending = 0
+                    last = time()
+            except Exception as e:
+                # the crawler stops when dump_resource raises it
+                self._error = e
+            finally:
+                if queued:
+                    self._queue.task_done()
+            if item is None:
+                return
+
+    def _add(self, url, domain, content_type, title, text):
+        doc = self._fieldmap.document()
+        doc.index("url", url_key(url), isdocid=True)
+        doc.index("domain", domain)
+        doc.index("content_type", content_type)
+        doc.index("title", title, weight=5)
+        doc.index("text", text)
+        doc.set_data(json.dumps({"url": url, "title": title}))
+        flax.core.Fieldmap.add_document(self._db, doc)
+        self.indexed += 1
@@ -0,0 +1,152 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Incremental extraction of links from HTML, for parsing content in chunks
+    as it is read rather than as one string.
+
+    Only the tags which can contain links (a, area, base, frame, iframe, img
+    and meta robots) are parsed, and comments, scripts and style sheets are
+    skipped. Attributes may be in any order and quoted or not.
+"""
+
+from re import compile as re_compile, IGNORECASE
+
+max_tag = 65536 # longer tags are assumed to be malformed and are skipped
+
+_START = re_compile("<(!--|(a|area|base|frame|iframe|img|meta|script|style)"
+                    "(?=[\\s/>]|$))", IGNORECASE)
+_REST = re_compile("(?:[^>\"']|\"[^\"]*\"|'[^']*')*>")
+_ATTR = re_compile("([^\\s=/>]+)(?:\\s*=\\s*(\"[^\"]*\"|'[^']*'|[^\\s>]*))?")
+_END = {"!--": re_compile("-->"),
+        "script": re_compile("</script\\s*>", IGNORECASE),
+        "style": re_compile("</style\\s*>", IGNORECASE)}
+_LINKS = {"a": "href", "area": "href", "frame": "src", "iframe": "src",
+          "img": "src"}
+
+
+def attributes(text):
+    """ Return a dictionary of the attributes in the text of a tag (after the
+        name), with lower case names and unquoted values.
+    """
+    attrs = dict()
+    for name, value in _ATTR.findall(text):
+        if value[:1] in ("\"", "'"):
+            value = value[1:-1]
+        if "&amp;" in value:
+            value = value.replace("&amp;", "&")
+        attrs.setdefault(name.lower(), value.strip())
+    return attrs
+
+
+class LinkExtractor (object):
+    """ Extract links from HTML fed to it in chunks of any size.
+        
+        After each chunk, base is the URL in the first <base href> tag (if any
+        yet), and noindex and nofollow are True if set by a meta robots tag.
+    """
+
+    def __init__(self):
+        self.base = None
+        self.noindex = False
+        self.nofollow = False
+        self._buffer = ""
+        self._end = None # pattern ending the comment or script being skipped
+
+    def feed(self, data):
+        """ Parse the next chunk of HTML, returning a list of the (unresolved)
+            links found in it.
+        """
+        buf = self._buffer + data
+        pos = 0
+        links = list()
+        while True:
+            if self._end is not None:
+                m = self._end.search(buf, pos)
+                if m is None:
+                    # keep enough to find an end split between chunks
+                    self._buffer = buf[-16:]
+                    return links
+                pos = m.end()
+                self._end = None
+            m = _START.search(buf, pos)
+            if m is None:
+                # keep a possible start of a tag split between chunks
+                start = buf.rfind("<", max(pos, len(buf) - 8))
+                self._buffer = buf[start:] if start >= 0 else ""
+                return links
+            tag = m.group(1).lower()
+            if tag == "!--":
+                self._end = _END[tag]
+                pos = m.end()
+                continue
+            rest = _REST.match(buf, m.end())
+            if rest is None:
+                if len(buf) - m.start() > max_tag:
+                    pos = m.end()
+                    continue
+                self._buffer = buf[m.start():]
+                return links
+            pos = rest.end()
+            if tag in _END:
+                self._end = _END[tag]
+                continue
+            attrs = attributes(buf[m.end():pos - 1])
+            if tag in _LINKS:
+                url = attrs.get(_LINKS[tag])
+                if url:
+                    links.append(url)
+            elif tag == "base":
+                if self.base is None and attrs.get("href"):
+                    self.base = attrs["href"]
+            elif attrs.get("name", "").lower() == "robots":
+                content = attrs.get("content", "").lower()
+                if "noindex" in content:
+                    self.noindex = True
+                if "nofollow" in content:
+                    self.nofollow = True
+
+
+if __name__ == "__main__":
+    html = """<html><head><base href="http://other/dir/">
+        <META content='NOINDEX' name=robots>
+        <script type="text/javascript">var s = '<a href="script.html">';</script>
+        <style>a:after { content: "<img src=style.png>" }</style>
+        </head><body>
+        <!-- <a href="comment.html"> -->
+        <a class="x" title="a > b" href="one.html">one</a>
+        <A HREF=two.html>two</A> <abbr href="abbr.html">
+        <img alt='' src="three.png"/> <area href="four.html?a=1&amp;b=2">
+        <iframe src="five.html"></iframe> <a name="anchor">
+        <a href=""> <p>1 < 2</p> <a href="six.html">
+        </body></html>"""
+    expected = ["one.html", "two.html", "three.png", "four.html?a=1&b=2",
+                "five.html", "six.html"]
+    for size in (1, 2, 3, 7, 64, len(html)):
+        extractor = LinkExtractor()
+        links = list()
+        for i in xrange(0, len(html), size):
+            links.extend(extractor.feed(html[i:i + size]))
+        assert links == expected, (size, links)
+        assert extractor.base == "http://other/dir/"
+        assert extractor.noindex and not extractor.nofollow
+    
+    # an unterminated tag does not stop the parse
+    extractor = LinkExtractor()
+    links = extractor.feed("<a href='x.html>" + "x" * (max_tag + 1))
+    links += extractor.feed("<a href=y.html>")
+    assert links == ["y.html"], links
+    print "Test passed"
@@ -0,0 +1,221 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Near-duplicate detection for crawled pages, so that the same page with
+    (for example) a different timestamp or session banner is not stored again.
+
+    The similarity of two pages is the Jaccard similarity of their sets of
+    shingles (runs of a few consecutive words), estimated from MinHash
+    signatures: the fraction of a number of hash functions for which the
+    smallest hash of a shingle is the same for both pages.
+
+    To find similar pages without comparing with every page, the signatures
+    are split into bands of a few hashes, each of which is indexed. Pages
+    which match in at least one band are candidates, and are compared in full.
+    The number of hashes per band is chosen so that pages at the threshold
+    similarity are almost always candidates, while dissimilar pages rarely
+    are.
+"""
+
+from random import Random
+from re import compile as re_compile, IGNORECASE, DOTALL
+from struct import Struct
+
+from crawler import DefaultDuplicateDetector, DuplicateResource
+from seen import fingerprint
+
+_SCRIPT = re_compile("<(script|style)\\b.*?</\\1\\s*>", IGNORECASE | DOTALL)
+_TAG = re_compile("<[^>]*>|&#?\\w+;")
+_WORD = re_compile("\\w+")
+
+
+def words(html):
+    """ Return the lower case words in the text of an HTML page.
+    """
+    text = _TAG.sub(" ", _SCRIPT.sub(" ", html))
+    return _WORD.findall(text.lower())
+
+def shingles(words, size=3):
+    """ Return the set of 64-bit fingerprints of the runs of size consecutive
+        words.
+    """
+    return set([fingerprint(" ".join(words[i:i + size]))
+                for i in xrange(len(words) - size + 1)])
+
+
+class MinHashIndex (object):
+    """ Index of MinHash signatures of sets of 64-bit values, for finding sets
+        with a similarity of at least threshold to a given set.
+    """
+
+    def __init__(self, threshold=0.7, hashes=128, seed=0):
+        """ Signatures have the given number of hashes (more give a more
+            accurate estimate of the similarity, but take longer to compute).
+            The hash functions are chosen using seed, so signatures can only be
+            compared between indexes with the same hashes and seed.
+        """
+        self.threshold = threshold
+        rnd = Random(seed)
+        self._masks = [rnd.getrandbits(64) for _ in xrange(hashes)]
+        self._struct = Struct("={0}Q".format(hashes))
+        # the largest number of hashes per band for which a pair of sets at
+        # the threshold similarity is a candidate with 99% probability
+        self.rows = 1
+        for rows in xrange(1, hashes + 1):
+            if hashes % rows == 0 and \
+               1 - (1 - threshold ** rows) ** (hashes / rows) >= 0.99:
+                self.rows = rows
+        self._tables = [dict() for _ in xrange(hashes / self.rows)]
+        self._signatures = list() # packed signatures, by id
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def signature(self, values):
+        """ Return the MinHash signature of a non-empty set of 64-bit values.
+            Each hash function is an exclusive or with a random mask, which
+            orders the values randomly as they are already hashes.
+        """
+        return tuple([min([value ^ mask for value in values])
+                      for mask in self._masks])
+
+    def similarity(self, a, b):
+        """ Return the estimated similarity of the sets with signatures a and
+            b.
+        """
+        return len([1 for x, y in zip(a, b) if x == y]) / float(len(a))
+
+    def find(self, signature):
+        """ Return the id of a set with a similarity of at least threshold to
+            the set with the given signature, or None.
+        """
+        checked = set()
+        for band, table in enumerate(self._tables):
+            key = signature[band * self.rows:(band + 1) * self.rows]
+            for i in table.get(key, ()):
+                if i in checked:
+                    continue
+                checked.add(i)
+                other = self._struct.unpack(self._signatures[i])
+                if self.similarity(signature, other) >= self.threshold:
+                    return i
+        return None
+
+    def add(self, signature):
+        """ Add a signature to the index, returning its id.
+        """
+        i = len(self._signatures)
+        self._signatures.append(self._struct.pack(*signature))
+        for band, table in enumerate(self._tables):
+            key = signature[band * self.rows:(band + 1) * self.rows]
+            if key in table:
+                table[key].append(i)
+            else:
+                table[key] = [i]
+        return i
+
+
+class NearDuplicateDetector (DefaultDuplicateDetector):
+    """ Duplicate detector which rejects pages similar to one already seen, as
+        well as exact duplicates (see DefaultDuplicateDetector).
+        
+        If the attribute api_lock is a Lock, calls to the API are synchronized.
+    """
+
+    content_types = ("text/html", "application/xhtml+xml", "text/plain")
+
+    def __init__(self, threshold=0.7, shingle=3, hashes=128):
+        """ Pages are near duplicates if the estimated similarity of their
+            sets of shingles of shingle words is at least threshold (which is
+            a fraction: 0.7 means that, of all the shingles in either page,
+            70% are in both).
+        """
+        DefaultDuplicateDetector.__init__(self)
+        self.index = MinHashIndex(threshold, hashes)
+        self.shingle = shingle
+
+    def duplicate_resource(self, resource):
+        """ Check a web resource for duplication. This will be called twice,
+            once when the headers have been received (when
+            resource.has_content() is False) and again when the content has
+            been received.
+        """
+        DefaultDuplicateDetector.duplicate_resource(self, resource)
+        if not resource.has_content() or \
+           resource.content_type() not in NearDuplicateDetector.content_types:
+            return
+        values = shingles(words(resource.content), self.shingle)
+        if len(values) == 0:
+            return
+        signature = self.index.signature(values)
+        if self.index.find(signature) is not None:
+            raise DuplicateResource("near duplicate")
+        self.index.add(signature)
+
+
+if __name__ == "__main__":
+    from os import listdir
+    from os.path import abspath, dirname, join
+    from crawler import HTTPResource
+    from stdurl import StdURL
+
+    # evaluate on the pages in test/near_duplicates, which lists groups of
+    # near duplicate pages in groups.txt
+    directory = join(dirname(abspath(__file__)), "test", "near_duplicates")
+    group = dict()
+    for line in open(join(directory, "groups.txt")):
+        if not line.startswith("#"):
+            for name in line.split():
+                group[name] = line
+    names = sorted([name for name in listdir(directory)
+                    if name.endswith(".html")])
+    assert sorted(group) == names
+    sets = dict([(name, shingles(words(open(join(directory, name)).read())))
+                 for name in names])
+    pairs = [(a, b) for a in names for b in names if a < b]
+    expected = len([(a, b) for a, b in pairs if group[a] == group[b]])
+    print "threshold  rows  precision  recall"
+    for threshold in (0.9, 0.8, 0.7, 0.6, 0.5, 0.4, 0.3, 0.2):
+        index = MinHashIndex(threshold)
+        signatures = dict([(name, index.signature(sets[name]))
+                           for name in names])
+        found = [(a, b) for a, b in pairs
+                 if index.similarity(signatures[a], signatures[b]) >=
+                    threshold]
+        correct = len([(a, b) for a, b in found if group[a] == group[b]])
+        precision = float(correct) / len(found) if found else 1.0
+        print "{0:9} {1:5} {2:10.2f} {3:7.2f}".format(threshold, index.rows,
+              precision, float(correct) / expected)
+        if threshold == 0.7:
+            assert precision == 1.0 and correct == expected
+
+    # the detector keeps the first page of each group
+    detector = NearDuplicateDetector()
+    kept = list()
+    for name in names:
+        resource = HTTPResource(StdURL("http://test/" + name),
+                                StdURL("http://test/" + name),
+                                {"Content-Type": "text/html"})
+        resource.content = open(join(directory, name)).read()
+        try:
+            detector.duplicate_resource(resource)
+        except DuplicateResource:
+            continue
+        kept.append(name)
+    assert sorted([group[name] for name in kept]) == \
+           sorted(set(group.values())), kept
+    print "Test passed"
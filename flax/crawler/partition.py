@@ -0,0 +1,363 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Crawling with several processes on one machine, each of which crawls the
+    domains assigned to it by consistent hashing (so that the parsing and
+    hashing of pages is not limited by one interpreter lock).
+
+    Each process has its own crawler API objects, set up by a function passed
+    to crawl(), with its URL pool wrapped in a PartitionedPool. URLs added for
+    domains belonging to another process are forwarded to it through a
+    multiprocessing queue. As each domain is only crawled by one process, the
+    throttle and robots.txt rules for it are kept in one place, as in a
+    single process crawl.
+
+    The crawl finishes when every process has no URLs queued or in progress
+    and no forwarded URLs are waiting to be received.
+"""
+
+from bisect import bisect
+from multiprocessing import Array, Process, Queue
+from Queue import Empty
+from time import time
+
+import crawler
+from crawler import DuplicateURL
+from seen import fingerprint
+from stdurl import StdURL
+
+poll_interval = 0.1 # seconds between checks for forwarded URLs when idle
+
+
+class HashRing (object):
+    """ Consistent hashing of domains to nodes, so that adding or removing a
+        node only moves the domains of about one node's share.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        """ Each of nodes (which should have distinct string forms) is placed
+            at replicas points on the ring, to spread domains evenly.
+        """
+        points = sorted([(fingerprint("{0}-{1}".format(node, i)), node)
+                         for node in nodes for i in xrange(replicas)])
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node(self, netloc):
+        """ Return the node to which the domain netloc is assigned.
+        """
+        i = bisect(self._points, fingerprint(netloc))
+        return self._nodes[i % len(self._nodes)]
+
+
+class PartitionedPool (object):
+    """ URL pool wrapper for one of several crawler processes, which passes
+        URLs for its own domains to the wrapped pool and forwards the rest to
+        the process they belong to.
+
+        The wrapped pool's API lock is shared, so calls to the wrapped pool
+        are synchronized as before.
+    """
+
+    def __init__(self, pool, index, ring, inboxes, state, seen=None):
+        """ This is process index of len(inboxes), assigned domains by ring,
+            receiving forwarded URLs on inboxes[index]. state is an Array of
+            three integers shared by the processes: the number of processes
+            idle, the number of batches of URLs forwarded and not yet
+            received, and whether the crawl has been stopped.
+
+            URLs forwarded are remembered in seen, so that each is only
+            forwarded once - by default a set, but for large crawls see the
+            seen.py module.
+        """
+        self.pool = pool
+        self.api_lock = getattr(pool, "api_lock", None)
+        self.index = index
+        self._ring = ring
+        self._inboxes = inboxes
+        self._outboxes = [list() for _ in inboxes] # URL strings to forward
+        self._state = state
+        self._seen = seen if seen is not None else set()
+        self._idle = False
+        self._held = 0 # URLs returned by next_url and not yet done
+        self.url_count = 0 # URLs done
+        self.forward_count = 0 # URLs forwarded to other processes
+        self.receive_count = 0 # URLs received from other processes
+
+    def owns(self, url):
+        """ Return whether the StdURL's domain belongs to this process.
+        """
+        return self._ring.node(url.netloc) == self.index
+
+    def add_url(self, url):
+        """ Add a StdURL to the wrapped pool unless it has been seen (as it
+            may have been received since the crawler checked it), or forward
+            it to the process its domain belongs to.
+        """
+        node = self._ring.node(url.netloc)
+        if node == self.index:
+            self._add(url)
+        elif url not in self._seen:
+            self._seen.add(url)
+            self._outboxes[node].append(str(url))
+            self.forward_count += 1
+
+    def _add(self, url):
+        """ Add a StdURL to the wrapped pool if it has not been seen, and
+            return whether it was added.
+        """
+        try:
+            self.pool.check_url(url)
+        except DuplicateURL:
+            return False
+        self.pool.add_url(url)
+        return True
+
+    def add_link(self, source, target):
+        self.pool.add_link(source, target)
+
+    def add_redirect(self, source, target):
+        self.pool.add_redirect(source, target)
+
+    def check_url(self, url):
+        """ If the wrapped pool has seen the StdURL, or it has been forwarded
+            to another process, raise DuplicateURL.
+        """
+        if self.owns(url):
+            self.pool.check_url(url)
+        elif url in self._seen:
+            raise DuplicateURL()
+
+    def next_url(self):
+        """ Forward and receive URLs, and return a StdURL from the wrapped pool
+            that can be fetched now, or None.
+        """
+        self._forward()
+        self._receive()
+        if self._state[2]:
+            return None
+        url = self.pool.next_url()
+        if url is not None:
+            self._held += 1
+        return url
+
+    def done_url(self, url):
+        """ Record that the crawler has finished with a StdURL returned by
+            next_url(), and forward the URLs it added.
+        """
+        done_url = getattr(self.pool, "done_url", None)
+        if done_url is not None:
+            done_url(url)
+        self._held -= 1
+        self.url_count += 1
+        self._forward()
+
+    def next_time(self):
+        """ Return the time at which next_url() should be called again, or None
+            if the crawl has finished in every process (or been stopped).
+        """
+        self._forward()
+        self._receive()
+        if self._state[2]:
+            return None
+        next_time = getattr(self.pool, "next_time", None)
+        t = next_time() if next_time is not None else None
+        if t is not None:
+            return t
+        if self._held == 0 and self._set_idle(True):
+            return None
+        return time() + poll_interval
+
+    def stop(self):
+        """ Stop the crawl in every process (as by crawler.stop()).
+        """
+        self._state[2] = 1
+
+    def checkpoint(self):
+        checkpoint = getattr(self.pool, "checkpoint", None)
+        if checkpoint is not None:
+            checkpoint()
+
+    def resume(self):
+        resume = getattr(self.pool, "resume", None)
+        if resume is not None:
+            resume()
+
+    def _set_idle(self, idle):
+        """ Record whether this process is idle, and return whether every
+            process is idle with no URLs waiting to be received.
+        """
+        lock = self._state.get_lock()
+        lock.acquire()
+        try:
+            if idle != self._idle:
+                self._state[0] += 1 if idle else -1
+                self._idle = idle
+            return self._state[0] == len(self._inboxes) and \
+                   self._state[1] == 0
+        finally:
+            lock.release()
+
+    def _forward(self):
+        """ Send the URLs added for other processes, a batch per process.
+        """
+        for node, urls in enumerate(self._outboxes):
+            if len(urls) == 0:
+                continue
+            lock = self._state.get_lock()
+            lock.acquire()
+            try:
+                self._state[1] += 1
+            finally:
+                lock.release()
+            self._inboxes[node].put(urls)
+            self._outboxes[node] = list()
+
+    def _receive(self):
+        """ Add the URLs forwarded by other processes which have not been seen
+            to the wrapped pool.
+        """
+        while True:
+            try:
+                urls = self._inboxes[self.index].get_nowait()
+            except Empty:
+                return
+            # no longer idle, before the batch stops counting as waiting
+            self._set_idle(False)
+            for url in urls:
+                if self._add(StdURL(url)):
+                    self.receive_count += 1
+            lock = self._state.get_lock()
+            lock.acquire()
+            try:
+                self._state[1] -= 1
+            finally:
+                lock.release()
+
+
+def _crawl(index, ring, inboxes, state, setup, seeds, engine, results):
+    """ Run one crawler process (see crawl()).
+    """
+    t = time()
+    pool = None
+    try:
+        setup(index)
+        pool = PartitionedPool(crawler.pool, index, ring, inboxes, state)
+        crawler.pool = pool
+        for url in seeds:
+            url = StdURL(url)
+            if pool.owns(url):
+                pool.add_url(url)
+        engine.start()
+    finally:
+        if pool is None or not pool._set_idle(True):
+            # stopped or failed, so stop the other processes too
+            state[2] = 1
+        counts = (pool.url_count, pool.forward_count, pool.receive_count) \
+                 if pool is not None else (0, 0, 0)
+        results.put((index, ) + counts + (time() - t, ))
+
+def crawl(processes, setup, seeds, engine=crawler, replicas=100):
+    """ Crawl from the seed URLs (strings) with the given number of
+        processes, each of which calls setup(index) to set the crawler API
+        objects (crawler.dump, crawler.pool and so on) for process index, from
+        0 to processes - 1. Each process should have its own URL pool (in
+        memory, or in its own database). engine is crawler or event_crawler.
+
+        Returns a list of (URLs crawled, URLs forwarded, URLs received,
+        seconds) for each process, in order of index.
+    """
+    ring = HashRing(range(processes), replicas)
+    inboxes = [Queue() for _ in xrange(processes)]
+    state = Array("i", 3)
+    results = Queue()
+    workers = [Process(target=_crawl, args=(index, ring, inboxes, state,
+                                            setup, seeds, engine, results))
+               for index in xrange(processes)]
+    for worker in workers:
+        worker.start()
+    stats = [None] * processes
+    for _ in workers:
+        result = results.get()
+        stats[result[0]] = result[1:]
+    for worker in workers:
+        worker.join()
+    return stats
+
+def report(stats, seconds):
+    """ Print the throughput of each process and in total, for the stats
+        returned by crawl() and the wall clock seconds it took.
+    """
+    for index, (urls, forwarded, received, t) in enumerate(stats):
+        print "Process {0}: {1} URLs in {2:.1f}s ({3:.1f} URLs/sec), " \
+              "{4} forwarded, {5} received".format(index, urls, t,
+              urls / max(t, 0.001), forwarded, received)
+    total = sum([urls for urls, _, _, _ in stats])
+    print "Total: {0} URLs in {1:.1f}s ({2:.1f} URLs/sec)".format(total,
+          seconds, total / max(seconds, 0.001))
+
+
+if __name__ == "__main__":
+    from crawler import DefaultURLPool
+
+    # domains are spread evenly, and adding a node only moves domains to it
+    netlocs = ["host{0}.example.com".format(i) for i in xrange(10000)]
+    ring = HashRing(range(4))
+    counts = [0] * 4
+    for netloc in netlocs:
+        counts[ring.node(netloc)] += 1
+    assert min(counts) > 1800, counts
+    bigger = HashRing(range(5))
+    moved = [netloc for netloc in netlocs
+             if ring.node(netloc) != bigger.node(netloc)]
+    assert set([bigger.node(netloc) for netloc in moved]) == set([4])
+    assert 1500 < len(moved) < 2500, len(moved)
+
+    # URLs for the other process are forwarded, and the crawl only finishes
+    # when both processes are idle with nothing in flight
+    ring = HashRing(range(2))
+    inboxes = [Queue(), Queue()]
+    state = Array("i", 3)
+    pools = [PartitionedPool(DefaultURLPool(delay=0), i, ring, inboxes, state)
+             for i in xrange(2)]
+    urls = [StdURL("http://host{0}.example.com/".format(i))
+            for i in xrange(20)]
+    for url in urls:
+        pools[0].add_url(url)
+    assert pools[0].forward_count == len([url for url in urls
+                                          if not pools[0].owns(url)])
+    url = pools[0].next_url()
+    assert url.path == "/robots.txt"
+    pools[0].done_url(url)
+    crawled = [set(), set()]
+    while True:
+        finished = True
+        for i, pool in enumerate(pools):
+            url = pool.next_url()
+            while url is not None:
+                assert pool.owns(url)
+                crawled[i].add(url)
+                pool.done_url(url)
+                url = pool.next_url()
+            if pool.next_time() is not None:
+                finished = False
+        if finished:
+            break
+    assert set([url for url in urls if pools[1].owns(url)]) <= crawled[1]
+    assert set(urls) <= crawled[0] | crawled[1]
+    assert list(state) == [2, 0, 0]
+    print "Test passed"
@@ -0,0 +1,86 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Scheduling of visits to pages already crawled, so that pages which change
+    often are fetched again sooner than pages which rarely change (see
+    SQLImplementation in sql_crawler.py).
+
+    The rate at which a page changes is estimated from its visits so far, with
+    the estimator of Cho and Garcia-Molina ("Estimating frequency of change",
+    2003), which allows for changes missed between visits: if X of n visits
+    found the page changed, at an average of I seconds after the previous
+    visit, the rate is -log((n - X + 0.5) / (n + 0.5)) / I. The page is then
+    visited again after the mean time between changes, within limits.
+"""
+
+from math import log
+
+
+class RecrawlPolicy (object):
+    """ Policy for when to visit pages again, within a budget of visits per
+        host.
+    """
+
+    def __init__(self, initial=86400, minimum=3600, maximum=2592000,
+                 budget=1000, period=86400):
+        """ A page is first visited again initial seconds after it is crawled,
+            and then after between minimum and maximum seconds, depending on
+            how often it has changed. At most budget pages are visited again
+            on each host in each period seconds; pages due when the budget is
+            spent wait until the next period.
+        """
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.budget = budget
+        self.period = period
+
+    def rate(self, visits, changes, elapsed):
+        """ Return the estimated number of changes per second of a page which
+            changed on changes of visits, which were a total of elapsed
+            seconds after the previous visits.
+        """
+        return -log((visits - changes + 0.5) / (visits + 0.5)) / \
+               (float(elapsed) / visits)
+
+    def interval(self, visits, changes, elapsed):
+        """ Return the number of seconds after the last visit when a page
+            should be visited again (see rate()).
+        """
+        if visits == 0 or elapsed <= 0:
+            return self.initial
+        rate = self.rate(visits, changes, elapsed)
+        if rate <= 0:
+            return self.maximum
+        return int(min(max(1.0 / rate, self.minimum), self.maximum))
+
+
+if __name__ == "__main__":
+    policy = RecrawlPolicy(minimum=60, maximum=86400 * 30)
+    assert policy.interval(0, 0, 0) == policy.initial
+    assert policy.interval(10, 0, 86400 * 10) == policy.maximum
+    # a page which changes at 1 per hour, visited every 10 minutes, is seen
+    # to change on about 1 - exp(-1/6) = 15% of visits
+    estimate = policy.interval(100, 15, 600 * 100)
+    assert 3000 < estimate < 4200, estimate
+    # visited every 2 hours, it changes on 86% of visits
+    estimate = policy.interval(100, 86, 7200 * 100)
+    assert 3000 < estimate < 4200, estimate
+    # a page which always changes is visited as often as allowed
+    assert policy.interval(100, 100, 6000 * 100) < 6000 / 3
+    assert policy.interval(100, 100, 60 * 100) == policy.minimum
+    print "Test passed"
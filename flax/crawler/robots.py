@@ -0,0 +1,297 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+""" Parsed robots.txt rules, including the Crawl-delay (which robotparser
+    ignores), and a bounded cache of them for use by robots managers.
+"""
+
+from Queue import Queue
+from collections import deque
+from robotparser import RobotFileParser
+from threading import Lock, Thread
+from time import time
+
+
+def crawl_delay(lines, user_agent):
+    """ Return the Crawl-delay in seconds from the lines of a robots.txt file
+        for the given user agent (from a group naming it, or else the "*"
+        group), or None if there is none.
+    """
+    name = user_agent.split("/")[0].lower()
+    delays = dict() # True for a group naming the user agent, False for "*"
+    agents = list()
+    in_rules = False
+    for line in lines:
+        field, colon, value = line.split("#", 1)[0].partition(":")
+        if not colon:
+            continue
+        field = field.strip().lower()
+        value = value.strip()
+        if field == "user-agent":
+            if in_rules:
+                # start of a new group
+                agents = list()
+                in_rules = False
+            agents.append(value.lower())
+            continue
+        in_rules = True
+        if field != "crawl-delay":
+            continue
+        try:
+            delay = float(value)
+        except ValueError:
+            continue
+        for agent in agents:
+            if agent == "*":
+                delays.setdefault(False, delay)
+            elif agent in name:
+                delays.setdefault(True, delay)
+    return delays.get(True, delays.get(False))
+
+
+class RobotRules (object):
+    """ The rules from a robots.txt file for a user agent.
+    """
+
+    def __init__(self, content, user_agent, parser=None):
+        """ Parse the content of robots.txt, which may be None if there is none
+            (in which case any URL is allowed). Alternatively, an already
+            parsed RobotFileParser can be passed (with no crawl delay).
+        """
+        self.user_agent = user_agent
+        self.time = time() # when the rules were fetched
+        self.crawl_delay = None
+        if parser is None:
+            parser = RobotFileParser()
+            if content is None:
+                parser.allow_all = True
+            else:
+                lines = content.split("\n")
+                parser.parse(lines)
+                self.crawl_delay = crawl_delay(lines, user_agent)
+        self.parser = parser
+
+    def can_fetch(self, path):
+        """ Return whether the user agent may fetch the path.
+        """
+        return self.parser.can_fetch(self.user_agent, path)
+
+    def delay(self, default):
+        """ Return the delay between requests to the domain: the Crawl-delay if
+            it is longer than default, otherwise default.
+        """
+        if self.crawl_delay is None:
+            return default
+        return max(self.crawl_delay, default)
+
+
+class RobotsCache (object):
+    """ Least recently used cache of RobotRules by domain, with expiry.
+    """
+
+    def __init__(self, capacity=10000, expiry=86400, load=None, refresh=None):
+        """ Keep at most capacity domains (or any number, if None). On a miss,
+            load(netloc) is called if specified, returning RobotRules or None.
+
+            When rules are more than expiry seconds old, refresh(netloc) is
+            called in a background thread, if specified, and the RobotRules it
+            returns replace the old rules (which are used in the meantime, and
+            kept if refresh returns None or raises an exception).
+        """
+        self.capacity = capacity
+        self.expiry = expiry
+        self._load = load
+        self._refresh = refresh
+        self._entries = dict() # [rules, last use, refreshing] by netloc
+        self._order = deque() # (last use, netloc), oldest first
+        self._tick = 0
+        self._lock = Lock()
+        self._queue = None # of netlocs to refresh, once a thread is started
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, netloc):
+        """ Return the rules for a domain, or None if there are none.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(netloc)
+            if entry is not None:
+                self._use(netloc, entry)
+                rules = entry[0]
+                if self._refresh is not None and not entry[2] and \
+                   rules.time + self.expiry < time():
+                    entry[2] = True
+                    self._refresh_later(netloc)
+                return rules
+        finally:
+            self._lock.release()
+        if self._load is None:
+            return None
+        rules = self._load(netloc)
+        if rules is not None:
+            self.put(netloc, rules)
+        return rules
+
+    def put(self, netloc, rules):
+        """ Store the rules for a domain, evicting the least recently used
+            domain if the cache is full.
+        """
+        self._lock.acquire()
+        try:
+            entry = [rules, 0, False]
+            self._entries[netloc] = entry
+            self._use(netloc, entry)
+            if self.capacity is not None:
+                while len(self._entries) > self.capacity:
+                    tick, oldest = self._order.popleft()
+                    if self._entries[oldest][1] == tick:
+                        del self._entries[oldest]
+        finally:
+            self._lock.release()
+
+    def items(self):
+        """ Return a list of (netloc, rules) for the domains in the cache.
+        """
+        self._lock.acquire()
+        try:
+            return [(netloc, entry[0])
+                    for netloc, entry in self._entries.iteritems()]
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """ Stop the refresh thread, if there is one.
+        """
+        if self._queue is not None:
+            self._queue.put(None)
+            self._queue = None
+
+    def _use(self, netloc, entry):
+        """ Record a use of an entry. Uses are appended to _order, and old uses
+            of the same entry are skipped when evicting, so _order is rebuilt
+            when it has too many.
+        """
+        self._tick += 1
+        entry[1] = self._tick
+        self._order.append((self._tick, netloc))
+        if len(self._order) > 2 * len(self._entries) + 1000:
+            self._order = deque(sorted([(e[1], n) for n, e
+                                        in self._entries.iteritems()]))
+
+    def _refresh_later(self, netloc):
+        """ Queue a domain to be refreshed by the background thread.
+        """
+        if self._queue is None:
+            self._queue = Queue()
+            thread = Thread(target=self._refresh_loop, args=(self._queue, ))
+            thread.daemon = True
+            thread.start()
+        self._queue.put(netloc)
+
+    def _refresh_loop(self, queue):
+        """ Refresh domains from the queue until None is taken from it.
+        """
+        while True:
+            netloc = queue.get()
+            if netloc is None:
+                return
+            try:
+                rules = self._refresh(netloc)
+            except Exception:
+                rules = None
+            self._lock.acquire()
+            try:
+                entry = self._entries.get(netloc)
+                if entry is not None:
+                    entry[2] = False
+                    if rules is None:
+                        # try again after another expiry period
+                        entry[0].time = time()
+            finally:
+                self._lock.release()
+            if rules is not None:
+                self.put(netloc, rules)
+
+
+if __name__ == "__main__":
+    from time import sleep
+
+    content = """
+User-agent: OtherBot
+Crawl-delay: 30
+Disallow: /
+
+User-agent: *
+Crawl-delay: 10
+Disallow: /private/
+
+User-agent: FlaxBot
+Crawl-delay: 2.5
+Disallow: /flax/
+"""
+    flax = RobotRules(content, "FlaxBot/0.1 (see http://www.flax.co.uk/)")
+    assert flax.crawl_delay == 2.5
+    assert flax.delay(4) == 4 and flax.delay(1) == 2.5
+    assert not flax.can_fetch("/flax/page.html")
+    assert flax.can_fetch("/private/page.html")
+    other = RobotRules(content, "AnyBot/1.0")
+    assert other.crawl_delay == 10
+    assert not other.can_fetch("/private/page.html")
+    assert RobotRules("Disallow: /\n", "AnyBot").crawl_delay is None
+    assert RobotRules(None, "AnyBot").can_fetch("/page.html")
+    assert RobotRules(None, "AnyBot").delay(4) == 4
+
+    # least recently used eviction, and loading on a miss
+    loads = list()
+    def load(netloc):
+        loads.append(netloc)
+        return RobotRules(None, "AnyBot") if netloc != "none" else None
+    cache = RobotsCache(capacity=2, load=load)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    cache.get("c") # evicts b
+    assert len(cache) == 2
+    assert loads == ["a", "b", "c"]
+    cache.get("a")
+    cache.get("b")
+    assert loads == ["a", "b", "c", "b"]
+    assert cache.get("none") is None and len(cache) == 2
+    for i in xrange(5000):
+        cache.get(str(i % 3))
+    assert len(cache) == 2 and len(cache._order) < 2000
+
+    # background refresh of expired rules
+    refreshed = list()
+    def refresh(netloc):
+        refreshed.append(netloc)
+        return RobotRules("User-agent: *\nCrawl-delay: 1\n", "AnyBot")
+    cache = RobotsCache(expiry=0.1, refresh=refresh)
+    cache.put("a", RobotRules(None, "AnyBot"))
+    assert cache.get("a").crawl_delay is None
+    sleep(0.2)
+    assert cache.get("a").crawl_delay is None # stale rules used meanwhile
+    for _ in xrange(50):
+        if cache.get("a").crawl_delay is not None:
+            break
+        sleep(0.001)
+    assert refreshed == ["a"]
+    assert cache.get("a").crawl_delay == 1
+    cache.close()
+    print "Test passed"
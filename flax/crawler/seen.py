@@ -0,0 +1,326 @@
+# Copyright (C) 2011 Lemur Consulting Ltd
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+""" Compact stores of seen URLs, for use by a URL pool in place of a set of
+    StdURLs (see DefaultURLPool).
+
+    FingerprintSet stores a 64-bit fingerprint of each URL (8 bytes per slot,
+    at most two thirds full) in open addressing hash tables, which can be
+    backed by files so that they spill to disk when larger than memory. The
+    chance of two of n URLs sharing a fingerprint is about n^2 / 2^65, or 1 in
+    3,700 for 100 million URLs.
+
+    BloomFilter is smaller still (about 1.2 bytes per URL for a 1% false
+    positive rate), but a new URL will sometimes be reported as seen.
+"""
+
+from array import array
+from hashlib import md5
+from math import ceil, log
+from mmap import mmap
+from os import rename
+from os.path import isfile, join
+from struct import Struct, unpack
+
+_SLOT = Struct("=Q")
+_DIGEST = Struct("=QQ")
+
+
+def fingerprint(url):
+    """ Return a 64-bit fingerprint of the string form of a URL (which is
+        never 0).
+    """
+    return _SLOT.unpack_from(md5(str(url)).digest())[0] or 1
+
+def _slots(table):
+    """ Return the values in a table as a sequence of integers.
+    """
+    if array("L").itemsize == 8:
+        return array("L", table[:])
+    return unpack("={0}Q".format(len(table) / 8), table[:])
+
+def _count(table):
+    """ Return the number of occupied slots in a table.
+    """
+    values = _slots(table)
+    return len(values) - values.count(0)
+
+
+class FingerprintSet (object):
+    """ Set of URL fingerprints, in 256 open addressing hash tables (selected
+        by the top 8 bits of the fingerprint), each of which doubles in size
+        when two thirds full.
+    """
+
+    def __init__(self, directory=None, slots=1024):
+        """ If directory is specified, the tables are memory mapped files in
+            that directory (named seen-00 to seen-ff), and any existing tables
+            are reopened. slots is the initial size of each table, and must be
+            a power of 2.
+        """
+        assert slots & (slots - 1) == 0
+        self._directory = directory
+        self._tables = list()
+        self._counts = list()
+        for shard in xrange(256):
+            path = self._path(shard)
+            if path is not None and isfile(path):
+                table = self._open(path)
+                self._counts.append(_count(table))
+            else:
+                table = self._create(path, slots)
+                self._counts.append(0)
+            self._tables.append(table)
+
+    def __len__(self):
+        return sum(self._counts)
+
+    def __contains__(self, url):
+        fp = fingerprint(url)
+        table = self._tables[fp >> 56]
+        mask = len(table) / 8 - 1
+        i = fp & mask
+        while True:
+            value = _SLOT.unpack_from(table, i << 3)[0]
+            if value == fp:
+                return True
+            if value == 0:
+                return False
+            i = (i + 1) & mask
+
+    def add(self, url):
+        """ Add a URL to the set.
+        """
+        fp = fingerprint(url)
+        shard = fp >> 56
+        table = self._tables[shard]
+        mask = len(table) / 8 - 1
+        i = fp & mask
+        while True:
+            value = _SLOT.unpack_from(table, i << 3)[0]
+            if value == fp:
+                return
+            if value == 0:
+                break
+            i = (i + 1) & mask
+        _SLOT.pack_into(table, i << 3, fp)
+        self._counts[shard] += 1
+        if self._counts[shard] * 3 >= (mask + 1) * 2:
+            self._grow(shard)
+
+    def memory_size(self):
+        """ Return the total size of the tables in bytes.
+        """
+        return sum([len(table) for table in self._tables])
+
+    def __getstate__(self):
+        """ Pickle the tables as strings if they are in memory, otherwise
+            flush them and pickle just the directory. The files go on changing
+            after the snapshot, so when they are unpickled the tables hold any
+            fingerprints added since, and are counted again.
+        """
+        if self._directory is not None:
+            for table in self._tables:
+                table.flush()
+            return (self._directory, None, self._counts)
+        return (None, [table[:] for table in self._tables], self._counts)
+
+    def __setstate__(self, state):
+        self._directory, tables, self._counts = state
+        if tables is None:
+            self._tables = [self._open(self._path(shard))
+                            for shard in xrange(256)]
+            self._counts = [_count(table) for table in self._tables]
+            return
+        self._tables = list()
+        for data in tables:
+            table = mmap(-1, len(data))
+            table[:] = data
+            self._tables.append(table)
+
+    def close(self):
+        """ Flush and close the tables.
+        """
+        for table in self._tables:
+            if self._directory is not None:
+                table.flush()
+            table.close()
+        self._tables = list()
+
+    def _path(self, shard):
+        if self._directory is None:
+            return None
+        return join(self._directory, "seen-{0:02x}".format(shard))
+
+    def _create(self, path, slots):
+        """ Return a new table, backed by the file at path if not None.
+        """
+        if path is None:
+            return mmap(-1, slots * 8)
+        f = open(path, "w+b")
+        try:
+            f.truncate(slots * 8)
+            return mmap(f.fileno(), slots * 8)
+        finally:
+            f.close()
+
+    def _open(self, path):
+        f = open(path, "r+b")
+        try:
+            return mmap(f.fileno(), 0)
+        finally:
+            f.close()
+
+    def _grow(self, shard):
+        """ Double the size of a table, reinserting the fingerprints.
+        """
+        old = self._tables[shard]
+        path = self._path(shard)
+        new_path = path + ".new" if path is not None else None
+        new = self._create(new_path, len(old) / 4)
+        mask = len(new) / 8 - 1
+        for fp in _slots(old):
+            if fp != 0:
+                i = fp & mask
+                while _SLOT.unpack_from(new, i << 3)[0] != 0:
+                    i = (i + 1) & mask
+                _SLOT.pack_into(new, i << 3, fp)
+        old.close()
+        if path is not None:
+            new.flush()
+            rename(new_path, path)
+        self._tables[shard] = new
+
+
+class BloomFilter (object):
+    """ Bloom filter of URLs, held in memory.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """ Size the filter to hold capacity URLs with the given false positive
+            rate (which rises above error_rate if more are added).
+        """
+        self.bits = int(ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, int(round(self.bits * log(2) / capacity)))
+        self.count = 0
+        self._array = bytearray((self.bits + 7) / 8)
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, url):
+        h1, h2 = _DIGEST.unpack(md5(str(url)).digest())
+        h1 %= self.bits
+        h2 %= self.bits
+        return [(h1 + i * h2) % self.bits for i in xrange(self.hashes)]
+
+    def __contains__(self, url):
+        bits = self._array
+        for i in self._positions(url):
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    def add(self, url):
+        """ Add a URL to the filter.
+        """
+        bits = self._array
+        new = False
+        for i in self._positions(url):
+            if not bits[i >> 3] & (1 << (i & 7)):
+                bits[i >> 3] |= 1 << (i & 7)
+                new = True
+        if new:
+            self.count += 1
+
+    def memory_size(self):
+        """ Return the size of the bit array in bytes.
+        """
+        return len(self._array)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_array"] = str(self._array)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._array = bytearray(state["_array"])
+
+    def close(self):
+        """ Nothing to do, as the filter is held in memory.
+        """
+        pass
+
+
+if __name__ == "__main__":
+    import cPickle
+    from shutil import rmtree
+    from tempfile import mkdtemp
+
+    urls = ["http://test/{0}.html".format(i) for i in xrange(10000)]
+    others = ["http://test/other/{0}.html".format(i) for i in xrange(10000)]
+
+    for directory in (None, mkdtemp()):
+        seen = FingerprintSet(directory, slots=16)
+        for url in urls:
+            seen.add(url)
+        seen.add(urls[0])
+        assert len(seen) == len(urls)
+        for url in urls:
+            assert url in seen
+        for url in others:
+            assert url not in seen
+        if directory is not None:
+            # reopen the tables
+            seen.close()
+            seen = FingerprintSet(directory, slots=16)
+            assert len(seen) == len(urls)
+            assert urls[-1] in seen
+            assert others[-1] not in seen
+            # pickle the tables, or just the directory
+            for seen in (seen, cPickle.loads(cPickle.dumps(seen, 2))):
+                assert len(seen) == len(urls)
+                assert urls[-1] in seen
+            # resume from a snapshot taken before more URLs were added
+            state = cPickle.dumps(seen, 2)
+            for url in others:
+                seen.add(url)
+            seen.close()
+            seen = cPickle.loads(state)
+            assert len(seen) == len(urls) + len(others)
+            assert others[-1] in seen
+            for i in xrange(10000):
+                seen.add("http://test/more/{0}.html".format(i))
+            assert len(seen) == len(urls) + len(others) + 10000
+            seen.close()
+            rmtree(directory)
+        else:
+            seen = cPickle.loads(cPickle.dumps(seen, 2))
+            assert len(seen) == len(urls)
+            assert urls[-1] in seen and others[-1] not in seen
+
+    bloom = BloomFilter(len(urls), 0.01)
+    for url in urls:
+        bloom.add(url)
+    for url in urls:
+        assert url in bloom
+    false_positives = len([url for url in others if url in bloom])
+    assert false_positives < len(others) * 0.02, false_positives
+    assert bloom.memory_size() < len(urls) * 1.3
+    bloom = cPickle.loads(cPickle.dumps(bloom, 2))
+    assert urls[-1] in bloom and len(bloom) == bloom.count
+    print "Test passed"
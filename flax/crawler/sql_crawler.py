@@ -17,24 +17,31 @@
 """ Reference implementation of crawler, storing URLs in an SQL database (using
     sqlite3). Note (at least):
     
-    * It's quite inefficient - SQL operations should be batched, results cached
+    * Writes are committed in batches (see SQLImplementation), so the last few
+      seconds of a crawl may be lost if the process is killed
     * No error handling - e.g. URLs are abandoned if they raise IncompleteRead
     * The default HTML parser doesn't understand meta redirects
 """
 
 import crawler
+import event_crawler
 from crawler import DefaultFollowDecider, DefaultHtmlParser, URLNotAllowed, \
                     NoRobots, DuplicateResource, DuplicateURL, URLNotFollowed,\
-                    _debug
+                    NotModified, _debug
 from robotparser import RobotFileParser
 from time import time
 from pickle import dumps, loads
 from threading import Lock
+from collections import deque
 from hashlib import md5
+from zlib import compressobj, decompress as zlib_decompress
+from bz2 import BZ2Compressor, decompress as bz2_decompress
 from sqlite3 import connect, Row, DatabaseError, Binary
 from os import unlink
 from os.path import isfile
 
+from recrawl import RecrawlPolicy
+from robots import RobotRules, RobotsCache
 from stdurl import StdURL
 
 
@@ -70,6 +77,47 @@ CREATE UNIQUE INDEX link_idx ON link (source_id, target_id);
 CREATE UNIQUE INDEX redirect_idx ON redirect (source_id, target_id);
 """
 
+# Scripts to bring a database created with the schema above up to date, in
+# order. The number applied is stored in the database as PRAGMA user_version.
+migrations = (
+"""
+CREATE INDEX IF NOT EXISTS content_hash_idx ON content (hash);
+CREATE INDEX IF NOT EXISTS header_idx ON header (name, value);
+CREATE INDEX IF NOT EXISTS header_url_idx ON header (url_id);
+CREATE INDEX IF NOT EXISTS link_target_idx ON link (target_id);
+""",
+"""
+ALTER TABLE url ADD COLUMN lease INTEGER;
+ALTER TABLE domain ADD COLUMN queued INTEGER NOT NULL DEFAULT 0;
+UPDATE domain SET queued=(SELECT COUNT(*) FROM url
+                          WHERE url.domain_id=domain.id AND url.time=0);
+CREATE INDEX url_queue_idx ON url (domain_id, time);
+CREATE INDEX url_lease_idx ON url (lease);
+CREATE INDEX domain_queue_idx ON domain (queued, time);
+""",
+"""
+ALTER TABLE url ADD COLUMN visits INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE url ADD COLUMN changes INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE url ADD COLUMN elapsed INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE url ADD COLUMN last_visit INTEGER;
+ALTER TABLE url ADD COLUMN next_visit INTEGER;
+ALTER TABLE domain ADD COLUMN budget_start INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE domain ADD COLUMN budget_used INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX url_visit_idx ON url (next_visit);
+""",
+"""
+ALTER TABLE content ADD COLUMN codec VARCHAR(16);
+ALTER TABLE content ADD COLUMN size INTEGER;
+""",
+)
+
+# Codecs for storing content, by name: a function returning a compressor
+# object (with compress and flush methods), and a function to decompress
+codecs = {"zlib": (lambda: compressobj(6), zlib_decompress),
+          "bz2": (BZ2Compressor, bz2_decompress)}
+
+limit = None # maximum number of URLs returned by next_url, or None
+
 class NoRow (Exception):
     """ Exception raised when a SELECT statement yield no rows.
     """
@@ -88,12 +136,72 @@ class SQLImplementation (object):
     
     api_lock = Lock()
 
-    def __init__(self, path):
-        """ Open a connection to the MySQL database of company data.
+    def __init__(self, path, batch_size=1000, batch_time=1.0, wal=True,
+                 claim_size=100, lease_time=600, robots_cache=10000,
+                 robots_expiry=86400, recrawl=None, codec="zlib"):
+        """ Open a connection to the SQLite database at path, migrating it to
+            the current schema if it has already been initialised.
+
+            Writes are made in a transaction which is committed once
+            batch_size statements have been executed, or when batch_time
+            seconds have passed since the last commit (checked on each write
+            and call to next_url), rather than after every statement. If wal,
+            the database uses write-ahead logging, so that a commit needs only
+            one sync and readers (such as the -s option) do not block the
+            crawl.
+
+            next_url claims up to claim_size URLs at a time from the domains
+            which have waited longest, with a lease of lease_time seconds
+            which is renewed until the crawler has finished with each URL (see
+            done_url). URLs whose lease has expired, because the crawler which
+            claimed them was stopped or killed, are returned to the queue.
+
+            The parsed robots.txt rules of up to robots_cache domains are kept
+            in memory, and robots.txt is fetched again in the background when
+            they are more than robots_expiry seconds old. The last request
+            time of each domain is also kept in memory, so that checking
+            robots.txt and the throttle need no database reads.
+
+            If recrawl is a RecrawlPolicy, pages which have been dumped are
+            returned to the queue when they are due to be visited again
+            (estimated from how often they have changed on earlier visits),
+            and the crawl does not finish. The number of visits to each page
+            and how many found it changed (a 304 Not Modified response, or
+            content with the same hash, means not) are stored in the url
+            table.
+
+            Content is compressed with the named codec (see codecs), or stored
+            as it is if codec is None, with the name of the codec and the
+            size of the content stored alongside it (see get_content). Hashes
+            are of the content before it is compressed.
         """
         self.db = connect(path, check_same_thread=False)
         self.db.row_factory = Row
         self.cursor = self.db.cursor()
+        self.batch_size = batch_size
+        self.batch_time = batch_time
+        self._pending = 0
+        self._commit_time = time()
+        self.claim_size = claim_size
+        self.lease_time = lease_time
+        self._claimed = deque() # claimed URLs not yet returned by next_url
+        self._held = dict() # ids of claimed URLs not yet done, by URL string
+        self._robots = RobotsCache(robots_cache, robots_expiry,
+                                   self._load_robots, self._refresh_robots)
+        self._last_times = dict() # last request time by netloc
+        self.recrawl = recrawl
+        self.codec = codec
+        self._revisits = set() # claimed URLs already visited, as strings
+        if wal:
+            self.cursor.execute("PRAGMA journal_mode=WAL")
+            self.cursor.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self.select("SELECT name FROM sqlite_master WHERE type='table' " \
+                        "AND name='url'")
+        except NoRow:
+            pass
+        else:
+            self.migrate()
         
     def execute(self, statement, *args):
         """ Execute the given SQL statement, substituting the remaining
@@ -102,11 +210,39 @@ class SQLImplementation (object):
         """
         try:
             self.cursor.execute(statement, args)
-            self.db.commit()
-            return self.cursor.lastrowid
+            row_id = self.cursor.lastrowid
         except DatabaseError as e:
             _debug(statement)
             raise e
+        self._pending += 1
+        self._maybe_commit()
+        return row_id
+
+    def execute_many(self, statement, args):
+        """ Execute the given SQL statement once for each tuple of arguments in
+            args.
+        """
+        try:
+            self.cursor.executemany(statement, args)
+        except DatabaseError as e:
+            _debug(statement)
+            raise e
+        self._pending += 1
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        """ Commit if the batch is full, or old enough.
+        """
+        if self._pending >= self.batch_size or (self._pending > 0 and
+                time() - self._commit_time >= self.batch_time):
+            self.commit()
+
+    def commit(self):
+        """ Commit any pending writes.
+        """
+        self.db.commit()
+        self._pending = 0
+        self._commit_time = time()
         
     def select(self, statement, *args):
         """ Execute the given SELECT SQL statement, substituting the remaining
@@ -139,14 +275,29 @@ class SQLImplementation (object):
             raise e        
         
     def close(self):
-        """ Close the database connection.
+        """ Commit any pending writes and close the database connection.
         """
+        self._robots.close()
+        self.commit()
         self.db.close()
 
     def initialise(self):
         """ Create SQL tables.
         """
         self.cursor.executescript(schema)
+        self.migrate()
+
+    def migrate(self):
+        """ Apply any migrations not yet applied to the database.
+        """
+        self.commit()
+        version = self.select("PRAGMA user_version")
+        for script in migrations[version:]:
+            version += 1
+            _debug("Migrating database to version {0}".format(version))
+            self.cursor.executescript(script)
+            self.cursor.execute("PRAGMA user_version={0}".format(version))
+        self.commit()
 
     def _select_url(self, url, select_time=False):
         """ Select a URL id from the database. If select_time, include the
@@ -166,19 +317,93 @@ class SQLImplementation (object):
         except NoRow:
             domain_id = self.execute("INSERT INTO domain(netloc) VALUES (?)",
                                      url.netloc)
-        return self.execute("INSERT INTO url(domain_id, url, time) " \
-                            "VALUES (?, ?, ?)", domain_id, str(url), t)
+        url_id = self.execute("INSERT INTO url(domain_id, url, time) " \
+                              "VALUES (?, ?, ?)", domain_id, str(url), t)
+        if t == 0:
+            self.execute("UPDATE domain SET queued=queued+1 WHERE id=?",
+                         domain_id)
+        return url_id
           
     def dump_resource(self, resource):
         """ Dump the resource to the database. Check for redirects.
         """
         url_id = self._select_url(resource.url)
-        for name, value in resource.headers.items():
-            self.execute("INSERT INTO header(url_id, name, value) " \
-                         "VALUES (?, ?, ?)", url_id, name, value)
-        content = Binary(resource.content)
-        self.execute("INSERT INTO content(url_id, content, hash) " \
-                     "VALUES (?, ?, ?)", url_id, content, resource.hash)
+        self._replace_links(resource.origin_url)
+        self.execute("DELETE FROM header WHERE url_id=?", url_id)
+        self.execute_many("INSERT INTO header(url_id, name, value) " \
+                          "VALUES (?, ?, ?)",
+                          [(url_id, name, value) for name, value
+                           in resource.headers.items()])
+        size = 0
+        if self.codec is None:
+            content = resource.content
+            size = len(content)
+        else:
+            compressor = codecs[self.codec][0]()
+            parts = list()
+            for chunk in resource.chunks():
+                size += len(chunk)
+                parts.append(compressor.compress(chunk))
+            parts.append(compressor.flush())
+            content = "".join(parts)
+        self.execute("INSERT OR REPLACE INTO content(url_id, content, hash, " \
+                     "codec, size) VALUES (?, ?, ?, ?, ?)", url_id,
+                     Binary(content), resource.hash, self.codec, size)
+        self._visited(url_id, True)
+
+    def _replace_links(self, url):
+        """ If the URL is being visited again, delete the links found on the
+            last visit (so that those found on this visit replace them), and
+            return its id. Otherwise return None.
+        """
+        if str(url) not in self._revisits:
+            return None
+        self._revisits.remove(str(url))
+        url_id = self._select_url(url)
+        self.execute("DELETE FROM link WHERE source_id=?", url_id)
+        return url_id
+
+    def _visited(self, url_id, changed):
+        """ Record a visit to a URL which has been dumped, and when to visit
+            it again. changed is whether the resource had changed since the
+            last visit, or None if it could not be fetched (in which case the
+            visit is not counted).
+        """
+        if self.recrawl is None:
+            return
+        now = int(time())
+        visits, changes, elapsed, last_visit = self.select("SELECT visits, " \
+            "changes, elapsed, last_visit FROM url WHERE id=?", url_id)
+        if last_visit is None:
+            if changed is None:
+                return
+            self.execute("UPDATE url SET last_visit=?, next_visit=? " \
+                         "WHERE id=?", now, now + self.recrawl.initial, url_id)
+            return
+        if changed is not None:
+            visits += 1
+            changes += 1 if changed else 0
+            elapsed += now - last_visit
+            last_visit = now
+        interval = self.recrawl.interval(visits, changes, elapsed)
+        self.execute("UPDATE url SET visits=?, changes=?, elapsed=?, " \
+                     "last_visit=?, next_visit=? WHERE id=?", visits,
+                     changes, elapsed, last_visit, now + interval, url_id)
+
+    def get_content(self, url):
+        """ Return the content dumped for the URL, decompressed, or None if
+            none has been.
+        """
+        try:
+            content, codec = self.select("SELECT content, codec " \
+                "FROM content, url WHERE url.url=? AND url_id=url.id",
+                str(url))
+        except NoRow:
+            return None
+        content = str(content)
+        if codec is not None:
+            content = codecs[codec][1](content)
+        return content
 
     def add_url(self, url):
         """ Add a URL, referencing the domain (domain is created if it does not
@@ -192,11 +417,16 @@ class SQLImplementation (object):
             if t is not None:
                 raise DuplicateURL()
             self.execute("UPDATE url SET time=0 WHERE id=?", url_id)
+            self.execute("UPDATE domain SET queued=queued+1 " \
+                         "WHERE id=(SELECT domain_id FROM url WHERE id=?)",
+                         url_id)
     
     def add_link(self, source, target):
         """ Add a link by referencing the source and target URLs.
         """
-        source_id = self._select_url(source)
+        source_id = self._replace_links(source)
+        if source_id is None:
+            source_id = self._select_url(source)
         try:
             target_id = self._select_url(target)
         except NoRow:
@@ -221,7 +451,7 @@ class SQLImplementation (object):
             url_id = self._select_url(target)
         except NoRow:
             url_id = self._insert_url(target)
-        self.execute("INSERT INTO redirect(source_id, target_id) " \
+        self.execute("INSERT OR REPLACE INTO redirect(source_id, target_id) "\
                      "VALUES (?, ?)", orig_id, url_id)
     
     def check_url(self, url):
@@ -235,48 +465,160 @@ class SQLImplementation (object):
             pass
     
     def next_url(self):
-        """ Return a URL to fetch - try to return a URL referencing the domain
-            with oldest 'time'. Update the 'time' on the returned URL with the
-            current timestamp, and don't return URLs with a non-null time. If
-            no URLs have been passed for domain of the URL, return the robots
-            URL instead (recording on the domain the current timestamp).
+        """ Return a URL to fetch, claiming a batch of URLs if none are left
+            from the last batch.
         """
         global limit
+        self._maybe_commit()
         if limit is not None:
             if limit == 0:
                 return None
             else:
                 limit -= 1
-        try:
-            domain_id, url_id, url = self.select("SELECT domain_id, " \
-                "url.id, url FROM domain, url WHERE url.domain_id=domain.id " \
-                "AND url.time=0 ORDER BY domain.time LIMIT 1")
-        except NoRow:
+        if len(self._claimed) == 0:
+            self._claim()
+        if len(self._claimed) == 0:
             return None
-        url = StdURL(url)
-        try:
-            self.select("SELECT time FROM domain WHERE id=? AND time > 0",
-                        domain_id)
-        except NoRow:
-            url = StdURL("http://{0}/robots.txt".format(url.netloc))
-            self.execute("UPDATE domain SET time=? WHERE id=?",
-                         int(time()), domain_id)
-        else:
-            self.execute("UPDATE url SET time=? WHERE id=?",
-                         int(time()), url_id)
-        return url
+        return self._claimed.popleft()
+
+    def _claim(self):
+        """ Claim URLs from the domains with the oldest 'time' which can be
+            fetched now, up to claim_size in total and spread evenly over the
+            domains. Claimed URLs have their 'time' set to the current
+            timestamp (so that they are not claimed again) and are leased. If
+            robots.txt has not been fetched for a domain, claim the robots URL
+            instead (recording on the domain the current timestamp).
+        """
+        now = int(time())
+        self._renew_leases(now)
+        if self.recrawl is not None:
+            self._schedule_recrawls(now)
+        domains = list(self.select_iter("SELECT id, netloc, time " \
+            "FROM domain WHERE queued > 0 AND time <= ? ORDER BY time " \
+            "LIMIT ?", now - crawler.default_delay, self.claim_size))
+        per_domain = max(self.claim_size / max(len(domains), 1), 1)
+        batches = list()
+        for domain_id, netloc, t in domains:
+            if t == 0:
+                self.execute("UPDATE domain SET time=? WHERE id=?",
+                             now, domain_id)
+                batches.append([(None,
+                                 "http://{0}/robots.txt".format(netloc),
+                                 None)])
+                continue
+            batch = list(self.select_iter("SELECT id, url, last_visit " \
+                                          "FROM url WHERE domain_id=? " \
+                                          "AND time=0 LIMIT ?",
+                                          domain_id, per_domain))
+            self.execute("UPDATE domain SET queued=queued-? WHERE id=?",
+                         len(batch), domain_id)
+            batches.append(batch)
+        self.execute_many("UPDATE url SET time=?, lease=? WHERE id=?",
+                          [(now, now + self.lease_time, url_id)
+                           for batch in batches for url_id, _, _ in batch
+                           if url_id is not None])
+        # interleave the domains
+        for i in xrange(max([len(batch) for batch in batches] or [0])):
+            for batch in batches:
+                if i < len(batch):
+                    url_id, url, last_visit = batch[i]
+                    if url_id is not None:
+                        self._held[url] = url_id
+                    if last_visit is not None:
+                        self._revisits.add(url)
+                    self._claimed.append(StdURL(url))
+
+    def _renew_leases(self, now):
+        """ Renew the leases on URLs claimed and not yet done, and return URLs
+            with expired leases to the queue.
+        """
+        self.execute_many("UPDATE url SET lease=? WHERE id=?",
+                          [(now + self.lease_time, url_id)
+                           for url_id in self._held.itervalues()])
+        # count in Python, as GROUP BY would not use the lease index
+        expired = dict()
+        for domain_id, in self.select_iter("SELECT domain_id FROM url " \
+                                           "WHERE lease < ?", now):
+            expired[domain_id] = expired.get(domain_id, 0) + 1
+        if len(expired) > 0:
+            _debug("Returning URLs with expired leases to the queue")
+            self.execute_many("UPDATE domain SET queued=queued+? WHERE id=?",
+                              [(count, domain_id)
+                               for domain_id, count in expired.iteritems()])
+            self.execute("UPDATE url SET time=0, lease=NULL WHERE lease < ?",
+                         now)
+
+    def _schedule_recrawls(self, now):
+        """ Return URLs which are due to be visited again to the queue, up to
+            the recrawl budget of each domain, and postpone the rest to the
+            start of the domain's next budget period.
+        """
+        budgets = dict() # [start, used] by domain id
+        queued = dict() # number of URLs returned to the queue by domain id
+        requeued = list()
+        postponed = list()
+        for url_id, domain_id, start, used in self.select_iter("SELECT " \
+            "url.id, domain_id, budget_start, budget_used FROM url, domain " \
+            "WHERE next_visit <= ? AND domain.id=domain_id " \
+            "ORDER BY next_visit LIMIT ?", now, self.claim_size):
+            budget = budgets.setdefault(domain_id, [start, used])
+            if now - budget[0] >= self.recrawl.period:
+                budget[:] = [now, 0]
+            if budget[1] < self.recrawl.budget:
+                budget[1] += 1
+                queued[domain_id] = queued.get(domain_id, 0) + 1
+                requeued.append((url_id, ))
+            else:
+                postponed.append((budget[0] + self.recrawl.period, url_id))
+        if len(budgets) == 0:
+            return
+        self.execute_many("UPDATE url SET time=0, next_visit=NULL " \
+                          "WHERE id=?", requeued)
+        self.execute_many("UPDATE url SET next_visit=? WHERE id=?", postponed)
+        self.execute_many("UPDATE domain SET budget_start=?, budget_used=?, " \
+                          "queued=queued+? WHERE id=?",
+                          [(start, used, queued.get(domain_id, 0), domain_id)
+                           for domain_id, (start, used)
+                           in budgets.iteritems()])
+
+    def next_time(self):
+        """ Return the time at which a URL will next be ready to claim, or
+            None if there are no URLs queued.
+        """
+        if len(self._claimed) > 0:
+            return time()
+        t = self.select("SELECT MIN(time) FROM domain WHERE queued > 0")
+        if t is not None:
+            t += crawler.default_delay
+        if self.recrawl is not None:
+            next_visit = self.select("SELECT MIN(next_visit) FROM url")
+            if next_visit is not None and (t is None or next_visit < t):
+                t = next_visit
+        return t
+
+    def done_url(self, url):
+        """ Release the lease on a URL the crawler has finished with.
+        """
+        url_id = self._held.pop(str(url), None)
+        self._revisits.discard(str(url))
+        if url_id is not None:
+            self.execute("UPDATE url SET lease=NULL WHERE id=?", url_id)
 
     def error(self, url, e):
         """ Record the error against the URL.
         """
         url_id = self._select_url(url)
-        self.execute("INSERT INTO error(url_id, type, error) VALUES (?, ?, ?)",
-                     url_id, e.__class__.__name__, str(e))
+        if isinstance(e, NotModified):
+            self._visited(url_id, False)
+            return
+        self.execute("INSERT OR REPLACE INTO error(url_id, type, error) " \
+                     "VALUES (?, ?, ?)", url_id, e.__class__.__name__, str(e))
+        self._visited(url_id, None)
         
     def duplicate_resource(self, resource):
         """ Check a web resource for duplication.
         """
-        if resource.content is None:
+        if not resource.has_content():
             # check the ETag, if there is one
             etag = resource.headers.get("ETag")
             if etag is not None:
@@ -289,56 +631,114 @@ class SQLImplementation (object):
             return
         # check the hash
         hasher = md5()
-        hasher.update(resource.content)
+        for chunk in resource.chunks():
+            hasher.update(chunk)
         resource.hash = hasher.hexdigest()
+        url_id = self._select_url(resource.url)
         try:
-            self.select("SELECT id FROM content WHERE hash=?", resource.hash)
-            raise DuplicateResource()
+            dup_id = self.select("SELECT url_id FROM content WHERE hash=? " \
+                                 "ORDER BY url_id=? DESC", resource.hash,
+                                 url_id)
         except NoRow:
             pass
+        else:
+            # unchanged, if it is the content last dumped for this URL
+            self._visited(url_id, False if dup_id == url_id else None)
+            raise DuplicateResource()
+
+    def validators(self, url):
+        """ Return the stored ETag and Last-Modified header values for the URL
+            (either of which may be None), or None if it has not been dumped.
+        """
+        try:
+            url_id = self._select_url(url)
+        except NoRow:
+            return None
+        headers = dict([(name.lower(), value) for name, value in
+                        self.select_iter("SELECT name, value FROM header " \
+                                         "WHERE url_id=?", url_id)])
+        if len(headers) == 0:
+            return None
+        return headers.get("etag"), headers.get("last-modified")
 
     def last_time(self, netloc):
         """ Return the last time a request was made to the specified domain,
             and record that a request is being made now. Returns 0 if this is
             the first request.
         """
-        domain_id, t = self.select("SELECT id, time FROM domain " \
-                                   "WHERE netloc=?", netloc)
-        self.execute("UPDATE domain SET time=? WHERE id=?",
-                     int(time()), domain_id)
+        t = self._last_times.get(netloc)
+        if t is None:
+            t = self.select("SELECT time FROM domain WHERE netloc=?", netloc)
+        now = time()
+        self._last_times[netloc] = now
+        self.execute("UPDATE domain SET time=? WHERE netloc=?",
+                     int(now), netloc)
         return t
 
     def parse_robots(self, netloc, content):
         """ Parse the given robots.txt content and store against the given
             domain. If content is None, any URL will be allowed.
         """
-        robot = RobotFileParser()
-        if content is not None:
-            robot.parse(content.split("\n"))
+        rules = RobotRules(content, crawler.user_agent)
         self.execute("UPDATE domain SET robots=? WHERE netloc=?",
-                     dumps(robot), netloc)
+                     dumps(rules), netloc)
+        self._robots.put(netloc, rules)
+        return rules
         
     def check_robots(self, url):
         """ If no attempt has yet been made to fetch robots.txt for the domain
             of the specified URL, raise NoRobots. Otherwise, if access to the
             specified URL is not allowed according to the stored robots.txt,
-            raise URLNotAllowed. Otherwise, return the crawl delay required by
-            robots.txt, or None if not specified.
+            raise URLNotAllowed. Otherwise, return the delay between requests
+            to the domain (the Crawl-delay from robots.txt if it is longer
+            than the default delay).
         """
-        robots = self.select("SELECT robots FROM domain WHERE netloc=?",
-                             url.netloc)
-        if robots is None:
+        rules = self._robots.get(url.netloc)
+        if rules is None:
             raise NoRobots()
-        robot = loads(str(robots))
-        if not robot.can_fetch(crawler.user_agent, url.path):
+        if not rules.can_fetch(url.path):
             raise URLNotAllowed()
-        return crawler.default_delay
+        return rules.delay(crawler.default_delay)
+
+    def _load_robots(self, netloc):
+        """ Load the robots.txt rules for a domain from the database, or return
+            None if robots.txt has not been fetched.
+        """
+        try:
+            robots = self.select("SELECT robots FROM domain WHERE netloc=?",
+                                 netloc)
+        except NoRow:
+            return None
+        if robots is None:
+            return None
+        rules = loads(str(robots))
+        if isinstance(rules, RobotFileParser):
+            # stored by an older version, without the crawl delay, so
+            # refresh it straight away
+            rules = RobotRules(None, crawler.user_agent, rules)
+            rules.time = 0
+        return rules
+
+    def _refresh_robots(self, netloc):
+        """ Fetch robots.txt for a domain again (called in the background).
+        """
+        content = crawler.fetch_robots(
+                  StdURL("http://{0}/robots.txt".format(netloc)))
+        self.api_lock.acquire()
+        try:
+            return self.parse_robots(netloc, content)
+        finally:
+            self.api_lock.release()
 
     def stats(self):
         """ Output database stats to stdout.
         """
         n = self.select("SELECT COUNT(*) FROM content")
         print n, "URLs downloaded"
+        size, stored = self.select("SELECT SUM(size), SUM(LENGTH(content)) " \
+                                   "FROM content WHERE size IS NOT NULL")
+        if size is not None:
+            print size, "bytes of content stored in", stored, "bytes"
         n_e = self.select("SELECT COUNT(*) FROM error WHERE type='HTTPError'")
         print n_e, "HTTP errors:"
         for source, target, e in self.select_iter("SELECT src.url, tgt.url, " \
@@ -376,18 +776,20 @@ if __name__ == "__main__":
         crawler.default_delay = 0
     if "-t" in argv[1:]:
         crawler.http_threads = 1
+    engine = event_crawler if "-e" in argv[1:] else crawler
     initialise = "-i" in argv[1:]
     domain = "-d" in argv[1:]
     single_url = "-u" in argv[1:]
     limit = 5 if "-l" in argv[1:] else None
     stats = "-s" in argv[1:]
+    recrawl = RecrawlPolicy() if "-r" in argv[1:] else None
     
     for arg in argv[1:]:
         if arg[0] == "-":
             argv.remove(arg)
 
     if len(argv) < (3 if not stats else 2):
-        print """Usage: [-v|-q|-i|-s|-l] <db path> <initial URL>
+        print """Usage: [-v|-q|-i|-s|-l|-e|-r] <db path> <initial URL>
 
 Flags: -v  Output debug messages
        -q  Set default delay to 0
@@ -396,6 +798,8 @@ Flags: -v  Output debug messages
        -u  Do not follow any URLs (single URL mode)
        -l  Limit the number of URLs crawled to 5
        -t  Run only one crawler thread
+       -e  Use the event-driven crawl engine
+       -r  Visit pages again as they change (the crawl does not finish)
        -s  Don't crawl, but output database stats
 """
         exit()
@@ -403,7 +807,7 @@ Flags: -v  Output debug messages
     if initialise and isfile(argv[1]):
         unlink(argv[1])
 
-    sql = SQLImplementation(argv[1])
+    sql = SQLImplementation(argv[1], recrawl=recrawl)
 
     if initialise:
         sql.initialise()
@@ -421,7 +825,7 @@ Flags: -v  Output debug messages
         crawler.robots = sql
         crawler.error = sql
         sql.add_url(StdURL(argv[2]))
-        crawler.start()
+        engine.start()
 
     sql.close()
     
@@ -15,10 +15,22 @@
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 """ Module including a standard URL class.
+
+    URLs are put in a canonical form when a StdURL is created, so that
+    different spellings of the same URL compare equal. The steps are applied
+    by the module's canonicaliser (an instance of Canonicaliser), which can be
+    replaced to turn steps on or off, for example:
+
+        stdurl.canonicaliser = Canonicaliser(sort_query=True,
+                                             strip_params=TRACKING_PARAMS)
 """
 
 from urlparse import urljoin, urlsplit
 
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAMS = ("utm_source", "utm_medium", "utm_campaign", "utm_term",
+                   "utm_content", "gclid")
+
 
 def stdurl(raw_url):
     """ Convert the argument to a StdURL.
@@ -27,73 +39,176 @@ def stdurl(raw_url):
         return None
     return StdURL(raw_url)
 
+def remove_dot_segments(path):
+    """ Resolve "." and ".." segments in a path (as in RFC 3986).
+    """
+    if "/." not in path and not path.startswith("."):
+        return path
+    segments = path.split("/")
+    output = list()
+    for segment in segments:
+        if segment == ".":
+            continue
+        if segment == "..":
+            # never remove the empty segment before the root "/"
+            if len(output) > 1 or (output and output[0] != ""):
+                output.pop()
+            continue
+        output.append(segment)
+    if segments[-1] in (".", ".."):
+        output.append("")
+    return "/".join(output)
+
+
+class Canonicaliser (object):
+    """ Puts the parts of a URL in a canonical form, with a number of steps
+        which can each be turned on or off.
+    """
+
+    def __init__(self, lower_case=True, default_port=True, dot_segments=True,
+                 sort_query=False, strip_params=()):
+        """ The steps are:
+
+            - lower_case: case-fold the scheme and host.
+            - default_port: remove the port if it is the default for the
+              scheme (or empty).
+            - dot_segments: resolve "." and ".." segments in the path, and use
+              "/" for an empty HTTP path.
+            - sort_query: sort the parameters in the query string (which
+              changes the meaning of URLs for a few web applications).
+            - strip_params: names of query parameters to remove (such as
+              TRACKING_PARAMS).
+        """
+        self.lower_case = lower_case
+        self.default_port = default_port
+        self.dot_segments = dot_segments
+        self.sort_query = sort_query
+        self.strip_params = frozenset(strip_params)
+
+    def canonicalise(self, scheme, netloc, path, query):
+        """ Return the canonical (scheme, netloc, path, query).
+        """
+        if self.lower_case:
+            scheme = scheme.lower()
+        if self.lower_case or self.default_port:
+            netloc = self._netloc(scheme, netloc)
+        if self.dot_segments:
+            path = remove_dot_segments(path)
+            if path == "" and netloc and scheme in DEFAULT_PORTS:
+                path = "/"
+        if query and (self.sort_query or self.strip_params):
+            params = query.split("&")
+            if self.strip_params:
+                params = [param for param in params
+                          if param.split("=", 1)[0] not in self.strip_params]
+            if self.sort_query:
+                params.sort()
+            query = "&".join(params)
+        return scheme, netloc, path, query
+
+    def _netloc(self, scheme, netloc):
+        """ Lower case the host and remove a default port, leaving any user
+            name and password alone.
+        """
+        if "@" in netloc:
+            userinfo, at, hostport = netloc.rpartition("@")
+        else:
+            userinfo, at, hostport = "", "", netloc
+        if self.lower_case:
+            hostport = hostport.lower()
+        if self.default_port:
+            host, colon, port = hostport.rpartition(":")
+            if colon and (port == "" or port.isdigit() and
+                          int(port) == DEFAULT_PORTS.get(scheme)):
+                hostport = host
+        return userinfo + at + hostport
+
+canonicaliser = Canonicaliser() # used by StdURL
+
 
 class StdURL (object):
     """Class representing a URL, the scheme of which is assumed to be HTTP.
+
+       The string form and hash are computed once, when the URL is created.
     """
 
+    __slots__ = ("scheme", "hostname", "port", "netloc", "path", "query",
+                 "extension", "selector", "_str", "_hash")
+
     def __init__(self, url, parent=None):
-        """ Create a StdURL instance for the given URL.
+        """ Create a StdURL instance for the given URL, in canonical form.
         
             If parent is specified, then the URL is resolved relative to it.
         """
         if parent is not None:
             # resolve the url relative to the parent
             if isinstance(parent, StdURL):
-                parent = str(parent)
+                parent = parent._str
             if isinstance(url, StdURL):
-                url = str(url)
+                url = url._str
             url = urljoin(parent, url)
-        # in case a StdURL is passed as the url argument (copy)
-        if isinstance(url, StdURL):
-            parts = url
-        else:
-            parts = urlsplit(url.strip())
-        # pull out most parts from urlsplit
-        self.scheme = parts.scheme
+        elif isinstance(url, StdURL):
+            # copy, which is already in canonical form
+            for name in StdURL.__slots__:
+                setattr(self, name, getattr(url, name))
+            return
+        parts = urlsplit(url.strip())
+        self.scheme, self.netloc, self.path, self.query = \
+            canonicaliser.canonicalise(parts.scheme, parts.netloc, parts.path,
+                                       parts.query)
         self.hostname = parts.hostname
         self.port = parts.port
-        self.netloc = parts.netloc
-        self.path = parts.path
-        self.query = parts.query
+        if len(self.netloc) != len(parts.netloc):
+            # the default port was removed
+            self.port = None
         # compute some extra properties based on above
         if self.path.find(".") == -1:
             self.extension = ""
         else:
             self.extension = self.path.split(".")[-1]
-        query_str = "?{0}".format(self.query) if self.query else ""
-        self.selector = "{0}{1}".format(self.path, query_str)
+        if self.query:
+            self.selector = self.path + "?" + self.query
+        else:
+            self.selector = self.path
+        self._str = self.scheme + "://" + self.netloc + self.selector
+        self._hash = hash(self._str)
 
     def __eq__(self, other):
         """ Two StdURL instances are equal if they have the same scheme, host,
             port, path and query.
         """
-        if other is None:
+        if not isinstance(other, StdURL):
             return False
-        return self.scheme == other.scheme and self.netloc == other.netloc \
-               and self.selector == other.selector
+        return self._hash == other._hash and self._str == other._str
 
     def __ne__(self, other):
         """ Two StdURL instances are unequal if they differ in scheme, host,
             port, path or query.
         """
-        if other is None:
-            return True
-        return self.scheme != other.scheme or self.netloc != other.netloc \
-               or self.selector != other.selector
+        return not self.__eq__(other)
 
     def __hash__(self):
         """ Returns a suitable hash value for the StdURL.
         """
-        return hash(str(self))
+        return self._hash
 
     def __str__(self):
         """ Ignore any URL fragment (#foo) for the string representation.
         """
-        return "{0}://{1}{2}".format(self.scheme, self.netloc, self.selector)
+        return self._str
+
+    def __repr__(self):
+        return "StdURL({0!r})".format(self._str)
+
+    def __reduce__(self):
+        """ Pickle as the string form (slotted classes need help to pickle).
+        """
+        return StdURL, (self._str,)
 
 
 if __name__ == "__main__":
+    from pickle import dumps, loads
+
     url1 = StdURL("http://www.google.com")
     url2 = StdURL("http://www.google.com")
     url3 = StdURL("http://www.google.co.uk")
@@ -109,5 +224,26 @@ if __name__ == "__main__":
     assert StdURL("mailto:abc@foo.com", url4).scheme == "mailto"
     assert StdURL("foo.html", url4) == StdURL("http://www.abc.com/foo.html")
     assert StdURL("http://foo", url4) == StdURL("http://foo")
-    print "TEST PASSED"
+    assert StdURL(url4) == url4 and str(StdURL(url4)) == str(url4)
+    assert loads(dumps(url4)) == url4
 
+    # canonicalisation
+    assert str(StdURL("HTTP://WWW.Abc.COM:80/A/./b/../C.html#x")) == \
+           "http://www.abc.com/A/C.html"
+    assert str(StdURL("https://Abc.com:443")) == "https://abc.com/"
+    assert str(StdURL("http://User:Pw@abc.com:8080/")) == \
+           "http://User:Pw@abc.com:8080/"
+    assert StdURL("http://abc.com:/x").port is None
+    assert str(StdURL("../../d", "http://abc.com/a/b/c")) == "http://abc.com/d"
+    assert remove_dot_segments("/a/b/c/./../../g") == "/a/g"
+    assert remove_dot_segments("/..") == "/"
+    assert remove_dot_segments("/a/b/.") == "/a/b/"
+    assert remove_dot_segments("a/../b") == "b"
+    url = "http://abc.com/?b=2&utm_source=x&a=1"
+    assert StdURL(url).query == "b=2&utm_source=x&a=1"
+    canonicaliser = Canonicaliser(sort_query=True,
+                                  strip_params=TRACKING_PARAMS)
+    assert str(StdURL(url)) == "http://abc.com/?a=1&b=2"
+    canonicaliser = Canonicaliser(False, False, False)
+    assert str(StdURL("http://Abc.com:80/./x")) == "http://Abc.com:80/./x"
+    print "TEST PASSED"
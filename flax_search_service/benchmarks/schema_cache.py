@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Copyright (c) 2009 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""Benchmark the per-request cost of looking up a database schema.
+
+Compares reading and parsing the schema from the database metadata (as every
+request used to do) with the controller's schema cache, on a small database.
+
+Usage:
+
+    $ python benchmarks/schema_cache.py [iterations]
+
+"""
+__docformat__ = "restructuredtext en"
+
+# Ensure flax and its external dependencies are on the path.
+import os.path
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ext
+
+import shutil
+import tempfile
+import time
+
+from flax.searchserver import controller
+
+def timeit(fn, iterations):
+    start = time.time()
+    for i in xrange(iterations):
+        fn()
+    return (time.time() - start) / iterations
+
+def main(iterations):
+    dbs_path = tempfile.mkdtemp()
+    try:
+        ctl = controller.Controller('http://localhost/', dbs_path,
+                                    {'xappy': {}}, None)
+        ctl.create_db('xappy', 'bench', False, False)
+
+        scm = ctl.get_schema('bench').copy()
+        for i in xrange(10):
+            scm.set_field('field%d' % i, {'type': 'text', 'store': True,
+                                          'freetext': {}})
+        scm.set_template('tmpl', 'Search(QueryText(params.q[0]), 0, 10)',
+                         'text/javascript')
+        ctl.set_schema('bench', scm)
+        dbw = ctl.get_db_writer('bench')
+        for i in xrange(100):
+            dbw.add_document(dict(('field%d' % j, 'document %d' % i)
+                                  for j in xrange(10)))
+        ctl.flush('bench')
+
+        def uncached():
+            db = ctl.get_db_reader('bench')
+            try:
+                db.get_schema()
+            finally:
+                ctl.release_db_reader('bench', db)
+
+        def cached():
+            ctl.get_schema('bench')
+
+        t_uncached = timeit(uncached, iterations)
+        t_cached = timeit(cached, iterations)
+        print "schema read per request:   %8.1f us" % (t_uncached * 1e6)
+        print "schema cache per request:  %8.1f us" % (t_cached * 1e6)
+        print "saving per request:        %8.1f us (%.0fx)" % (
+            (t_uncached - t_cached) * 1e6, t_uncached / max(t_cached, 1e-9))
+        ctl.close()
+    finally:
+        shutil.rmtree(dbs_path)
+
+if __name__ == '__main__':
+    try:
+        iterations = int(sys.argv[1])
+    except IndexError:
+        iterations = 10000
+    main(iterations)
@@ -242,6 +242,50 @@ class Database(object):
             uri += '/' + utils.quote(str(docid))
         return self._client.do_request(uri, 'POST', json=doc)
 
+    def bulk(self, operations, batch_size=1000):
+        """Add and delete documents in bulk.
+
+        `operations` is an iterable of operations, each of which is a dict of
+        one of the following forms:
+
+         - ``{'add': doc}`` to add a document.
+         - ``{'add': doc, 'id': docid}`` to add or replace a document.
+         - ``{'delete': docid}`` to delete a document.
+
+        Operations are sent to the server `batch_size` at a time, so
+        `operations` may be a generator producing any number of operations.
+
+        Returns a dict containing the total number of documents 'added' and
+        'deleted' (that is, queued to be indexed), the number of operations
+        which 'failed', and a list of 'errors', each giving the 'line'
+        (counting from 1 across all the operations) and the 'error' message.
+
+        """
+        uri = self._basepath + '/docs/_bulk'
+        totals = {'added': 0, 'deleted': 0, 'failed': 0, 'errors': []}
+
+        def send(lines, offset):
+            res = utils.json.loads(self._client.do_request(uri, 'POST',
+                data='\n'.join(lines) + '\n',
+                content_type='application/x-ndjson'))
+            for key in ('added', 'deleted', 'failed'):
+                totals[key] += res[key]
+            for error in res['errors']:
+                error['line'] += offset
+                totals['errors'].append(error)
+
+        lines = []
+        offset = 0
+        for op in operations:
+            lines.append(utils.json.dumps(op))
+            if len(lines) >= batch_size:
+                send(lines, offset)
+                offset += len(lines)
+                lines = []
+        if lines:
+            send(lines, offset)
+        return totals
+
     def get_document(self, docid):
         """Get the document with the given id.
 
@@ -262,6 +306,31 @@ class Database(object):
         """
         self._client.do_request(self._basepath + '/flush', 'POST')
 
+    def get_commit_policy(self):
+        """Get the policy for automatically committing changes.
+
+        Returns a dict with "max_docs" and "max_seconds" items.
+
+        """
+        return utils.json.loads(self._client.do_request(self._basepath +
+                                                        '/commit_policy'))
+
+    def set_commit_policy(self, max_docs=None, max_seconds=None):
+        """Set the policy for automatically committing changes.
+
+        Changes are committed once `max_docs` documents have been changed, or
+        `max_seconds` after the first uncommitted change.  Items left as None
+        are unchanged; set them to 0 to disable that trigger.
+
+        """
+        policy = {}
+        if max_docs is not None:
+            policy['max_docs'] = max_docs
+        if max_seconds is not None:
+            policy['max_seconds'] = max_seconds
+        self._client.do_request(self._basepath + '/commit_policy', 'PUT',
+                                json=policy)
+
     def search_simple(self, searchstring, start_rank=0, end_rank=10,
                       default_op='AND'):
         return SearchResults(self._client.do_request(self._basepath + '/search/simple', 'GET',
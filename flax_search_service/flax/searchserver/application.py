@@ -63,7 +63,10 @@ class DbResource(Resource):
         """
         dbname = request.pathinfo['dbname']
         db = self.controller.get_db_reader(dbname)
-        return db.get_info()
+        try:
+            return db.get_info()
+        finally:
+            self.controller.release_db_reader(dbname, db)
 
 
     @pathinfo(dbname_param)
@@ -130,6 +133,14 @@ class SearchServer(object):
          - `backend_settings`: A dictionary of backend-specific settings, keyed
            by backend name.  These will be passed directly to the backend in
            use.
+         - `reader_pool_size`: The maximum number of idle readers to keep open
+           for each database (default 10).
+         - `reader_idle_time`: The number of seconds after which an idle
+           reader is closed (default 60).
+         - `result_cache_size`: The maximum size, in bytes, of the cache of
+           search results (default 0, which disables the cache).
+         - `template_contexts`: The maximum number of javascript contexts to
+           keep open for running search templates (default 10).
 
         For example:
 
@@ -163,6 +174,10 @@ class SearchServer(object):
                                                 self.dbs_path,
                                                 self.backend_settings,
                                                 self.settings_db,
+                                                settings.get('reader_pool_size', 10),
+                                                settings.get('reader_idle_time', 60.0),
+                                                result_cache_size=settings.get('result_cache_size', 0),
+                                                template_contexts=settings.get('template_contexts', 10),
                                                )
 
     @allow_GETHEAD
@@ -182,6 +197,10 @@ class SearchServer(object):
                 'PROTOCOL': version.PROTOCOL_VERSION,
             },
             'backends': backend_versions,
+            'readers': self.controller.reader_stats(),
+            'writers': self.controller.writer_stats(),
+            'result_cache': self.controller.result_cache_stats(),
+            'templates': self.controller.template_stats(),
         }
 
     #### DB methods ####
@@ -202,13 +221,51 @@ class SearchServer(object):
     def db_flush(self, request):
         """Flush changes to the database.
 
-        FIXME: this is a hack!
-        (we also need to support automatic flushing).
+        Changes are also committed automatically, according to the database's
+        commit policy, so this is only needed when changes must be visible to
+        searches immediately.
+
         """
         dbname = request.pathinfo['dbname']
         self.controller.flush(dbname)
         return True
 
+    @allow_GETHEAD
+    @noparams
+    @pathinfo(dbname_param)
+    @jsonreturning
+    def commit_policy_get(self, request):
+        """Get the policy for automatically committing changes.
+
+        """
+        dbname = request.pathinfo['dbname']
+        dbw = self.controller.get_db_writer(dbname)
+        try:
+            return dbw.get_commit_policy()
+        except NotImplementedError:
+            raise HTTPNotFound()
+
+    @allow_POST
+    @allow_PUT
+    @pathinfo(dbname_param)
+    @jsonreturning
+    def commit_policy_set(self, request):
+        """Set the policy for automatically committing changes.
+
+        The request body is a JSON object, which may contain "max_docs" (the
+        number of changed documents after which changes are committed) and
+        "max_seconds" (the delay after the first uncommitted change before
+        changes are committed).  A value of null or 0 disables that trigger.
+
+        """
+        dbname = request.pathinfo['dbname']
+        dbw = self.controller.get_db_writer(dbname)
+        try:
+            dbw.set_commit_policy(request.json)
+        except NotImplementedError:
+            raise HTTPNotFound()
+        return True
+
     #### schema methods ####
 
     @allow_GETHEAD
@@ -217,8 +274,7 @@ class SearchServer(object):
     @jsonreturning
     def schema_info(self, request):
         dbname = request.pathinfo['dbname']
-        db = self.controller.get_db_reader(dbname)
-        scm = db.get_schema()
+        scm = self.controller.get_schema(dbname)
         return scm.as_dict()
 
     @allow_GETHEAD
@@ -227,8 +283,7 @@ class SearchServer(object):
     @jsonreturning
     def schema_get_language(self, request):
         dbname = request.pathinfo['dbname']
-        db = self.controller.get_db_reader(dbname)
-        scm = db.get_schema()
+        scm = self.controller.get_schema(dbname)
         return scm.language
 
     @allow_POST
@@ -248,11 +303,9 @@ class SearchServer(object):
         dbname = request.pathinfo['dbname']
         language = request.pathinfo['language']
 
-        dbr = self.controller.get_db_reader(dbname)
-        dbw = self.controller.get_db_writer(dbname)
-        scm = dbr.get_schema()
+        scm = self.controller.get_schema(dbname).copy()
         scm.language = language
-        dbw.set_schema(scm)
+        self.controller.set_schema(dbname, scm)
         # FIXME - should we flush this immediately?
 
         return True
@@ -269,8 +322,7 @@ class SearchServer(object):
         """
         dbname = request.pathinfo['dbname']
         fieldname = request.pathinfo['fieldname']
-        dbr = self.controller.get_db_reader(dbname)
-        scm = dbr.get_schema()
+        scm = self.controller.get_schema(dbname).copy()
 
 #        # don't overwrite existing field
 #        if request.method == 'POST' and fieldname in scm.get_field_names():
@@ -278,8 +330,7 @@ class SearchServer(object):
 
         try:
             scm.set_field(fieldname, request.json)
-            dbw = self.controller.get_db_writer(dbname)
-            dbw.set_schema(scm)
+            self.controller.set_schema(dbname, scm)
             self.controller.flush(dbname)
             return True
         except schema.FieldError, e:
@@ -292,8 +343,7 @@ class SearchServer(object):
         dbname = request.pathinfo['dbname']
         fieldname = request.pathinfo['fieldname']
 
-        db = self.controller.get_db_reader(dbname)
-        scm = db.get_schema()
+        scm = self.controller.get_schema(dbname)
         try:
             return scm.get_field(fieldname)
         except KeyError:
@@ -306,16 +356,14 @@ class SearchServer(object):
         dbname = request.pathinfo['dbname']
         fieldname = request.pathinfo['fieldname']
 
-        dbr = self.controller.get_db_reader(dbname)
-        scm = dbr.get_schema()
+        scm = self.controller.get_schema(dbname).copy()
         try:
             scm.get_field(fieldname) # check it exists
         except KeyError:
             raise HTTPNotFound()
 
         scm.delete_field(fieldname)
-        dbw = self.controller.get_db_writer(dbname)
-        dbw.set_schema(scm)
+        self.controller.set_schema(dbname, scm)
         self.controller.flush(dbname)
         return True
 
@@ -324,8 +372,7 @@ class SearchServer(object):
     @jsonreturning
     def fields_list(self, request):
         dbname = request.pathinfo['dbname']
-        db = self.controller.get_db_reader(dbname)
-        scm = db.get_schema()
+        scm = self.controller.get_schema(dbname)
         return scm.get_field_names()
 
     @allow_GETHEAD
@@ -338,8 +385,7 @@ class SearchServer(object):
         dbname = request.pathinfo['dbname']
         tmplname = request.pathinfo['tmplname']
 
-        dbr = self.controller.get_db_reader(dbname)
-        scm = dbr.get_schema()
+        scm = self.controller.get_schema(dbname)
         try:
             return scm.get_template(tmplname)
         except KeyError:
@@ -355,8 +401,7 @@ class SearchServer(object):
         """
         dbname = request.pathinfo['dbname']
         tmplname = request.pathinfo['tmplname']
-        dbr = self.controller.get_db_reader(dbname)
-        scm = dbr.get_schema()
+        scm = self.controller.get_schema(dbname).copy()
 
 #        # don't overwrite existing template
 #        if request.method == 'POST' and tmplname in scm.get_template_names():
@@ -364,8 +409,8 @@ class SearchServer(object):
 
         try:
             scm.set_template(tmplname, request.raw_post_data, request.content_type)
-            dbw = self.controller.get_db_writer(dbname)
-            dbw.set_schema(scm)
+            self.controller.set_schema(dbname, scm)
+            self.controller.forget_template(dbname, tmplname)
             self.controller.flush(dbname)
             return True
         except schema.FieldError, e:
@@ -384,6 +429,8 @@ class SearchServer(object):
             return db.get_document(doc_id)
         except KeyError:
             raise HTTPNotFound()
+        finally:
+            self.controller.release_db_reader(dbname, db)
 
     @allow_POST
     @pathinfo(dbname_param)
@@ -429,6 +476,71 @@ class SearchServer(object):
         dbw.delete_document(request.pathinfo['docid'])
         return True
 
+    # Maximum number of per-line errors reported by doc_bulk.
+    max_bulk_errors = 100
+
+    @allow_POST
+    @pathinfo(dbname_param)
+    @jsonreturning
+    def doc_bulk(self, request):
+        """Add and delete documents in bulk.
+
+        The request body is newline-delimited JSON, with one operation on each
+        line:
+
+         - ``{"add": {document data}}`` adds a document.
+         - ``{"add": {document data}, "id": "<doc_id>"}`` adds or replaces the
+           document with the specified ID.
+         - ``{"delete": "<doc_id>"}`` deletes a document.
+
+        Blank lines are ignored.  The body is read and passed to the database
+        writer a line at a time, so it is never held in memory as a whole.
+
+        Each document is checked before it is passed to the writer: its fields
+        must be in the schema, and their values strings or numbers (or lists
+        of them).
+
+        Returns the number of documents added and deleted, the number of lines
+        which could not be processed, and the line numbers and messages of
+        the first errors found.  Changes are applied asynchronously, so the
+        documents counted as added and deleted have been queued for the
+        writer, not yet indexed.
+
+        """
+        dbname = request.pathinfo['dbname']
+        dbw = self.controller.get_db_writer(dbname)
+        fields = set(self.controller.get_schema(dbname).get_field_names())
+        added = 0
+        deleted = 0
+        failed = 0
+        errors = []
+        lineno = 0
+        for line in utils.iter_body_lines(request):
+            lineno += 1
+            if not line.strip():
+                continue
+            try:
+                action, doc, docid = utils.parse_bulk_operation(line, fields)
+            except ValueError, e:
+                failed += 1
+                if len(errors) < self.max_bulk_errors:
+                    errors.append({'line': lineno, 'error': str(e)})
+                continue
+
+            if action == 'add':
+                dbw.add_document(doc, docid=docid)
+                added += 1
+            else:
+                dbw.delete_document(docid)
+                deleted += 1
+
+        return {
+            'added': added,
+            'deleted': deleted,
+            'failed': failed,
+            'errors': errors,
+        }
+
     #### Search methods ####
 
     # Define our common decorators once, it saves space and conforms to DRY.
@@ -497,7 +609,6 @@ class SearchServer(object):
         summary_fields = set(request.params['summary_field'])
         summary_maxlen = int(request.params['summary_maxlen'][0])
         summary_hl = (request.params['highlight_bra'][0], request.params['highlight_ket'][0])
-        db = self.controller.get_db_reader(dbname)
 
         qlist = [queries.QueryText(querystr.decode('utf-8'), default_op=default_op)
                  for querystr in request.params['query']]
@@ -506,7 +617,7 @@ class SearchServer(object):
                                 summary_fields=summary_fields,
                                 summary_maxlen=summary_maxlen,
                                 summary_hl=summary_hl)
-        return db.search(search)
+        return self.controller.search(dbname, search)
 
     @allow_GETHEAD
     @pathinfo(dbname_param, tmplname_param)
@@ -517,16 +628,15 @@ class SearchServer(object):
         """
         dbname = request.pathinfo['dbname']
         tmplname = request.pathinfo['tmplname']
-        db = self.controller.get_db_reader(dbname)
-        scm = db.get_schema()
+        scm = self.controller.get_schema(dbname)
         tmpl = scm.get_template(tmplname)
         if tmpl['content_type'] != 'text/javascript':
             raise ValueError('Template not in known language')
         tmpl = tmpl['template']
-        import jstemplates
-        env = jstemplates.JsTemplateEvaluator()
-        search = env.search_template(tmpl, request.params)
-        return db.search(search)
+        env = self.controller.get_template_evaluator()
+        search = env.search_template(tmpl, request.params,
+                                     name=(dbname, tmplname))
+        return self.controller.search(dbname, search)
 
     @allow_GETHEAD
     @pathinfo(dbname_param)
@@ -541,7 +651,10 @@ class SearchServer(object):
         """
         dbname = request.pathinfo['dbname']
         db = self.controller.get_db_reader(dbname)
-        return [db.spell_correct(query) for query in request.params['query']]
+        try:
+            return [db.spell_correct(query) for query in request.params['query']]
+        finally:
+            self.controller.release_db_reader(dbname, db)
 
     @allow_GETHEAD
     @pathinfo(dbname_param)
@@ -573,7 +686,6 @@ class SearchServer(object):
         summary_maxlen = int(request.params['summary_maxlen'][0])
         summary_hl = (request.params['highlight_bra'][0], request.params['highlight_ket'][0])
         pcutoff = int(request.params['pcutoff'][0])
-        db = self.controller.get_db_reader(dbname)
 
         search = queries.Search(queries.QuerySimilar(ids),
                                 start_rank, end_rank,
@@ -581,7 +693,7 @@ class SearchServer(object):
                                 summary_fields=summary_fields,
                                 summary_maxlen=summary_maxlen,
                                 summary_hl=summary_hl)
-        return db.search(search)
+        return self.controller.search(dbname, search)
 
     @allow_GETHEAD
     @pathinfo(dbname_param)
@@ -618,7 +730,6 @@ class SearchServer(object):
 
         """
         dbname = request.pathinfo['dbname']
-        db = self.controller.get_db_reader(dbname)
         summary_fields = set(request.params['summary_field'])
         summary_maxlen = int(request.params['summary_maxlen'][0])
         summary_hl = (request.params['highlight_bra'][0], request.params['highlight_ket'][0])
@@ -676,7 +787,7 @@ class SearchServer(object):
                                 summary_maxlen=summary_maxlen,
                                 summary_hl=summary_hl)
         print repr(search)
-        return db.search(search)
+        return self.controller.search(dbname, search)
 
     #### term methods (HACK) ####
 
@@ -695,8 +806,11 @@ class SearchServer(object):
         dbname = request.pathinfo['dbname']
         fieldname = request.pathinfo['fieldname']
         db = self.controller.get_db_reader(dbname)
-        return db.get_terms(fieldname, request.params['starts_with'][0],
-                            int(request.params['max_terms'][0]))
+        try:
+            return db.get_terms(fieldname, request.params['starts_with'][0],
+                                int(request.params['max_terms'][0]))
+        finally:
+            self.controller.release_db_reader(dbname, db)
 
     #### metadata methods ####
     
@@ -712,6 +826,8 @@ class SearchServer(object):
             return db.get_metadata(metakey)
         except KeyError:
             raise HTTPNotFound()
+        finally:
+            self.controller.release_db_reader(dbname, db)
 
     @allow_POST
     @allow_PUT
@@ -721,8 +837,7 @@ class SearchServer(object):
         dbname = request.pathinfo['dbname']
         metakey = request.pathinfo['metakey']
 
-        db = self.controller.get_db_writer(dbname)
-        db.set_metadata(metakey, request.json)
+        self.controller.set_metadata(dbname, metakey, request.json)
         return 1
         
     #### end of implementations ####
@@ -733,6 +848,10 @@ class SearchServer(object):
             'v1/dbs': self.dbnames,
             'v1/dbs/*': DbResource(self.controller),
             'v1/dbs/*/flush': self.db_flush,
+            'v1/dbs/*/commit_policy': Resource(
+                get=self.commit_policy_get,
+                post=self.commit_policy_set,
+                put=self.commit_policy_set),
             'v1/dbs/*/schema': self.schema_info,
             'v1/dbs/*/schema/language': Resource(
                 get=self.schema_get_language,
@@ -750,6 +869,7 @@ class SearchServer(object):
                 put=self.template_set),
             'v1/dbs/*/docs': Resource(
                 post=self.doc_add),
+            'v1/dbs/*/docs/_bulk': self.doc_bulk,
             'v1/dbs/*/docs/*': Resource(
                 get=self.doc_get,
                 post=self.doc_add2,
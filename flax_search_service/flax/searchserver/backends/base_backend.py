@@ -117,6 +117,17 @@ class BaseDbReader(object):
         """
         pass
 
+    def reopen(self):
+        """Bring the reader up to date with the latest committed revision.
+
+        Readers are kept open in a pool between requests, so this is called
+        after the writer has committed changes.  The default implementation
+        simply closes the reader, on the assumption that resources are reopened
+        lazily.
+
+        """
+        self.close()
+
     def get_info(self):
         """Get version information about the database.
 
@@ -175,6 +186,10 @@ class BaseDbWriter(object):
         self.base_uri = base_uri
         self.db_path = db_path
 
+        # Callable to be called (with no arguments) whenever changes have been
+        # committed.  Set by the controller.
+        self.on_commit = None
+
     def __del__(self):
         """Clean up when garbage collected if not already closed.
 
@@ -187,6 +202,72 @@ class BaseDbWriter(object):
         """
         pass
 
+    def committed(self):
+        """Notify that changes have been committed.
+
+        This should be called by subclasses after each commit has completed,
+        so that readers can be brought up to date.
+
+        """
+        if self.on_commit is not None:
+            self.on_commit()
+
+    def perform_actions(self, actions):
+        """Perform a batch of actions taken from the writer's queue.
+
+        Called by the writer thread with all the actions which were waiting in
+        the queue (up to a limit).  Subclasses may override this to combine
+        actions; the default implementation performs each action in turn.
+
+        """
+        for action in actions:
+            action.perform()
+
+    def commit_due_in(self):
+        """Return the number of seconds until uncommitted changes should be
+        committed, or None if there are no uncommitted changes.
+
+        The writer thread calls auto_commit() if this time passes without any
+        further actions being queued; since the queue may never be idle,
+        perform_actions() should also call it after each batch.
+
+        """
+        return None
+
+    def auto_commit(self):
+        """Commit changes if a commit is due.
+
+        """
+        pass
+
+    def get_commit_policy(self):
+        """Get the policy for automatically committing changes.
+
+        Returns a dictionary with the following items:
+
+         - `max_docs`: the number of changed documents after which changes are
+           committed, or None.
+         - `max_seconds`: the number of seconds after the first uncommitted
+           change at which changes are committed, or None.
+
+        """
+        raise NotImplementedError
+
+    def set_commit_policy(self, policy):
+        """Set the policy for automatically committing changes.
+
+        `policy` is a dictionary in the form returned by get_commit_policy().
+        Missing items are left unchanged.
+
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """Get a dictionary of statistics about the writer.
+
+        """
+        return {}
+
     def set_schema(self, schema):
         """Set the schema for the database.
 
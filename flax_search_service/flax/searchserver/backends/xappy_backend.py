@@ -27,13 +27,20 @@ from base_backend import BaseBackend, BaseDbReader, BaseDbWriter
 from flax.searchserver import schema, utils, queries
 
 # Global modules
+import logging
 import Queue
+import time
 import wsgiwapi
 import xapian
 import xappy
 
 # The metadata key used to hold schemas.
-SCHEMA_KEY = "_flax_schema"
+SCHEMA_KEY = schema.SCHEMA_KEY
+
+# The metadata key used to hold the commit policy for a database.
+COMMIT_POLICY_KEY = "_flax_commit_policy"
+
+log = logging.getLogger('flax.searchserver.xappy')
 
 op_convert = {
     queries.Query.AND: xappy.SearchConnection.OP_AND,
@@ -105,7 +112,15 @@ class Backend(BaseBackend):
 
     Settings for this backend can be specified in the settings.py module by
     adding a 'xappy' entry to the 'backend_settings' dict.  They will be
-    available in self.settings.
+    available in self.settings.  The following settings are used:
+
+     - `commit_docs`: the default number of changed documents after which
+       changes are committed (default 1000).
+     - `commit_seconds`: the default number of seconds after the first
+       uncommitted change at which changes are committed (default 5).
+
+    The defaults may be overridden for each database by setting its commit
+    policy.
 
     """
     def version_info(self):
@@ -144,7 +159,9 @@ class Backend(BaseBackend):
         There should only be one of these in existence at any one time (per DB).
 
         """
-        return DbWriter(base_uri, db_path)
+        return DbWriter(base_uri, db_path,
+                        self.settings.get('commit_docs', 1000),
+                        self.settings.get('commit_seconds', 5.0))
 
 class DbReader(BaseDbReader):
     """A reader obtined by Backend.get_db_reader().
@@ -174,6 +191,13 @@ class DbReader(BaseDbReader):
             self._sconn.close()
             self._sconn = None
 
+    def reopen(self):
+        """Reopen the search connection to get the latest revision.
+
+        """
+        if self._sconn is not None:
+            self._sconn.reopen()
+
     def get_info(self):
         """Get information about the database.
 
@@ -288,12 +312,19 @@ class DbReader(BaseDbReader):
 
 
 class DbWriter(BaseDbWriter):
-    """A reader obtined by Backend.get_db_reader().
+    """A writer obtained by Backend.get_db_writer().
+
+    Changes are committed automatically, once `max_docs` documents have been
+    changed or `max_seconds` seconds after the first uncommitted change,
+    whichever comes first.
 
     """
-    def __init__(self, base_uri, db_path):
+    def __init__(self, base_uri, db_path, max_docs=1000, max_seconds=5.0):
         """Create a database writer for the specified path.
 
+        `max_docs` and `max_seconds` give the default commit policy, which is
+        overridden by any policy stored in the database.
+
         """
         BaseDbWriter.__init__(self, base_uri, db_path)
         self.queue = Queue.Queue(1000)
@@ -305,12 +336,201 @@ class DbWriter(BaseDbWriter):
             self.queue.join = nop
         self.iconn = xappy.IndexerConnection(self.db_path)
 
+        self.max_docs = max_docs
+        self.max_seconds = max_seconds
+        data = self.iconn.get_metadata(COMMIT_POLICY_KEY)
+        if data:
+            self._apply_commit_policy(utils.json.loads(data))
+
+        # Number of changes since the last commit, and the time of the first.
+        self.pending = 0
+        self.pending_since = None
+
+        # Counters, for monitoring.
+        self.commit_count = 0
+        self.commit_seconds = 0.0
+        self.committed_docs = 0
+        self.coalesced_docs = 0
+        self.failed_actions = 0
+        self.last_commit = None
+
     def close(self):
         """Close any open database connections.
 
         """
         self.iconn.close()
 
+    def perform_actions(self, actions):
+        """Perform a batch of actions taken from the queue.
+
+        Consecutive document additions and deletions are performed together,
+        skipping any which are superseded by a later change to the same
+        document in the batch.  Changes are then committed if the commit
+        policy requires it (by number of documents or by time, so that a
+        queue which is never idle still gets committed).
+
+        An action which fails is logged and counted, and the rest of the batch
+        is still performed.
+
+        """
+        docactions = []
+        for action in actions:
+            if isinstance(action, DbWriter.DocumentAction):
+                docactions.append(action)
+                continue
+            self._perform_document_actions(docactions)
+            docactions = []
+            if self._perform(action) and getattr(action, 'modifies', False):
+                self._add_pending(1)
+        self._perform_document_actions(docactions)
+
+        if self.max_docs and self.pending >= self.max_docs:
+            self.commit()
+        # check the time too, as the writer thread only calls auto_commit()
+        # itself when the queue is idle
+        self.auto_commit()
+
+    def _perform_document_actions(self, docactions):
+        """Perform a list of document actions, skipping any which are
+        superseded by later actions on the same document ID.
+
+        """
+        if not docactions:
+            return
+        last = {}
+        for pos, action in enumerate(docactions):
+            if action.docid is not None:
+                last[action.docid] = pos
+        performed = skipped = 0
+        for pos, action in enumerate(docactions):
+            if action.docid is not None and last[action.docid] != pos:
+                skipped += 1
+                continue
+            if self._perform(action):
+                performed += 1
+        self.coalesced_docs += skipped
+        self._add_pending(performed)
+
+    def _perform(self, action):
+        """Perform a single action, returning True if it succeeded.
+
+        A failure is logged and counted rather than raised, so that one bad
+        document doesn't stop the writer thread or lose the rest of a batch.
+
+        """
+        try:
+            action.perform()
+        except Exception:
+            self.failed_actions += 1
+            log.exception("Failed to perform %s", action)
+            return False
+        return True
+
+    def _add_pending(self, count):
+        """Record that `count` uncommitted changes have been made.
+
+        """
+        if count == 0:
+            return
+        if self.pending == 0:
+            self.pending_since = time.time()
+        self.pending += count
+
+    def commit(self):
+        """Commit changes to the database now.
+
+        This must only be called from the writer thread.
+
+        """
+        docs = self.pending
+        start = time.time()
+        self.iconn.flush()
+        end = time.time()
+        self.pending = 0
+        self.pending_since = None
+
+        self.commit_count += 1
+        self.commit_seconds += end - start
+        self.committed_docs += docs
+        self.last_commit = {
+            'time': end,
+            'docs': docs,
+            'seconds': end - start,
+        }
+        log.info("Committed %d changes to %s in %.3fs",
+                 docs, self.db_path, end - start)
+        self.committed()
+
+    def commit_due_in(self):
+        """Return the number of seconds until a commit is due.
+
+        """
+        if self.pending == 0 or not self.max_seconds:
+            return None
+        return max(0, self.pending_since + self.max_seconds - time.time())
+
+    def auto_commit(self):
+        """Commit changes if the commit policy requires it.
+
+        """
+        due = self.commit_due_in()
+        if due is not None and due <= 0:
+            self.commit()
+
+    def get_commit_policy(self):
+        """Get the policy for automatically committing changes.
+
+        """
+        return {
+            'max_docs': self.max_docs,
+            'max_seconds': self.max_seconds,
+        }
+
+    def set_commit_policy(self, policy):
+        """Set the policy for automatically committing changes.
+
+        The new policy takes effect immediately, and is stored in the database
+        asynchronously.
+
+        """
+        self._apply_commit_policy(policy)
+        self.set_metadata(COMMIT_POLICY_KEY, self.get_commit_policy())
+
+    def _apply_commit_policy(self, policy):
+        """Check and apply a commit policy.
+
+        """
+        if not isinstance(policy, dict):
+            raise wsgiwapi.HTTPError(400, "Commit policy must be an object")
+        for key, value in policy.iteritems():
+            if key not in ('max_docs', 'max_seconds'):
+                raise wsgiwapi.HTTPError(400, "Invalid commit policy item "
+                                         "(%s)" % key)
+            if value is not None and (not isinstance(value, (int, long, float))
+                                      or isinstance(value, bool)
+                                      or value < 0):
+                raise wsgiwapi.HTTPError(400, "Invalid value (%s) for commit "
+                                         "policy item (%s)" % (value, key))
+        if 'max_docs' in policy:
+            self.max_docs = policy['max_docs']
+        if 'max_seconds' in policy:
+            self.max_seconds = policy['max_seconds']
+
+    def stats(self):
+        """Get a dictionary of statistics about the writer.
+
+        """
+        return {
+            'queued': self.queue.qsize(),
+            'pending': self.pending,
+            'commits': self.commit_count,
+            'commit_seconds': self.commit_seconds,
+            'committed_docs': self.committed_docs,
+            'coalesced_docs': self.coalesced_docs,
+            'failed_actions': self.failed_actions,
+            'last_commit': self.last_commit,
+        }
+
     def set_schema(self, schema):
         """Set the schema for this database.
 
@@ -356,6 +576,8 @@ class DbWriter(BaseDbWriter):
         """Action to set the schema for a Xappy database.
 
         """
+        modifies = True
+
         def __init__(self, db_writer, schema):
             self.db_writer = db_writer
             self.schema = schema
@@ -368,7 +590,17 @@ class DbWriter(BaseDbWriter):
             return 'SetSchemaAction(%s)' % self.db_writer.db_path
 
 
-    class AddDocumentAction(object):
+    class DocumentAction(object):
+        """Base class for actions which change a single document.
+
+        `docid` is the ID of the document changed, or None if a new document
+        is being added.
+
+        """
+        modifies = True
+        docid = None
+
+    class AddDocumentAction(DocumentAction):
         """Action to add a document to a Xappy database.
 
         """
@@ -395,7 +627,7 @@ class DbWriter(BaseDbWriter):
         def __str__(self):
             return 'AddDocumentAction(%s)' % self.db_writer.db_path
 
-    class DeleteDocumentAction(object):
+    class DeleteDocumentAction(DocumentAction):
         """Action to delete a document from a Xappy database.
 
         """
@@ -413,11 +645,13 @@ class DbWriter(BaseDbWriter):
         """Action to flush changes to the database so they can be searched.
 
         """
+        modifies = False
+
         def __init__(self, db_writer):
             self.db_writer = db_writer
 
         def perform(self):
-            self.db_writer.iconn.flush()
+            self.db_writer.commit()
 
         def __str__(self):
             return 'CommitAction(%s)' % self.db_writer.db_path
@@ -426,6 +660,8 @@ class DbWriter(BaseDbWriter):
         """Action to set a piece of metadata.
         
         """
+        modifies = True
+
         def __init__(self, db_writer, key, data):
             self.db_writer = db_writer
             self.key = key
@@ -27,14 +27,21 @@ __docformat__ = "restructuredtext en"
 
 # Local modules
 import backends
+import resultcache
+import schema
 import utils
 
 # Global modules
+import logging
 import os
+import Queue
 import shutil
 import threading
+import time
 import wsgiwapi
 
+log = logging.getLogger('flax.searchserver.controller')
+
 def synchronised(fn):
     """Decorator to ensure that a call is only performed with the lock held.
 
@@ -82,14 +89,30 @@ class InfoFile(object):
         os.rename(tmppath, infopath)
 
 class Controller(object):
-    def __init__(self, base_uri, dbs_path, backend_settings, settings_db):
+    def __init__(self, base_uri, dbs_path, backend_settings, settings_db,
+                 reader_pool_size=10, reader_idle_time=60.0,
+                 reader_check_interval=1.0, result_cache_size=0,
+                 template_contexts=10):
         """Set up the controller.
 
+         - `reader_pool_size` is the maximum number of idle readers to keep
+           open for each database.
+         - `reader_idle_time` is the number of seconds after which an unused
+           reader is closed.
+         - `reader_check_interval` is the maximum number of seconds between
+           checks for stale and idle readers.
+         - `result_cache_size` is the maximum size, in bytes, of the cache of
+           search results.  0 disables the cache.
+         - `template_contexts` is the maximum number of javascript contexts to
+           keep open for running search templates.
+
         """
         self.base_uri = base_uri
         self.dbs_path = dbs_path
         self.backend_settings = backend_settings
         self.settings_db = settings_db
+        self.reader_pool_size = reader_pool_size
+        self.reader_idle_time = reader_idle_time
 
         # Lock which should be held when trying to create or delete a database,
         # or start or stop a database writer thread.
@@ -101,6 +124,38 @@ class Controller(object):
         # Dictionary of writer threads
         self.writer_threads = {}
 
+        # Dictionary of reader pools
+        self.reader_pools = {}
+
+        # Number of reader pools created, used to tell apart pools for
+        # databases which have been deleted and recreated.
+        self.pool_generation = 0
+
+        # Cache of search results.
+        self.result_cache = resultcache.ResultCache(result_cache_size)
+
+        # Evaluator for javascript search templates - created when first
+        # needed, since the javascript engine is an optional dependency.
+        self.template_contexts = template_contexts
+        self.template_evaluator = None
+
+        # Dictionary of cached schemas.  Schemas are only changed through
+        # set_schema(), so a cached schema stays valid until replaced there.
+        self.schemas = {}
+
+        # Number of times the schema has been set for each database, used to
+        # avoid caching a schema which was read while being changed.
+        self.schema_versions = {}
+
+        # Lock which should be held when accessing the schema cache.
+        self.schema_mutex = threading.Lock()
+
+        # Thread which reopens stale readers, and closes idle ones.
+        self.reader_thread = ReaderMaintenanceThread(self,
+                                                     reader_check_interval)
+        self.reader_thread.setDaemon(True)
+        self.reader_thread.start()
+
     def db_names(self):
         """Get a list of the database names.
 
@@ -149,11 +204,244 @@ class Controller(object):
         Raises an HTTPError if the database is not found, or the database
         backend does not exist.
 
-        The close() method of the returned database should be called after use.
+        The reader is taken from a pool of open readers for the database, and
+        must be handed back with release_db_reader() after use.
+
+        """
+        return self._get_reader_pool(dbname).get()
+
+    def release_db_reader(self, dbname, reader):
+        """Return a reader obtained from get_db_reader() to its pool.
+
+        The reader is always returned to the pool which opened it.  If the
+        database has been deleted or recreated since the reader was handed
+        out, that pool is no longer current, and the reader is closed.
+
+        """
+        pool = reader.pool
+        if self.reader_pools.get(dbname) is pool:
+            pool.release(reader)
+        else:
+            pool.discard(reader)
+
+    def _get_reader_pool(self, dbname):
+        """Get or create the reader pool for the named database.
+
+        """
+        # First, check for the pool without the lock
+        pool = self.reader_pools.get(dbname)
+        if pool is not None:
+            return pool
+
+        self.mutex.acquire()
+        try:
+            # check again to avoid race conditions
+            pool = self.reader_pools.get(dbname)
+            if pool is not None:
+                return pool
+
+            dbpath, backend = self.get_path_and_backend(dbname)
+            self.pool_generation += 1
+            pool = ReaderPool(backend, self.base_uri + 'dbs/' + dbname, dbpath,
+                              self.reader_pool_size, self.pool_generation)
+            self.reader_pools[dbname] = pool
+            return pool
+        finally:
+            self.mutex.release()
+
+    def search(self, dbname, search):
+        """Perform a search on the named database.
+
+        Results are cached, keyed by the revision of the database and the
+        search, so the returned object is shared between requests and must not
+        be modified.
+
+        """
+        pool = self._get_reader_pool(dbname)
+        key = search.cache_key()
+        result = self.result_cache.get(dbname, pool.cache_revision(), key)
+        if result is not None:
+            return result
+
+        db = pool.get()
+        try:
+            result = db.search(search)
+            revision = pool.cache_revision(db)
+        finally:
+            self.release_db_reader(dbname, db)
+        self.result_cache.set(dbname, revision, key, result)
+        return result
+
+    def result_cache_stats(self):
+        """Get statistics about the search result cache.
+
+        """
+        return self.result_cache.stats()
+
+    def get_template_evaluator(self):
+        """Get the evaluator used to run javascript search templates.
+
+        """
+        evaluator = self.template_evaluator
+        if evaluator is not None:
+            return evaluator
+
+        self.mutex.acquire()
+        try:
+            if self.template_evaluator is None:
+                import jstemplates
+                self.template_evaluator = \
+                    jstemplates.JsTemplateEvaluator(self.template_contexts)
+            return self.template_evaluator
+        finally:
+            self.mutex.release()
+
+    def forget_template(self, dbname, tmplname):
+        """Discard any cached javascript contexts for a template.
+
+        """
+        evaluator = self.template_evaluator
+        if evaluator is not None:
+            evaluator.invalidate((dbname, tmplname))
+
+    def template_stats(self):
+        """Get statistics about the javascript template contexts, or None if
+        no templates have been used.
+
+        """
+        evaluator = self.template_evaluator
+        if evaluator is None:
+            return None
+        return evaluator.stats()
+
+    def get_schema(self, dbname):
+        """Get the schema for the named database.
+
+        The schema is cached, so the returned object is shared between
+        requests and must not be modified - use its copy() method to get a
+        schema to change, and pass that to set_schema().
+
+        """
+        # First, check for the schema without the lock
+        scm = self.schemas.get(dbname)
+        if scm is not None:
+            return scm
+
+        self.schema_mutex.acquire()
+        try:
+            version = self.schema_versions.get(dbname, 0)
+        finally:
+            self.schema_mutex.release()
+
+        db = self.get_db_reader(dbname)
+        try:
+            scm = db.get_schema()
+        finally:
+            self.release_db_reader(dbname, db)
+
+        self.schema_mutex.acquire()
+        try:
+            if self.schema_versions.get(dbname, 0) == version:
+                self.schemas[dbname] = scm
+        finally:
+            self.schema_mutex.release()
+        return scm
+
+    def set_schema(self, dbname, scm):
+        """Set the schema for the named database.
+
+        The schema is written to the database asynchronously by the writer
+        thread, but the cached schema is replaced immediately.
+
+        """
+        dbw = self.get_db_writer(dbname)
+        self.schema_mutex.acquire()
+        try:
+            self.schema_versions[dbname] = self.schema_versions.get(dbname, 0) + 1
+            self.schemas[dbname] = scm
+        finally:
+            self.schema_mutex.release()
+        dbw.set_schema(scm)
+
+    def set_metadata(self, dbname, key, value):
+        """Set a piece of metadata for the named database.
+
+        Setting the metadata holding the schema is passed on to set_schema(),
+        so that the cached schema is replaced.
+
+        """
+        if key == schema.SCHEMA_KEY:
+            if not isinstance(value, dict):
+                raise wsgiwapi.HTTPError(400, "Schema must be an object")
+            self.set_schema(dbname, schema.Schema(value))
+            return
+        self.get_db_writer(dbname).set_metadata(key, value)
+
+    def _forget_schema(self, dbname):
+        """Remove the cached schema for the named database.
+
+        """
+        self.schema_mutex.acquire()
+        try:
+            self.schema_versions[dbname] = self.schema_versions.get(dbname, 0) + 1
+            self.schemas.pop(dbname, None)
+        finally:
+            self.schema_mutex.release()
+
+    def _close_reader_pool(self, dbname):
+        """Close all the pooled readers for the named database.
+
+        The mutex must already be held by the current thread when this is called.
+
+        """
+        pool = self.reader_pools.pop(dbname, None)
+        if pool is not None:
+            pool.close()
+        self.result_cache.forget(dbname)
+
+    def _db_committed(self, dbname):
+        """Called by the writer for a database when it has committed changes.
+
+        Readers on the old revision are reopened by the maintenance thread.
+
+        """
+        pool = self.reader_pools.get(dbname)
+        if pool is not None:
+            pool.new_revision()
+            self.result_cache.forget(dbname, pool.cache_revision())
+            self.reader_thread.wake()
+
+    def maintain_readers(self):
+        """Reopen stale idle readers, and close readers which have been idle
+        for too long.
+
+        """
+        for pool in self.reader_pools.values():
+            pool.maintain(self.reader_idle_time)
+
+    def close(self):
+        """Stop the reader maintenance thread, and close all the reader pools.
+
+        Readers in use are closed when they are released.
+
+        """
+        self.reader_thread.stop()
+        for dbname in self.reader_pools.keys():
+            self._close_reader_pool(dbname)
+
+    def writer_stats(self):
+        """Get statistics about the writers, keyed by database name.
+
+        """
+        return dict((dbname, writer.stats())
+                    for dbname, writer in self.writers.items())
+
+    def reader_stats(self):
+        """Get statistics about the reader pools, keyed by database name.
 
         """
-        dbpath, backend = self.get_path_and_backend(dbname)
-        return backend.get_db_reader(self.base_uri + 'dbs/' + dbname, dbpath)
+        return dict((dbname, pool.stats())
+                    for dbname, pool in self.reader_pools.items())
 
     @synchronised
     def create_db(self, backend_name, dbname, overwrite, reopen):
@@ -173,6 +461,8 @@ class Controller(object):
             if overwrite:
                 # Delete the old database.
                 self._abort_writer(dbname)
+                self._close_reader_pool(dbname)
+                self._forget_schema(dbname)
                 infofile = InfoFile(db_dir)
                 backend = backends.get(infofile.backend_name, self.backend_settings)
                 backend.delete_db(os.path.join(db_dir, 'db'))
@@ -206,6 +496,8 @@ class Controller(object):
                 return
             raise wsgiwapi.HTTPError(400, "Database missing")
         self._abort_writer(dbname)
+        self._close_reader_pool(dbname)
+        self._forget_schema(dbname)
         try:
             infofile = InfoFile(db_dir)
             backend = backends.get(infofile.backend_name, self.backend_settings)
@@ -233,6 +525,7 @@ class Controller(object):
 
             dbpath, backend = self.get_path_and_backend(dbname)
             writer = backend.get_db_writer(self.base_uri + 'dbs/' + dbname, dbpath)
+            writer.on_commit = lambda: self._db_committed(dbname)
             self.writers[dbname] = writer
 
             # start a thread to process the writer's items
@@ -280,8 +573,14 @@ class Controller(object):
 class WriterThread(threading.Thread):
     """Thread class which takes database actions from its writer's queue and
     performs them.
+
+    Actions are taken from the queue in batches of up to `max_batch`, and
+    passed to the writer together, so that it can combine them.  When the
+    queue is idle, the writer is given the chance to commit any outstanding
+    changes.
     
     """
+    max_batch = 1000
 
     def __init__(self, writer):
         threading.Thread.__init__(self)
@@ -289,12 +588,265 @@ class WriterThread(threading.Thread):
         self.abort = False
         
     def run(self):
+        queue = self.writer.queue
         while not self.abort:
-            action = self.writer.queue.get()
-            # FIXME how to log this? wsgiwapi?
-            action.perform()
-            self.writer.queue.task_done()
+            try:
+                action = queue.get(True, self.writer.commit_due_in())
+            except Queue.Empty:
+                try:
+                    self.writer.auto_commit()
+                except Exception:
+                    log.exception("Failed to commit %s", self.writer.db_path)
+                continue
+
+            actions = [action]
+            try:
+                while len(actions) < self.max_batch:
+                    actions.append(queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            try:
+                if not self.abort:
+                    self.writer.perform_actions(actions)
+            except Exception:
+                # Keep the thread running, so that the queue doesn't fill up
+                # and block every later change to the database.
+                log.exception("Failed to perform actions on %s",
+                              self.writer.db_path)
+            finally:
+                for action in actions:
+                    queue.task_done()
         
+class ReaderPool(object):
+    """A pool of open readers for a single database.
+
+    Each reader is tagged with the revision of the pool at the time it was
+    opened.  When the writer for the database commits, the pool's revision is
+    incremented, and readers with an older tag are reopened before they are
+    handed out again.
+
+    """
+    def __init__(self, backend, base_uri, db_path, max_idle, generation=0):
+        self.backend = backend
+        self.base_uri = base_uri
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.generation = generation
+
+        # Lock which must be held when accessing the pool's state.
+        self.mutex = threading.Lock()
+
+        # The current revision - incremented whenever changes are committed.
+        self.revision = 0
+
+        # List of idle readers, as (reader, revision, time of last use).
+        self.idle = []
+
+        self.in_use = 0
+        self.closed = False
+
+        # Counters, for monitoring.
+        self.open_count = 0
+        self.reopen_count = 0
+        self.close_count = 0
+
+    def get(self):
+        """Get a reader from the pool, opening a new one if none are idle.
+
+        """
+        self.mutex.acquire()
+        try:
+            self.in_use += 1
+            revision = self.revision
+            if self.idle:
+                # Use the most recently used reader, so that unneeded readers
+                # become idle and get closed.
+                reader, reader_revision, last_used = self.idle.pop()
+                if reader_revision == revision:
+                    reader.pool_revision = revision
+                    return reader
+                self.reopen_count += 1
+            else:
+                reader = None
+                self.open_count += 1
+        finally:
+            self.mutex.release()
+
+        try:
+            if reader is None:
+                reader = self.backend.get_db_reader(self.base_uri, self.db_path)
+            else:
+                # The maintenance thread hasn't got to this one yet.
+                reader.reopen()
+        except:
+            self.mutex.acquire()
+            self.in_use -= 1
+            self.mutex.release()
+            raise
+        reader.pool = self
+        reader.pool_revision = revision
+        return reader
+
+    def release(self, reader):
+        """Return a reader to the pool.
+
+        """
+        self.mutex.acquire()
+        try:
+            self.in_use -= 1
+            if not self.closed and len(self.idle) < self.max_idle:
+                self.idle.append((reader, reader.pool_revision, time.time()))
+                return
+            self.close_count += 1
+        finally:
+            self.mutex.release()
+        reader.close()
+
+    def discard(self, reader):
+        """Close a reader obtained from the pool, rather than returning it.
+
+        """
+        self.mutex.acquire()
+        try:
+            self.in_use -= 1
+            self.close_count += 1
+        finally:
+            self.mutex.release()
+        reader.close()
+
+    def new_revision(self):
+        """Mark all currently open readers as stale.
+
+        """
+        self.mutex.acquire()
+        try:
+            self.revision += 1
+        finally:
+            self.mutex.release()
+
+    def cache_revision(self, reader=None):
+        """Get a value identifying the revision of the database, for use in
+        cache keys.
+
+        If `reader` is supplied, the revision it was opened at is returned,
+        otherwise the current revision.
+
+        """
+        if reader is None:
+            return (self.generation, self.revision)
+        return (self.generation, reader.pool_revision)
+
+    def maintain(self, idle_time):
+        """Reopen stale idle readers, and close any which have been idle for
+        longer than `idle_time` seconds.
+
+        """
+        now = time.time()
+        self.mutex.acquire()
+        try:
+            revision = self.revision
+            keep, stale, expired = [], [], []
+            for item in self.idle:
+                if now - item[2] > idle_time:
+                    expired.append(item[0])
+                elif item[1] != revision:
+                    stale.append(item)
+                else:
+                    keep.append(item)
+            self.idle = keep
+            self.close_count += len(expired)
+        finally:
+            self.mutex.release()
+
+        for reader in expired:
+            reader.close()
+
+        for reader, reader_revision, last_used in stale:
+            try:
+                reader.reopen()
+            except:
+                # Drop the reader - a new one will be opened when needed.
+                # FIXME - should log this.
+                reader.close()
+                self.mutex.acquire()
+                self.close_count += 1
+                self.mutex.release()
+                continue
+            reader.pool_revision = revision
+            self.mutex.acquire()
+            try:
+                self.reopen_count += 1
+                self.idle.append((reader, revision, last_used))
+            finally:
+                self.mutex.release()
+
+    def close(self):
+        """Close all idle readers, and any readers in use when released.
+
+        """
+        self.mutex.acquire()
+        try:
+            self.closed = True
+            idle = self.idle
+            self.idle = []
+            self.close_count += len(idle)
+        finally:
+            self.mutex.release()
+        for reader, reader_revision, last_used in idle:
+            reader.close()
+
+    def stats(self):
+        """Get a dictionary of statistics about the pool.
+
+        """
+        self.mutex.acquire()
+        try:
+            return {
+                'revision': self.revision,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'opened': self.open_count,
+                'reopened': self.reopen_count,
+                'closed': self.close_count,
+            }
+        finally:
+            self.mutex.release()
+
+class ReaderMaintenanceThread(threading.Thread):
+    """Thread which periodically calls the controller to maintain its reader
+    pools.
+
+    The thread is also woken whenever a writer commits, so that readers are
+    reopened in the background rather than by the next request.
+
+    """
+    def __init__(self, controller, interval):
+        threading.Thread.__init__(self)
+        self.controller = controller
+        self.interval = interval
+        self.event = threading.Event()
+        self.abort = False
+
+    def wake(self):
+        self.event.set()
+
+    def stop(self):
+        """Stop the thread, and wait for it to finish.
+
+        """
+        self.abort = True
+        self.event.set()
+        self.join()
+
+    def run(self):
+        while not self.abort:
+            self.event.wait(self.interval)
+            self.event.clear()
+            if self.abort:
+                break
+            self.controller.maintain_readers()
+
 class PassAction(object):
     """A database action which does nothing, to wake up the thread if it's blocking
     on the queue.
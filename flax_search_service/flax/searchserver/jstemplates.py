@@ -23,9 +23,12 @@ r"""Evaluation of javascript templates.
 __docformat__ = "restructuredtext en"
 
 # Global modules
+import re
+import threading
 import wsgiwapi
 import spidermonkey
 import queries
+import utils
 
 class JsHttpError(object):
     """Class used for reporting Http errors from javascript.
@@ -45,26 +48,260 @@ def access_checker(obj, name):
         # FIXME - should log this somewhere.
         return False
 
+# Javascript wrapping a template in a function, so that each run gets its own
+# scope for "params" and for the variables and functions the template
+# declares.  The function is compiled once per context, with the template's
+# last statement turned into its return value (see template_function()).
+_TEMPLATE_JS = '(function (params) {\n%s\n})'
+
+# Wrapper used for templates whose last statement can't simply be returned:
+# the template is evaluated with eval(), which gives the value of its last
+# statement, but is parsed again on every run.
+_EVAL_TEMPLATE_JS = '(function (params) { return eval(%s); })'
+
+# Keywords which start statements that can't follow "return".
+_STATEMENT_KEYWORDS = frozenset((
+    'break', 'case', 'catch', 'const', 'continue', 'debugger', 'default',
+    'do', 'else', 'finally', 'for', 'function', 'if', 'let', 'return',
+    'switch', 'throw', 'try', 'var', 'while', 'with',
+))
+
+# Keywords which can't end a statement, so a line break after them never ends
+# one.
+_OPEN_KEYWORDS = _STATEMENT_KEYWORDS.union((
+    'delete', 'in', 'instanceof', 'new', 'typeof', 'void',
+)).difference(('break', 'continue', 'debugger', 'return'))
+
+# Keywords whose parenthesised part is followed by the rest of the statement.
+_CONTROL_KEYWORDS = frozenset(('for', 'if', 'while', 'with'))
+
+# Keywords after which a "/" starts a regular expression, not a division.
+_REGEX_KEYWORDS = _OPEN_KEYWORDS.union(('return', 'throw'))
+
+_NAME_RE = re.compile(r'[A-Za-z_$][\w$]*|\d[\w.]*|\.\d[\w.]*')
+_PUNCT_RE = re.compile(r'>>>=?|[=!]==|<<=|>>=|\+\+|--|&&|\|\||[-+*/%&|^<>=!]=|'
+                       r'<<|>>|[^\s\w$]')
+_REGEX_RE = re.compile(r'/(?:[^\\/\[\n]|\\.|\[(?:[^\\\]\n]|\\.)*\])+/[\w$]*')
+
+def _js_tokens(source):
+    """Split javascript source into tokens, skipping comments.
+
+    Yields (kind, text, start, newline) tuples, where kind is 'name' (for
+    identifiers, keywords and numbers), 'string', 'regex' or 'punct', start is
+    the offset of the token, and newline is True if there is a line break
+    between the token and the previous one.  Raises ValueError if the source
+    can't be split.
+
+    """
+    pos = 0
+    newline = False
+    prev = None
+    while pos < len(source):
+        c = source[pos]
+        if c in '\n\r':
+            newline = True
+            pos += 1
+            continue
+        if c.isspace():
+            pos += 1
+            continue
+        if source.startswith('//', pos):
+            end = source.find('\n', pos)
+            pos = (end == -1) and len(source) or end
+            continue
+        if source.startswith('/*', pos):
+            end = source.find('*/', pos + 2)
+            if end == -1:
+                raise ValueError("Unterminated comment")
+            newline = newline or '\n' in source[pos:end]
+            pos = end + 2
+            continue
+
+        if c in '"\'':
+            end = pos + 1
+            while end < len(source) and source[end] != c:
+                if source[end] == '\n':
+                    break
+                end += (source[end] == '\\') and 2 or 1
+            if end >= len(source) or source[end] != c:
+                raise ValueError("Unterminated string")
+            token = ('string', source[pos:end + 1])
+        elif c == '/' and (prev is None or
+                           (prev[0] == 'punct' and prev[1] not in ')]}') or
+                           (prev[0] == 'name' and prev[1] in _REGEX_KEYWORDS)):
+            match = _REGEX_RE.match(source, pos)
+            if match is None:
+                raise ValueError("Unterminated regular expression")
+            token = ('regex', match.group())
+        else:
+            match = _NAME_RE.match(source, pos) or _PUNCT_RE.match(source, pos)
+            if match is None:
+                raise ValueError("Unexpected character")
+            token = (match.re is _NAME_RE and 'name' or 'punct', match.group())
+        yield token + (pos, newline)
+        prev = token
+        pos += len(token[1])
+        newline = False
+
+def _last_statement(source):
+    """Find the offset in a template at which its last statement starts.
+
+    Returns None if the template is empty, and raises ValueError if the last
+    statement can't be found reliably, or can't follow "return".
+
+    """
+    start = None
+    depth = 0
+    # Whether each open bracket belongs to if/for/while/with.
+    control = []
+    prev = prev_control = None
+    tokens = list(_js_tokens(source))
+    for pos, (kind, text, offset, newline) in enumerate(tokens):
+        begins = kind != 'punct' or text in ('!', '~', '{', '++', '--')
+        if depth == 0 and (prev is None or
+                           (prev[1] == ';' and prev[0] == 'punct') or
+                           (begins and prev == ('punct', '}')) or
+                           (begins and newline and _ends_statement(prev,
+                                                                 prev_control))):
+            start = pos
+        prev_control = False
+        if kind == 'punct' and text in '([{':
+            control.append(text == '(' and prev is not None and
+                           prev[1] in _CONTROL_KEYWORDS)
+            depth += 1
+        elif kind == 'punct' and text in ')]}':
+            if depth == 0:
+                raise ValueError("Unbalanced brackets")
+            prev_control = control.pop()
+            depth -= 1
+        prev = (kind, text)
+    if depth != 0:
+        raise ValueError("Unbalanced brackets")
+    if start is None:
+        return None
+
+    kind, text = tokens[start][:2]
+    if kind == 'name' and text in _STATEMENT_KEYWORDS:
+        raise ValueError("Last statement is a %s statement" % text)
+    if text == '{':
+        raise ValueError("Last statement is a block")
+    if kind == 'name' and start + 1 < len(tokens) and \
+       tokens[start + 1][1] == ':':
+        raise ValueError("Last statement is labelled")
+    return tokens[start][2]
+
+def _ends_statement(token, control):
+    """Return True if a line break after `token` can end a statement.
+
+    `control` is True if the token closes the condition of an if, for, while or
+    with statement.
+
+    """
+    kind, text = token
+    if kind == 'name':
+        return text not in _OPEN_KEYWORDS
+    if kind != 'punct':
+        return True
+    if text == ')':
+        return not control
+    return text in (']', '}', '++', '--')
+
+def template_function(source):
+    """Return javascript for a function which runs a template.
+
+    The function takes the template parameters, and returns the value of the
+    template's last statement.  Where possible this is done by returning the
+    last statement directly, so that the template is only parsed when the
+    function is compiled; otherwise the template is run with eval().
+
+    """
+    try:
+        start = _last_statement(source)
+    except ValueError:
+        return _EVAL_TEMPLATE_JS % utils.json.dumps(source)
+    if start is None:
+        return _TEMPLATE_JS % source
+    return _TEMPLATE_JS % (source[:start] + 'return ' + source[start:])
+
+# Javascript returning a function which restores the global object to its
+# state when the context was set up, removing any globals a template assigned
+# without declaring them.
+_RESET_JS = '''(function (global) {
+    var saved = {};
+    for (var name in global) saved[name] = global[name];
+    return function () {
+        for (var name in global)
+            if (!saved.hasOwnProperty(name)) delete global[name];
+        for (var name in saved) global[name] = saved[name];
+    };
+})(this)'''
+
 class JsTemplateEvaluator(object):
-    def __init__(self):
-        self._rt = None
+    """Evaluate javascript search templates.
 
-    @property
-    def rt(self):
-        if self._rt is None:
-            self._rt = spidermonkey.Runtime()
-        return self._rt
+    Setting up a javascript context is much more expensive than running a
+    template in it, so contexts are kept for reuse.  Each context is dedicated
+    to a single template: contexts are keyed by the template's name and a hash
+    of its source, so a context is never reused after the template changes.
+    At most `max_contexts` contexts are open at once; idle contexts for other
+    templates are discarded (least recently used first) to make room for new
+    ones, and if all contexts are in use, callers wait for one to be released.
 
-    def search_template(self, tmpl, params):
-        cx = self.rt.new_context()
-        cx.set_access(access_checker)
+    Each run of a template gets a fresh scope: the template is compiled into a
+    function when its context is created (see template_function()), and any
+    globals it sets are removed after it runs, so nothing is carried over from
+    one run to the next.
 
-        cx.add_global('params', params)
-        for qtype, qtypeobj in queries.query_types:
-            cx.add_global(qtype, qtypeobj)
-        cx.add_global('Search', queries.Search)
-        cx.add_global('HttpError', JsHttpError)
-        res = cx.execute(tmpl)
+    """
+    def __init__(self, max_contexts=10):
+        self.max_contexts = max_contexts
+
+        # Condition which must be held when accessing the evaluator's state,
+        # and which is notified when a context is released.
+        self.cond = threading.Condition()
+
+        # Dictionary of idle contexts, keyed by (name, source hash).  Each item
+        # is a list of (runtime, context, template function, reset function)
+        # tuples.
+        self.idle = {}
+
+        # List of keys of idle contexts, most recently used last.
+        self.idle_order = []
+
+        # Number of contexts currently open (both idle and in use).
+        self.live = 0
+
+        # Number of times each template name has been invalidated.
+        self.generations = {}
+
+        # Counters, for monitoring.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def search_template(self, tmpl, params, name=None):
+        """Run a template, and return the Search it produces.
+
+        `name` identifies the template, and is used with invalidate() to
+        discard contexts when a template is replaced.
+
+        """
+        source = tmpl
+        if isinstance(source, unicode):
+            source = source.encode('utf-8')
+        key = (name, utils.sha_fn(source).hexdigest())
+        jscx, generation = self._get_context(key, tmpl)
+        run, reset = jscx[2:]
+        try:
+            try:
+                res = run(params)
+            finally:
+                reset()
+        except:
+            # Don't reuse a context which may have been left in a bad state.
+            self._discard_context()
+            raise
+        self._release_context(key, jscx, generation)
 
         if isinstance(res, JsHttpError):
             raise wsgiwapi.HTTPError(res.code, body=res.body)
@@ -72,3 +309,139 @@ class JsTemplateEvaluator(object):
             raise wsgiwapi.HTTPError(400, "Template didn't return a Search.")
 
         return res
+
+    def invalidate(self, name):
+        """Discard all contexts for the named template.
+
+        Contexts which are in use are discarded when they are released.
+
+        """
+        self.cond.acquire()
+        try:
+            self.generations[name] = self.generations.get(name, 0) + 1
+            for key in self.idle.keys():
+                if key[0] == name:
+                    self._drop_idle(key)
+        finally:
+            self.cond.release()
+
+    def stats(self):
+        """Get a dictionary of statistics about the evaluator.
+
+        """
+        self.cond.acquire()
+        try:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'live': self.live,
+                'idle': len(self.idle_order),
+                'max_contexts': self.max_contexts,
+            }
+        finally:
+            self.cond.release()
+
+    def _get_context(self, key, tmpl):
+        """Get a context for a template, creating one if necessary.
+
+        Returns a tuple of ((runtime, context, template function, reset
+        function), generation).
+
+        """
+        self.cond.acquire()
+        try:
+            generation = self.generations.get(key[0], 0)
+            while True:
+                contexts = self.idle.get(key)
+                if contexts:
+                    jscx = contexts.pop()
+                    if not contexts:
+                        del self.idle[key]
+                    self.idle_order.remove(key)
+                    self.hits += 1
+                    return jscx, generation
+                if self.live < self.max_contexts:
+                    break
+                if self.idle_order:
+                    # Make room by discarding the least recently used context.
+                    self._drop_idle(self.idle_order[0], 1)
+                    self.evictions += 1
+                    continue
+                self.cond.wait()
+            self.live += 1
+            self.misses += 1
+        finally:
+            self.cond.release()
+
+        try:
+            return self._new_context(tmpl), generation
+        except:
+            self._discard_context()
+            raise
+
+    def _release_context(self, key, jscx, generation):
+        """Return a context obtained from _get_context() for reuse.
+
+        """
+        self.cond.acquire()
+        try:
+            if self.generations.get(key[0], 0) != generation:
+                self.live -= 1
+            else:
+                self.idle.setdefault(key, []).append(jscx)
+                self.idle_order.append(key)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def _discard_context(self):
+        """Discard a context obtained from _get_context().
+
+        """
+        self.cond.acquire()
+        try:
+            self.live -= 1
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def _drop_idle(self, key, count=None):
+        """Drop idle contexts with the given key - all of them, unless `count`
+        is given.
+
+        The condition must be held by the current thread when this is called.
+
+        """
+        contexts = self.idle[key]
+        if count is None:
+            count = len(contexts)
+        del contexts[:count]
+        if not contexts:
+            del self.idle[key]
+        for i in xrange(count):
+            self.idle_order.remove(key)
+        self.live -= count
+        self.cond.notify()
+
+    def _new_context(self, tmpl):
+        """Create a new context for a template, with the query classes
+        available.
+
+        Returns a tuple of (runtime, context, template function, reset
+        function).  Each context gets its own runtime, so that contexts can
+        safely be used by different threads.
+
+        """
+        rt = spidermonkey.Runtime()
+        cx = rt.new_context()
+        cx.set_access(access_checker)
+
+        for qtype, qtypeobj in queries.query_types:
+            cx.add_global(qtype, qtypeobj)
+        cx.add_global('Search', queries.Search)
+        cx.add_global('HttpError', JsHttpError)
+
+        run = cx.execute(template_function(tmpl))
+        reset = cx.execute(_RESET_JS)
+        return rt, cx, run, reset
@@ -39,6 +39,14 @@ class Query(object):
     def __repr__(self):
         return u"Query()"
 
+    def cache_key(self):
+        """Return a hashable value which identifies the query.
+
+        Two queries with the same key will always return the same results.
+
+        """
+        return (self.__class__.__name__,)
+
     # Constants used to represent the operators.
     OR = 0
     AND = 1
@@ -203,6 +211,10 @@ class QueryCombination(Query):
         joinsym = ' ' + Query.opsym(self.op) + ' '
         return '(' + joinsym.join(repr(q) for q in self.subqs) + ')'
 
+    def cache_key(self):
+        return (self.__class__.__name__,
+                tuple(q.cache_key() for q in self.subqs))
+
 class QueryOr(QueryCombination):
     """A query which matches a document if any of its subqueries match.
 
@@ -258,6 +270,9 @@ class QueryMultWeight(Query):
     def __repr__(self):
         return "(%s * %.4g)" % (repr(self.subq), self.mult)
 
+    def cache_key(self):
+        return (self.__class__.__name__, self.subq.cache_key(), self.mult)
+
 class QueryText(Query):
     """A free-text query for a piece of text.
 
@@ -286,6 +301,10 @@ class QueryText(Query):
     def __repr__(self):
         return "QueryText(%r)" % (self.text, )
 
+    def cache_key(self):
+        return (self.__class__.__name__, self.text, _fields_key(self.fields),
+                self.default_op)
+
 class QueryExact(Query):
     """A query which returns documents containing the exact field contents.
 
@@ -308,6 +327,9 @@ class QueryExact(Query):
     def __repr__(self):
         return "QueryExact(%r, %r)" % (self.text, self.fields, )
 
+    def cache_key(self):
+        return (self.__class__.__name__, self.text, _fields_key(self.fields))
+
 class QuerySimilar(Query):
     """A query which returns similar documents to a given set of documents.
 
@@ -334,6 +356,9 @@ class QuerySimilar(Query):
     def __repr__(self):
         return "QuerySimilar(%r)" % (self.ids, )
 
+    def cache_key(self):
+        return (self.__class__.__name__, tuple(self.ids), self.simterms)
+
 class Search(object):
     def __init__(self, query, start_rank, end_rank, percent_cutoff=None,
                  summary_fields=None, summary_maxlen=None, summary_hl=None):
@@ -358,6 +383,27 @@ class Search(object):
             r += ", %d" % self.percent_cutoff
         return "Search(%s)" % r
 
+    def cache_key(self):
+        """Return a hashable value which identifies the search.
+
+        Two searches with the same key will always return the same results
+        from the same revision of a database.
+
+        """
+        percent_cutoff = self.percent_cutoff or None
+        return (self.query.cache_key(), self.start_rank, self.end_rank,
+                percent_cutoff, _fields_key(self.summary_fields),
+                self.summary_maxlen, self.summary_hl)
+
+def _fields_key(fields):
+    """Return a hashable value for a list of field names, ignoring order.
+
+    """
+    if fields is None:
+        return None
+    fields = list(fields)
+    fields.sort()
+    return tuple(fields)
 
 query_types = 'Query,QueryOr,QueryAnd,QueryXor,QueryNot,' \
               'QueryMultWeight,QueryText,' \
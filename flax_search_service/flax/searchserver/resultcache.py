@@ -0,0 +1,160 @@
+# Copyright (c) 2009 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""Cache of search results.
+
+"""
+__docformat__ = "restructuredtext en"
+
+import threading
+
+import utils
+
+class ResultCache(object):
+    """A least-recently-used cache of search results.
+
+    Entries are keyed by database name, database revision and a normalised
+    form of the search.  Since the revision changes whenever changes to the
+    database are committed, entries for older revisions can never be returned;
+    they are dropped by forget() as soon as the revision changes.
+
+    The size of each result is estimated from its JSON serialisation, and the
+    least recently used entries are discarded to keep the total within
+    `max_bytes`.
+
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+        # Lock which must be held when accessing the cache's state.
+        self.mutex = threading.Lock()
+
+        # Dictionary mapping key to entry.  Each entry is a list of
+        # [prev entry, next entry, key, result, size], and the entries form a
+        # circular list in order of use, with the least recently used entry
+        # after self.root.
+        self.entries = {}
+        self.root = root = []
+        root[:] = [root, root, None, None, 0]
+        self.size = 0
+
+        # Counters, for monitoring.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, dbname, revision, key):
+        """Get a cached result, or None if there isn't one.
+
+        """
+        if not self.max_bytes:
+            return None
+        self.mutex.acquire()
+        try:
+            entry = self.entries.get((dbname, revision, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._unlink(entry)
+            self._append(entry)
+            return entry[3]
+        finally:
+            self.mutex.release()
+
+    def set(self, dbname, revision, key, result):
+        """Add a result to the cache.
+
+        Results which are larger than the whole cache are not stored.
+
+        """
+        if not self.max_bytes:
+            return
+        size = len(utils.json.dumps(result))
+        if size > self.max_bytes:
+            return
+        fullkey = (dbname, revision, key)
+        self.mutex.acquire()
+        try:
+            entry = self.entries.get(fullkey)
+            if entry is not None:
+                self._remove(entry)
+            entry = [None, None, fullkey, result, size]
+            self.entries[fullkey] = entry
+            self._append(entry)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(self.root[1])
+                self.evictions += 1
+        finally:
+            self.mutex.release()
+
+    def forget(self, dbname, revision=None):
+        """Drop all entries for a database, except those for `revision`.
+
+        """
+        self.mutex.acquire()
+        try:
+            for entry in self.entries.values():
+                if entry[2][0] == dbname and entry[2][1] != revision:
+                    self._remove(entry)
+        finally:
+            self.mutex.release()
+
+    def stats(self):
+        """Get a dictionary of statistics about the cache.
+
+        """
+        self.mutex.acquire()
+        try:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+            }
+        finally:
+            self.mutex.release()
+
+    def _append(self, entry):
+        """Link an entry in as the most recently used.
+
+        """
+        last = self.root[0]
+        entry[0] = last
+        entry[1] = self.root
+        last[1] = entry
+        self.root[0] = entry
+
+    def _unlink(self, entry):
+        """Unlink an entry from the list.
+
+        """
+        entry[0][1] = entry[1]
+        entry[1][0] = entry[0]
+
+    def _remove(self, entry):
+        """Remove an entry from the cache.
+
+        """
+        self._unlink(entry)
+        del self.entries[entry[2]]
+        self.size -= entry[4]
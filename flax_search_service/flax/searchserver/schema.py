@@ -22,8 +22,12 @@ r"""Schema (fields, groups, default) support for search server.
 """
 __docformat__ = "restructuredtext en"
 
+import copy
 import xappy
 
+# The metadata key used to hold schemas.
+SCHEMA_KEY = "_flax_schema"
+
 class Schema(object):
 
     def __init__(self, dict_data=None):
@@ -46,6 +50,13 @@ class Schema(object):
             'templates': self.templates,
         }
 
+    def copy(self):
+        """Return a copy of the schema, which can be modified without
+        affecting this one.
+
+        """
+        return Schema(copy.deepcopy(self.as_dict()))
+
     def set_field(self, fieldname, fieldprops):
         """Set a field from the name and properties supplied.
 
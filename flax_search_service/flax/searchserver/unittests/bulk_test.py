@@ -0,0 +1,85 @@
+# Copyright (c) 2009 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""Test parsing of bulk document requests.
+
+"""
+__docformat__ = "restructuredtext en"
+
+from harness import *
+
+import StringIO
+from flax.searchserver import utils
+
+class DummyRequest(object):
+    def __init__(self, body, content_length=True):
+        self.environ = {'wsgi.input': StringIO.StringIO(body)}
+        if content_length:
+            self.environ['CONTENT_LENGTH'] = str(len(body))
+
+class BulkTest(TestCase):
+    def test_iter_body_lines(self):
+        body = '{"add": {}}\n\r\n{"delete": "1"}\r\n{"delete": "2"}'
+        for content_length in (True, False):
+            for chunk_size in (1, 3, 1000):
+                req = DummyRequest(body, content_length)
+                self.assertEqual(list(utils.iter_body_lines(req, chunk_size)),
+                                 ['{"add": {}}', '', '{"delete": "1"}',
+                                  '{"delete": "2"}'])
+
+    def test_content_length(self):
+        # Input beyond the content length must not be read.
+        req = DummyRequest('{"delete": "1"}\nGARBAGE')
+        req.environ['CONTENT_LENGTH'] = '16'
+        self.assertEqual(list(utils.iter_body_lines(req, 5)),
+                         ['{"delete": "1"}'])
+
+    def test_parse_bulk_operation(self):
+        parse = utils.parse_bulk_operation
+        self.assertEqual(parse('{"add": {"title": "foo"}}'),
+                         ('add', {'title': 'foo'}, None))
+        self.assertEqual(parse('{"add": {"title": "foo"}, "id": "a1"}'),
+                         ('add', {'title': 'foo'}, 'a1'))
+        self.assertEqual(parse('{"delete": 12}'), ('delete', None, '12'))
+        for line in ('', '[]', '{"add": []}', '{"update": {}}',
+                     '{"delete": ""}', '{"delete": null}',
+                     '{"delete": "1", "id": "2"}',
+                     '{"add": {}, "extra": 1}'):
+            self.assertRaises(ValueError, parse, line)
+
+    def test_field_values(self):
+        parse = utils.parse_bulk_operation
+        fields = set(['title', 'size'])
+        line = '{"add": {"title": ["foo", "bar"], "size": 1.5}}'
+        self.assertEqual(parse(line, fields),
+                         ('add', {'title': ['foo', 'bar'], 'size': 1.5}, None))
+        for line in ('{"add": {"title": {"nested": "dict"}}}',
+                     '{"add": {"title": ["foo", ["bar"]]}}',
+                     '{"add": {"title": null}}',
+                     '{"add": {"size": true}}',
+                     '{"add": {"colour": "red"}}'):
+            self.assertRaises(ValueError, parse, line, fields)
+
+        # Without a schema, any field names are accepted.
+        self.assertEqual(parse('{"add": {"colour": "red"}}'),
+                         ('add', {'colour': 'red'}, None))
+        self.assertRaises(ValueError, parse, '{"add": {"colour": {}}}')
+
+if __name__ == '__main__':
+    main()
@@ -46,5 +46,94 @@ class JSQueryTemplateTest(TestCase):
         s = evaluator.search_template('q = QueryText("foo"); Search(q, 0, 0)', {})
         self.assertEqual(unicode(s), u'Search(QueryText(u\'foo\'), 0, 0)')
 
+    def test_context_reuse(self):
+        evaluator = jstemplates.JsTemplateEvaluator()
+        tmpl = 'Search(QueryText(params.q[0]), 0, 10)'
+        s = evaluator.search_template(tmpl, {'q': [u'foo']}, name='t')
+        self.assertEqual(unicode(s), u'Search(QueryText(u\'foo\'), 0, 10)')
+        s = evaluator.search_template(tmpl, {'q': [u'bar']}, name='t')
+        self.assertEqual(unicode(s), u'Search(QueryText(u\'bar\'), 0, 10)')
+        stats = evaluator.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+        # A changed template gets a new context.
+        s = evaluator.search_template('Search(Query(), 0, 0)', {}, name='t')
+        self.assertEqual(evaluator.stats()['misses'], 2)
+
+        # Invalidating a template discards its contexts.
+        evaluator.invalidate('t')
+        self.assertEqual(evaluator.stats()['live'], 0)
+        evaluator.search_template(tmpl, {'q': [u'foo']}, name='t')
+        self.assertEqual(evaluator.stats()['misses'], 3)
+
+    def test_fresh_scope(self):
+        evaluator = jstemplates.JsTemplateEvaluator()
+        tmpl = ('var n = (typeof leaked == "undefined") ? 0 : 1; '
+                'if (typeof declared != "undefined") n += 2; '
+                'leaked = 1; var declared = 1; Search(Query(), 0, n)')
+        for i in range(2):
+            s = evaluator.search_template(tmpl, {}, name='t')
+            self.assertEqual(unicode(s), u'Search(Query(), 0, 0)')
+        self.assertEqual(evaluator.stats()['hits'], 1)
+
+        # Overwritten globals are restored too.
+        tmpl = ('var n = (Query == null) ? 1 : 0; '
+                'Query = null; Search(QueryText("a"), 0, n)')
+        for i in range(2):
+            s = evaluator.search_template(tmpl, {}, name='u')
+            self.assertEqual(unicode(s), u'Search(QueryText(u\'a\'), 0, 0)')
+
+    def test_template_function(self):
+        # The last statement is returned directly, so the template is only
+        # parsed when the function is compiled, not by eval() on each run.
+        for tmpl, body in (
+            ('Search(Query(), 0, 0)', 'return Search(Query(), 0, 0)'),
+            ('q = QueryText("a;b"); Search(q, 0, 0);',
+             'q = QueryText("a;b"); return Search(q, 0, 0);'),
+            ('var q = QueryText(params.q[0])\n'
+             'Search(q, 0, 10) // comment',
+             'var q = QueryText(params.q[0])\n'
+             'return Search(q, 0, 10) // comment'),
+            ('function f() {\n  return 1;\n}\nSearch(Query(), 0, f())',
+             'function f() {\n  return 1;\n}\nreturn Search(Query(), 0, f())'),
+            ('var n = 1\n  + 2\nSearch(Query(), 0, n)',
+             'var n = 1\n  + 2\nreturn Search(Query(), 0, n)'),
+            ):
+            self.assertEqual(jstemplates.template_function(tmpl),
+                             '(function (params) {\n%s\n})' % body)
+
+        # Templates whose last statement can't be returned fall back to
+        # eval().
+        for tmpl in ('if (params.q) Search(Query(), 0, 0); '
+                     'else Search(Query(), 0, 1)',
+                     'for (var i = 0; i < 3; i++)\n  n = i',
+                     'Search(Query(), 0, 0); var n = 1',
+                     'label: Search(Query(), 0, 0)'):
+            self.assertTrue('eval(' in jstemplates.template_function(tmpl))
+
+        evaluator = jstemplates.JsTemplateEvaluator()
+        tmpl = 'if (params.q) Search(Query(), 0, 0); else Search(Query(), 0, 1)'
+        s = evaluator.search_template(tmpl, {'q': [u'a']})
+        self.assertEqual(unicode(s), u'Search(Query(), 0, 0)')
+        s = evaluator.search_template(tmpl, {})
+        self.assertEqual(unicode(s), u'Search(Query(), 0, 1)')
+
+    def test_compiled_once(self):
+        evaluator = jstemplates.JsTemplateEvaluator()
+        tmpl = 'Search(QueryText(params.q[0]), 0, 10)'
+        evaluator.search_template(tmpl, {'q': [u'foo']}, name='t')
+        (key, contexts), = evaluator.idle.items()
+        run = contexts[0][2]
+        evaluator.search_template(tmpl, {'q': [u'bar']}, name='t')
+        self.assertTrue(evaluator.idle[key][0][2] is run)
+
+    def test_max_contexts(self):
+        evaluator = jstemplates.JsTemplateEvaluator(max_contexts=1)
+        evaluator.search_template('Search(Query(), 0, 0)', {}, name='a')
+        evaluator.search_template('Search(Query(), 0, 1)', {}, name='b')
+        stats = evaluator.stats()
+        self.assertEqual(stats['live'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,163 @@
+# Copyright (c) 2009 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""Test pooling of database readers.
+
+"""
+__docformat__ = "restructuredtext en"
+
+from harness import *
+
+import shutil
+import tempfile
+
+from flax.searchserver import controller
+from flax.searchserver.backends.base_backend import BaseBackend, BaseDbReader
+
+class DummyReader(BaseDbReader):
+    def __init__(self, base_uri, db_path):
+        BaseDbReader.__init__(self, base_uri, db_path)
+        self.reopens = 0
+        self.closed = False
+
+    def reopen(self):
+        self.reopens += 1
+
+    def close(self):
+        self.closed = True
+
+class DummyBackend(BaseBackend):
+    def get_db_reader(self, base_uri, db_path):
+        return DummyReader(base_uri, db_path)
+
+class ReaderPoolTest(TestCase):
+    def setUp(self):
+        self.pool = controller.ReaderPool(DummyBackend({}), 'uri', 'path', 2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_reuse(self):
+        r1 = self.pool.get()
+        self.pool.release(r1)
+        r2 = self.pool.get()
+        self.assertTrue(r1 is r2)
+        r3 = self.pool.get()
+        self.assertFalse(r3 is r2)
+        self.pool.release(r2)
+        self.pool.release(r3)
+        stats = self.pool.stats()
+        self.assertEqual(stats['opened'], 2)
+        self.assertEqual(stats['reopened'], 0)
+        self.assertEqual(stats['idle'], 2)
+        self.assertEqual(stats['in_use'], 0)
+
+    def test_max_idle(self):
+        readers = [self.pool.get() for i in range(3)]
+        for reader in readers:
+            self.pool.release(reader)
+        self.assertEqual(self.pool.stats()['idle'], 2)
+        self.assertTrue(readers[2].closed)
+
+    def test_reopen_on_commit(self):
+        r1 = self.pool.get()
+        self.pool.release(r1)
+        self.pool.new_revision()
+
+        # The maintenance pass reopens stale readers in the background.
+        self.pool.maintain(60)
+        self.assertEqual(r1.reopens, 1)
+        r2 = self.pool.get()
+        self.assertTrue(r1 is r2)
+        self.assertEqual(r2.reopens, 1)
+
+        # Readers in use during a commit are reopened when next handed out.
+        self.pool.new_revision()
+        self.pool.release(r2)
+        r3 = self.pool.get()
+        self.assertTrue(r3 is r1)
+        self.assertEqual(r3.reopens, 2)
+        self.pool.release(r3)
+        self.assertEqual(self.pool.stats()['reopened'], 2)
+
+    def test_reopened_reader_current(self):
+        r1 = self.pool.get()
+        self.pool.release(r1)
+        self.pool.new_revision()
+        self.pool.maintain(60)
+
+        # A reader reopened in the background is tagged with the new
+        # revision, so it isn't reopened again when next used.
+        r2 = self.pool.get()
+        self.assertTrue(r2 is r1)
+        self.assertEqual(self.pool.cache_revision(r2),
+                         self.pool.cache_revision())
+        self.pool.release(r2)
+        r3 = self.pool.get()
+        self.assertTrue(r3 is r1)
+        self.assertEqual(r3.reopens, 1)
+        self.pool.release(r3)
+        self.assertEqual(self.pool.stats()['reopened'], 1)
+
+    def test_idle_close(self):
+        r1 = self.pool.get()
+        self.pool.release(r1)
+        self.pool.maintain(-1)
+        self.assertTrue(r1.closed)
+        stats = self.pool.stats()
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['closed'], 1)
+
+    def test_release_after_close(self):
+        r1 = self.pool.get()
+        self.assertTrue(r1.pool is self.pool)
+        self.pool.close()
+        self.pool.release(r1)
+        self.assertTrue(r1.closed)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_discard(self):
+        r1 = self.pool.get()
+        self.pool.discard(r1)
+        self.assertTrue(r1.closed)
+        stats = self.pool.stats()
+        self.assertEqual(stats['idle'], 0)
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['closed'], 1)
+
+class ControllerCloseTest(TestCase):
+    def test_close(self):
+        dbs_path = tempfile.mkdtemp()
+        try:
+            ctl = controller.Controller('uri/', dbs_path, {}, None,
+                                        reader_check_interval=0.01)
+            pool = controller.ReaderPool(DummyBackend({}), 'uri', 'path', 2)
+            ctl.reader_pools['db'] = pool
+            reader = ctl.get_db_reader('db')
+            ctl.release_db_reader('db', reader)
+            ctl.close()
+            self.assertFalse(ctl.reader_thread.isAlive())
+            self.assertTrue(pool.closed)
+            self.assertTrue(reader.closed)
+            self.assertEqual(ctl.reader_stats(), {})
+        finally:
+            shutil.rmtree(dbs_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# Copyright (c) 2009 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""Test the search result cache.
+
+"""
+__docformat__ = "restructuredtext en"
+
+from harness import *
+
+from flax.searchserver import queries
+from flax.searchserver.resultcache import ResultCache
+
+class ResultCacheTest(TestCase):
+    def test_hit_and_miss(self):
+        cache = ResultCache(1000)
+        self.assertEqual(cache.get('db', 1, 'key'), None)
+        cache.set('db', 1, 'key', {'matches_estimated': 1})
+        self.assertEqual(cache.get('db', 1, 'key'), {'matches_estimated': 1})
+        self.assertEqual(cache.get('db', 2, 'key'), None)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['entries'], 1)
+
+    def test_lru(self):
+        cache = ResultCache(25)
+        cache.set('db', 1, 'a', 'x' * 8)
+        cache.set('db', 1, 'b', 'x' * 8)
+        cache.get('db', 1, 'a')
+        cache.set('db', 1, 'c', 'x' * 8)
+        self.assertEqual(cache.get('db', 1, 'b'), None)
+        self.assertEqual(cache.get('db', 1, 'a'), 'x' * 8)
+        self.assertEqual(cache.get('db', 1, 'c'), 'x' * 8)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['bytes'], 20)
+
+        # Results larger than the cache are not stored.
+        cache.set('db', 1, 'd', 'x' * 40)
+        self.assertEqual(cache.get('db', 1, 'd'), None)
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_forget(self):
+        cache = ResultCache(1000)
+        cache.set('db', 1, 'a', 1)
+        cache.set('db', 2, 'a', 2)
+        cache.set('db2', 1, 'a', 3)
+        cache.forget('db', 2)
+        self.assertEqual(cache.get('db', 1, 'a'), None)
+        self.assertEqual(cache.get('db', 2, 'a'), 2)
+        cache.forget('db')
+        self.assertEqual(cache.get('db', 2, 'a'), None)
+        self.assertEqual(cache.get('db2', 1, 'a'), 3)
+        self.assertEqual(cache.stats()['bytes'], 1)
+
+    def test_search_keys(self):
+        def search(text, fields, summary_fields):
+            return queries.Search(queries.QueryText(text, fields), 0, 10,
+                                  summary_fields=summary_fields)
+        self.assertEqual(search(u'foo', ['a', 'b'], set(['x', 'y'])).cache_key(),
+                         search(u'foo', ['b', 'a'], ['y', 'x']).cache_key())
+        self.assertNotEqual(search(u'foo', None, None).cache_key(),
+                            search(u'foo', ['a'], None).cache_key())
+        q1 = queries.QueryText(u'foo') & queries.QueryExact(u'bar', 'f')
+        q2 = queries.QueryText(u'foo') | queries.QueryExact(u'bar', 'f')
+        self.assertNotEqual(q1.cache_key(), q2.cache_key())
+
+if __name__ == '__main__':
+    main()
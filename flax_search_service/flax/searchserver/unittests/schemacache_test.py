@@ -0,0 +1,104 @@
+# Copyright (c) 2009 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""Test caching of database schemas by the controller.
+
+"""
+__docformat__ = "restructuredtext en"
+
+from harness import *
+
+import shutil
+import tempfile
+
+from flax.searchserver import controller, schema
+from flax.searchserver.backends.base_backend import BaseBackend, \
+     BaseDbReader, BaseDbWriter
+
+class DummyReader(BaseDbReader):
+    def __init__(self, base_uri, db_path, stored):
+        BaseDbReader.__init__(self, base_uri, db_path)
+        self.stored = stored
+
+    def get_schema(self):
+        return schema.Schema(self.stored)
+
+class DummyBackend(BaseBackend):
+    def __init__(self, stored):
+        BaseBackend.__init__(self, {})
+        self.stored = stored
+
+    def get_db_reader(self, base_uri, db_path):
+        return DummyReader(base_uri, db_path, self.stored)
+
+class DummyWriter(BaseDbWriter):
+    def __init__(self):
+        BaseDbWriter.__init__(self, 'uri', 'path')
+        self.schemas = []
+        self.metadata = {}
+
+    def set_schema(self, scm):
+        self.schemas.append(scm)
+
+    def set_metadata(self, key, data):
+        self.metadata[key] = data
+
+class SchemaCacheTest(TestCase):
+    def setUp(self):
+        self.dbs_path = tempfile.mkdtemp()
+        self.controller = controller.Controller('uri/', self.dbs_path, {}, None)
+        self.stored = {'language': 'en'}
+        self.controller.reader_pools['db'] = controller.ReaderPool(
+            DummyBackend(self.stored), 'uri/dbs/db', 'path', 2)
+        self.writer = DummyWriter()
+        self.controller.writers['db'] = self.writer
+
+    def tearDown(self):
+        self.controller.close()
+        shutil.rmtree(self.dbs_path)
+
+    def test_cached(self):
+        scm = self.controller.get_schema('db')
+        self.assertEqual(scm.language, 'en')
+        self.stored['language'] = 'fr'
+        self.assertTrue(self.controller.get_schema('db') is scm)
+
+    def test_set_schema_metadata(self):
+        self.assertEqual(self.controller.get_schema('db').language, 'en')
+
+        # Setting the schema through its metadata key replaces the cached
+        # schema, rather than leaving the old one in place.
+        self.controller.set_metadata('db', schema.SCHEMA_KEY,
+                                     {'language': 'de'})
+        self.assertEqual(self.controller.get_schema('db').language, 'de')
+        self.assertEqual([scm.language for scm in self.writer.schemas],
+                         ['de'])
+        self.assertEqual(self.writer.metadata, {})
+
+        self.assertRaises(wsgiwapi.HTTPError, self.controller.set_metadata,
+                          'db', schema.SCHEMA_KEY, 'de')
+
+    def test_other_metadata(self):
+        scm = self.controller.get_schema('db')
+        self.controller.set_metadata('db', 'colour', 'blue')
+        self.assertEqual(self.writer.metadata, {'colour': 'blue'})
+        self.assertTrue(self.controller.get_schema('db') is scm)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# Copyright (c) 2009 Lemur Consulting Ltd
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+r"""Test batching of actions by the writer thread, and by the Xappy writer.
+
+"""
+__docformat__ = "restructuredtext en"
+
+from harness import *
+
+import os
+import Queue
+import shutil
+import tempfile
+import time
+import xappy
+
+from flax.searchserver import controller
+from flax.searchserver.backends.base_backend import BaseDbWriter
+from flax.searchserver.backends.xappy_backend import DbWriter
+
+class Action(object):
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+
+    def perform(self):
+        self.log.append(self.name)
+
+class FailingAction(object):
+    modifies = True
+    docid = None
+
+    def perform(self):
+        raise ValueError('bad action')
+
+class DummyWriter(BaseDbWriter):
+    def __init__(self, commit_seconds):
+        BaseDbWriter.__init__(self, 'uri', 'path')
+        self.queue = Queue.Queue()
+        self.commit_seconds = commit_seconds
+        self.pending_since = None
+        self.batches = []
+        self.log = []
+        self.commits = 0
+
+    def perform_actions(self, actions):
+        self.batches.append(len(actions))
+        BaseDbWriter.perform_actions(self, actions)
+        if self.pending_since is None:
+            self.pending_since = time.time()
+
+    def commit_due_in(self):
+        if self.pending_since is None:
+            return None
+        return max(0, self.pending_since + self.commit_seconds - time.time())
+
+    def auto_commit(self):
+        self.commits += 1
+        self.pending_since = None
+
+class WriterThreadTest(TestCase):
+    def start(self, writer):
+        thread = controller.WriterThread(writer)
+        thread.setDaemon(True)
+        return thread
+
+    def stop(self, writer, thread):
+        thread.abort = True
+        writer.queue.put(controller.PassAction())
+        thread.join()
+
+    def test_batching(self):
+        writer = DummyWriter(60)
+        for i in range(5):
+            writer.queue.put(Action(writer.log, i))
+        thread = self.start(writer)
+        thread.start()
+        writer.queue.join()
+        self.assertEqual(writer.log, range(5))
+        self.assertEqual(writer.batches, [5])
+        self.stop(writer, thread)
+
+    def test_auto_commit(self):
+        writer = DummyWriter(0.01)
+        thread = self.start(writer)
+        thread.start()
+        writer.queue.put(Action(writer.log, 'a'))
+        writer.queue.join()
+        for i in range(100):
+            if writer.commits:
+                break
+            time.sleep(0.01)
+        self.assertEqual(writer.commits, 1)
+        self.stop(writer, thread)
+
+    def test_failed_batch(self):
+        writer = DummyWriter(60)
+        thread = self.start(writer)
+        thread.start()
+        writer.queue.put(FailingAction())
+        writer.queue.join()
+
+        # The thread is still running after the failure.
+        writer.queue.put(Action(writer.log, 'a'))
+        writer.queue.join()
+        self.assertEqual(writer.log, ['a'])
+        self.stop(writer, thread)
+
+class DbWriterTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dbpath = os.path.join(self.tempdir, 'db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def writer(self, max_docs=None, max_seconds=None):
+        writer = DbWriter('uri', self.dbpath, max_docs, max_seconds)
+        writer.iconn.add_field_action('title',
+                                      xappy.FieldActions.STORE_CONTENT)
+        return writer
+
+    def add(self, writer, title, docid=None):
+        return DbWriter.AddDocumentAction(writer, {'title': title}, docid)
+
+    def test_coalesce(self):
+        writer = self.writer()
+        writer.perform_actions([self.add(writer, 'a', '1'),
+                                self.add(writer, 'b', '2'),
+                                self.add(writer, 'c', '1'),
+                                DbWriter.DeleteDocumentAction(writer, '2'),
+                                self.add(writer, 'd')])
+        self.assertEqual(writer.coalesced_docs, 2)
+        self.assertEqual(writer.pending, 3)
+        writer.commit()
+        writer.close()
+
+        # The last change to each document wins.
+        sconn = xappy.SearchConnection(self.dbpath)
+        self.assertEqual(sconn.get_doccount(), 2)
+        self.assertEqual(sconn.get_document('1').data['title'], ['c'])
+        self.assertRaises(KeyError, sconn.get_document, '2')
+        sconn.close()
+
+    def test_failed_action(self):
+        writer = self.writer()
+        writer.perform_actions([self.add(writer, 'a', '1'),
+                                FailingAction(),
+                                self.add(writer, {'nested': 'dict'}, '2'),
+                                self.add(writer, 'b', '3')])
+        self.assertEqual(writer.stats()['failed_actions'], 2)
+        self.assertEqual(writer.pending, 2)
+        writer.commit()
+        writer.close()
+
+        sconn = xappy.SearchConnection(self.dbpath)
+        self.assertEqual(sconn.get_doccount(), 2)
+        sconn.close()
+
+    def test_max_docs(self):
+        writer = self.writer(max_docs=3)
+        writer.perform_actions([self.add(writer, 'a'), self.add(writer, 'b')])
+        self.assertEqual((writer.commit_count, writer.pending), (0, 2))
+        writer.perform_actions([self.add(writer, 'c')])
+        self.assertEqual((writer.commit_count, writer.pending), (1, 0))
+        self.assertEqual(writer.last_commit['docs'], 3)
+        writer.close()
+
+    def test_max_seconds(self):
+        writer = self.writer(max_seconds=0.05)
+        self.assertEqual(writer.commit_due_in(), None)
+        writer.perform_actions([self.add(writer, 'a')])
+        self.assertEqual(writer.commit_count, 0)
+        self.assertTrue(0 < writer.commit_due_in() <= 0.05)
+
+        # A busy queue is still committed once the time has passed.
+        time.sleep(0.06)
+        writer.perform_actions([self.add(writer, 'b')])
+        self.assertEqual((writer.commit_count, writer.pending), (1, 0))
+        self.assertEqual(writer.commit_due_in(), None)
+        writer.close()
+
+if __name__ == '__main__':
+    main()
@@ -80,3 +80,99 @@ def dbpath_from_urlquoted(dbs_path, dbname_urlquoted):
     """
     filename = dbname_to_filename(dbname_from_urlquoted(dbname_urlquoted))
     return os.path.join(dbs_path, filename)
+
+def iter_body_lines(request, chunk_size=65536):
+    """Iterate over the lines of a request body.
+
+    The body is read from the WSGI input stream in chunks of `chunk_size`
+    bytes, so that large bodies are never held in memory all at once.  Line
+    endings are not included in the lines returned.
+
+    """
+    stream = request.environ['wsgi.input']
+    remaining = request.environ.get('CONTENT_LENGTH')
+    if remaining:
+        remaining = int(remaining)
+    else:
+        # No length given (eg, chunked encoding) - read until end of input.
+        remaining = None
+
+    pending = ''
+    while remaining is None or remaining > 0:
+        if remaining is None:
+            chunk = stream.read(chunk_size)
+        else:
+            chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip('\r')
+    if pending:
+        yield pending.rstrip('\r')
+
+def _is_field_value(value):
+    """Check if a value can be stored in a document field.
+
+    """
+    return isinstance(value, (basestring, int, long, float)) and \
+           not isinstance(value, bool)
+
+def parse_bulk_operation(line, fields=None):
+    """Parse a line of a bulk document request.
+
+    Returns a tuple (action, doc, docid), where action is 'add' or 'delete',
+    doc is the document data for an add (or None), and docid is the document
+    ID (or None for an add with no ID).
+
+    Each field value in a document must be a string or number, or a list of
+    them.  If `fields` is given, it is a collection of the field names in the
+    database's schema, and documents may only contain those fields.
+
+    Raises ValueError if the line isn't a valid operation.
+
+    """
+    op = json.loads(line)
+    if not isinstance(op, dict):
+        raise ValueError("Operation must be a JSON object")
+
+    docid = None
+    if 'add' in op:
+        doc = op['add']
+        if not isinstance(doc, dict):
+            raise ValueError("Document to add must be a JSON object")
+        for field, value in doc.iteritems():
+            if fields is not None and field not in fields:
+                raise ValueError("Unknown field: %r" % field)
+            if isinstance(value, list):
+                valid = all(_is_field_value(item) for item in value)
+            else:
+                valid = _is_field_value(value)
+            if not valid:
+                raise ValueError("Value of field %r must be a string or "
+                                 "number, or a list of them" % field)
+        docid = op.get('id')
+        for key in op:
+            if key not in ('add', 'id'):
+                raise ValueError("Unknown key in add operation: %r" % key)
+        action = 'add'
+    elif 'delete' in op:
+        doc = None
+        docid = op['delete']
+        if len(op) != 1:
+            raise ValueError("Delete operation must contain only the docid")
+        action = 'delete'
+    else:
+        raise ValueError("Operation must be 'add' or 'delete'")
+
+    if docid is not None:
+        if isinstance(docid, (int, long)):
+            docid = unicode(docid)
+        if not isinstance(docid, basestring) or len(docid) == 0:
+            raise ValueError("Document ID must be a non-empty string")
+    elif action == 'delete':
+        raise ValueError("Delete operation requires a document ID")
+    return action, doc, docid
@@ -28,8 +28,15 @@ settings = {
     'data_path': '/tmp/flax/', # Path used to hold data
     'server_bind_address': ('0.0.0.0', 8080), # Address to bind the server to.
     'backend_settings': {
-        'xappy': {},
-    }
+        'xappy': {
+            'commit_docs': 1000, # Changed documents which trigger a commit.
+            'commit_seconds': 5, # Seconds after a change before a commit.
+        },
+    },
+    'reader_pool_size': 10, # Maximum idle readers kept open per database.
+    'reader_idle_time': 60, # Seconds before an idle reader is closed.
+    'result_cache_size': 16 * 1024 * 1024, # Bytes of search results to cache.
+    'template_contexts': 10, # Maximum open javascript template contexts.
 }
 
 # Allow default settings to be overridden with settings in local_settings.py